@@ -3,6 +3,7 @@ import os
 import time
 import json
 import random
+import uuid
 import requests
 from datetime import datetime, date, timedelta
 from pathlib import Path
@@ -38,6 +39,13 @@ PULL_WAIT_SECONDS = int(os.getenv("PULL_WAIT_SECONDS", "20"))
 IDLE_SLEEP_SECONDS = float(os.getenv("IDLE_SLEEP_SECONDS", "1"))
 JITTER_MAX_SECONDS = float(os.getenv("JITTER_MAX_SECONDS", "3"))
 UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "4"))
+# "sync" = /upload clásico | "spool" = /upload/spool (202 + ticket, el backend procesa en segundo plano)
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
+SPOOL_WAIT_SECONDS = float(os.getenv("SPOOL_WAIT_SECONDS", "120"))
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "raw").lower()  # "raw" (cuerpo binario) | "multipart"
+# Archivos >= RESUMABLE_MIN_BYTES se suben por trozos reanudables (0 = nunca)
+RESUMABLE_MIN_BYTES = int(os.getenv("RESUMABLE_MIN_BYTES", str(512 * 1024)))
+RESUMABLE_CHUNK_BYTES = int(os.getenv("RESUMABLE_CHUNK_BYTES", str(256 * 1024)))
 MONITOR_INDEX = int(os.getenv("MONITOR_INDEX", "0"))
 DEBUG_SAVE = os.getenv("DEBUG_SAVE", "0") == "1"
 
@@ -190,28 +198,181 @@ def read_file_after_wait(path: Path, timeout=5.0) -> bytes:
 # =======================
 # API BACKEND (capturas)
 # =======================
-def subir_imagen(img_bytes: bytes, fecha_reporte: date, origen: str = "auto") -> dict:
-    url = f"{SERVER}/api/capturas/upload"
+def esperar_ticket(ticket: str, timeout: float = SPOOL_WAIT_SECONDS) -> dict:
+    """Consulta el estado de un ticket del spool hasta que termine (ok/error) o se agote el tiempo."""
+    url = f"{SERVER}/api/capturas/upload/spool/{ticket}"
+    t0 = time.time()
+    espera = 1.0
+    while time.time() - t0 < timeout:
+        try:
+            r = requests.get(url, timeout=15)
+            if r.status_code == 200:
+                st = r.json()
+                if st.get("estado") == "ok":
+                    log(f"ticket {ticket} procesado:", r.text)
+                    return st
+                if st.get("estado") == "error":
+                    raise RuntimeError(f"ticket {ticket} rechazado: {st.get('detail')}")
+            else:
+                log(f"ticket {ticket} HTTP {r.status_code}:", r.text)
+        except RuntimeError:
+            raise
+        except Exception as e:
+            log(f"ticket {ticket} ERROR:", repr(e))
+        time.sleep(espera)
+        espera = min(espera * 1.5, 10.0)
+    # el archivo ya quedó persistido en el servidor: no se re-sube
+    log(f"ticket {ticket} sigue pendiente tras {timeout:.0f}s; se continúa sin confirmar")
+    return {"ticket": ticket, "estado": "pendiente"}
+
+
+def _offset_servidor(sesion_url: str) -> Optional[int]:
+    """Offset que el servidor ya tiene de la sesión (None si no se pudo consultar)."""
+    try:
+        r = requests.get(sesion_url, timeout=15)
+        if r.status_code == 200:
+            return int(r.json()["offset"])
+        if r.status_code == 404:
+            raise RuntimeError("sesión de upload expirada")
+    except RuntimeError:
+        raise
+    except Exception as e:
+        log("upload-ses offset ERROR:", repr(e))
+    return None
+
+
+def subir_reanudable(img_bytes: bytes, fecha_reporte: date, origen: str = "auto",
+                     idem_key: Optional[str] = None, orden_id: Optional[int] = None) -> dict:
+    """
+    Sube por trozos: si se corta la conexión se pregunta el offset al servidor y se
+    sigue desde ahí, en vez de reenviar el archivo completo.
+    """
+    url = f"{SERVER}/api/capturas/upload/sesiones"
+    data = {
+        "uuid_equipo": UUID_EQUIPO,
+        "fecha_reporte": fecha_reporte.isoformat(),
+        "origen": origen,
+        "size": str(len(img_bytes)),
+    }
+    if idem_key:
+        data["idempotency_key"] = idem_key
+    if orden_id:
+        data["orden_id"] = str(orden_id)
+    r = requests.post(url, data=data, timeout=30)
+    r.raise_for_status()
+    ses = r.json()
+    sesion_url = f"{url}/{ses['session_id']}"
+    chunk = max(1, min(RESUMABLE_CHUNK_BYTES, int(ses.get("chunk_max") or RESUMABLE_CHUNK_BYTES)))
+    log(f"upload-ses {ses['session_id']} ({len(img_bytes)} bytes, trozos de {chunk})")
+
+    offset = 0
+    fallos = 0
+    while offset < len(img_bytes):
+        try:
+            r = requests.put(
+                sesion_url,
+                params={"offset": offset},
+                data=img_bytes[offset:offset + chunk],
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=60,
+            )
+            if r.status_code in (200, 409):
+                offset = int(r.headers.get("Upload-Offset", offset))
+                fallos = 0
+                continue
+            log(f"upload-ses trozo HTTP {r.status_code}:", r.text)
+            if r.status_code in (404, 413):
+                raise RuntimeError(f"sesión de upload rechazada: HTTP {r.status_code}")
+        except RuntimeError:
+            raise
+        except Exception as e:
+            log(f"upload-ses trozo @{offset} ERROR:", repr(e))
+        fallos += 1
+        if fallos > UPLOAD_MAX_RETRIES * 2:
+            raise RuntimeError("upload-ses: demasiados fallos seguidos")
+        time.sleep(min(1.5 ** fallos, 30) + random.uniform(0, 1.0))
+        nuevo = _offset_servidor(sesion_url)
+        if nuevo is not None:
+            offset = nuevo
+
+    for intento in range(1, UPLOAD_MAX_RETRIES + 1):
+        retry_after = 0.0
+        try:
+            r = requests.post(f"{sesion_url}/finalizar", timeout=120)
+            if r.status_code == 200:
+                log("upload-ses OK:", r.text)
+                return r.json()
+            log(f"upload-ses finalizar HTTP {r.status_code}:", r.text)
+            if r.status_code in (429, 503):
+                try:
+                    retry_after = float(r.headers.get("Retry-After", "0"))
+                except ValueError:
+                    retry_after = 0.0
+            elif r.status_code < 500:
+                raise RuntimeError(f"finalizar rechazado: HTTP {r.status_code}")
+        except RuntimeError:
+            raise
+        except Exception as e:
+            # finalizar es idempotente en el servidor: se puede repetir sin duplicar
+            log("upload-ses finalizar ERROR:", repr(e))
+        if intento < UPLOAD_MAX_RETRIES:
+            time.sleep(max(1.5 ** intento, retry_after) + random.uniform(0, 1.5))
+    raise RuntimeError("No se pudo finalizar el upload reanudable.")
+
+
+def subir_imagen(img_bytes: bytes, fecha_reporte: date, origen: str = "auto",
+                 orden_id: Optional[int] = None) -> dict:
+    """Sube la captura; con orden_id el servidor marca la orden como tomada en la misma transacción."""
+    spool = INGEST_MODE == "spool"
+    # una clave por captura: si el servidor ya la aplicó, los reintentos reciben la misma respuesta
+    idem_key = uuid.uuid4().hex
+    if not spool and RESUMABLE_MIN_BYTES and len(img_bytes) >= RESUMABLE_MIN_BYTES:
+        try:
+            return subir_reanudable(img_bytes, fecha_reporte, origen, idem_key=idem_key, orden_id=orden_id)
+        except Exception as e:
+            log("upload reanudable falló, se usa upload directo:", repr(e))
+    url = f"{SERVER}/api/capturas/upload/spool" if spool else f"{SERVER}/api/capturas/upload"
     data = {
         "uuid_equipo": UUID_EQUIPO,
         "fecha_reporte": fecha_reporte.isoformat(),
         "origen": origen,
     }
+    if orden_id:
+        data["orden_id"] = str(orden_id)
     filename = "screenshot.jpg"
     files = {"file": (filename, img_bytes, "image/jpeg")}
+    headers = {"Idempotency-Key": idem_key}
+    if UPLOAD_FORMAT == "raw":
+        # imagen como cuerpo y metadata en la query: el servidor no parsea multipart
+        url = f"{SERVER}/api/capturas/upload/raw"
+        params = {**data, **({"spool": "true"} if spool else {})}
+        headers["Content-Type"] = "image/jpeg"
     backoff = 1.5
     for intento in range(1, UPLOAD_MAX_RETRIES + 1):
+        retry_after = 0.0
         try:
-            r = requests.post(url, data=data, files=files, timeout=60)
+            if UPLOAD_FORMAT == "raw":
+                r = requests.post(url, params=params, data=img_bytes, headers=headers, timeout=60)
+            else:
+                r = requests.post(url, data=data, files=files, headers=headers, timeout=60)
+            if r.status_code == 202 and spool:
+                log("upload encolado:", r.text)
+                return esperar_ticket(r.json()["ticket"])
             if r.status_code == 200:
                 log("upload OK:", r.text)
                 return r.json()
             else:
                 log(f"upload HTTP {r.status_code}:", r.text)
+                if r.status_code in (429, 503):
+                    # servidor saturado: respetar Retry-After si viene
+                    try:
+                        retry_after = float(r.headers.get("Retry-After", "0"))
+                    except ValueError:
+                        retry_after = 0.0
         except Exception as e:
             log("upload ERROR:", repr(e))
         if intento < UPLOAD_MAX_RETRIES:
-            sleep_s = backoff ** intento + random.uniform(0, 1.5)
+            sleep_s = max(backoff ** intento, retry_after) + random.uniform(0, 1.5)
             log(f"reintentando upload en {sleep_s:.1f}s (intento {intento+1}/{UPLOAD_MAX_RETRIES})")
             time.sleep(sleep_s)
     raise RuntimeError("No se pudo subir la imagen después de varios reintentos.")
@@ -373,7 +534,7 @@ def netio_write_items(items: list) -> bool:
 # =======================
 # EJECUCIÓN
 # =======================
-def ejecutar_captura(origen: str, fecha: Optional[date] = None):
+def ejecutar_captura(origen: str, fecha: Optional[date] = None, orden_id: Optional[int] = None):
     if fecha is None:
         fecha = date.today()
     img_bytes = obtener_imagen_bytes()
@@ -384,7 +545,7 @@ def ejecutar_captura(origen: str, fecha: Optional[date] = None):
             log(f"DEBUG_SAVE: escrito {dbg.resolve()}")
         except Exception as e:
             log("DEBUG_SAVE error:", repr(e))
-    return subir_imagen(img_bytes, fecha_reporte=fecha, origen=origen)
+    return subir_imagen(img_bytes, fecha_reporte=fecha, origen=origen, orden_id=orden_id)
 
 def proxima_automatico_str(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -438,15 +599,19 @@ def main():
             orden = pull_orden()
             if orden:
                 log("Orden recibida:", json.dumps(orden))
+                orden_id = int(orden["orden_id"])
+                res = None
                 try:
                     # Comportamiento actual: retoma captura
                     try:
                         fecha_rep = date.fromisoformat(orden.get("fecha_reporte", date.today().isoformat()))
                     except Exception:
                         fecha_rep = date.today()
-                    ejecutar_captura(origen="retoma", fecha=fecha_rep)
+                    res = ejecutar_captura(origen="retoma", fecha=fecha_rep, orden_id=orden_id)
                 finally:
-                    ack_orden(int(orden["orden_id"]))
+                    # el upload ya cerró la orden en su transacción: el ack sobra
+                    if not (res and res.get("orden_tomada")):
+                        ack_orden(orden_id)
             else:
                 # 3) Empuje periódico del estado NETIO
                 t = time.time()
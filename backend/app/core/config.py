@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from pathlib import Path
 import os
 
 
@@ -12,6 +13,66 @@ class Settings(BaseModel):
     tz: str = os.getenv("TZ", "America/Santiago")
     allowed_origins: list[str] = []
 
+    # Pool de procesos para transcodificar imágenes (0 = un worker por núcleo)
+    image_workers: int = int(os.getenv("IMAGE_WORKERS", "0")) or (os.cpu_count() or 1)
+    # Trabajos en vuelo (ejecutando + en cola) antes de responder 503 (0 = workers * 4)
+    image_queue_max: int = int(os.getenv("IMAGE_QUEUE_MAX", "0"))
+    image_retry_after: int = int(os.getenv("IMAGE_RETRY_AFTER", "5"))
+    # Tope duro de bytes por upload y de píxeles por imagen (anti bomba de descompresión)
+    upload_max_bytes: int = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+    image_max_pixels: int = int(os.getenv("IMAGE_MAX_PIXELS", "80000000"))
+    # Segundos que vive una entrada del cache de catálogo (centros/dispositivos por uuid)
+    catalog_ttl: int = int(os.getenv("CATALOG_TTL", "60"))
+    # Vida de las Idempotency-Key de /upload y /{captura_id}/version
+    idempotency_ttl: int = int(os.getenv("IDEMPOTENCY_TTL", str(48 * 3600)))
+    # Máximo de imágenes por llamada a /api/capturas/upload/batch
+    batch_max_items: int = int(os.getenv("UPLOAD_BATCH_MAX_ITEMS", "20"))
+
+    # Spool durable para /api/capturas/upload/spool (montar como volumen en Docker)
+    spool_dir: str = os.getenv("INGEST_SPOOL_DIR", str(Path(__file__).resolve().parents[2] / "spool"))
+    spool_workers: int = int(os.getenv("INGEST_SPOOL_WORKERS", "2"))
+    # Dónde viven los bytes de imagen: fs | s3 | memory | db (db = columnas bytea, como antes)
+    blob_backend: str = os.getenv("BLOB_BACKEND", "fs").lower()
+    blob_dir: str = os.getenv("BLOB_DIR", str(Path(__file__).resolve().parents[2] / "blobs"))
+    blob_s3_bucket: str = os.getenv("BLOB_S3_BUCKET", "")
+    blob_s3_prefix: str = os.getenv("BLOB_S3_PREFIX", "capturas")
+    blob_s3_endpoint: str = os.getenv("BLOB_S3_ENDPOINT", "")  # vacío = AWS; p.ej. http://minio:9000
+    blob_s3_region: str = os.getenv("BLOB_S3_REGION", "")
+    # barrido diario de objetos del store sin fila en imagen_blobs (solo más viejos que esto)
+    blob_sweep_grace_hours: int = int(os.getenv("BLOB_SWEEP_GRACE_HOURS", "24"))
+    # Uploads reanudables por trozos (las sesiones viven en {spool_dir}/sessions)
+    upload_chunk_max: int = int(os.getenv("UPLOAD_CHUNK_MAX", str(1024 * 1024)))
+    upload_session_ttl: int = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+    # Cache en disco de miniaturas: presupuesto en bytes (0 = sin límite) y buckets de tamaño/calidad
+    thumb_cache_max_bytes: int = int(os.getenv("THUMB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+    thumb_widths: list[int] = sorted(int(x) for x in os.getenv("THUMB_WIDTHS", "96,180,360,720,1280,1920").split(","))
+    thumb_qualities: list[int] = sorted(int(x) for x in os.getenv("THUMB_QUALITIES", "50,70,85").split(","))
+    # Precalentado de miniaturas del board del día (al arrancar y tras cada ingest):
+    # variantes (ancho, calidad) y cuántas se generan a la vez como máximo
+    thumb_warm_enabled: bool = os.getenv("THUMB_WARM_ENABLED", "1") in ("1", "true", "yes")
+    thumb_warm_widths: list[int] = sorted(int(x) for x in os.getenv("THUMB_WARM_WIDTHS", "360,720").split(","))
+    thumb_warm_quality: int = int(os.getenv("THUMB_WARM_QUALITY", "70"))
+    thumb_warm_concurrency: int = int(os.getenv("THUMB_WARM_CONCURRENCY", "1"))
+    # Cache en memoria de imágenes codificadas por (version_id, variante): presupuesto total,
+    # tope por objeto y tamaño bajo el cual se admite al primer miss
+    hot_cache_max_bytes: int = int(os.getenv("HOT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    hot_cache_max_item: int = int(os.getenv("HOT_CACHE_MAX_ITEM", str(2 * 1024 * 1024)))
+    hot_cache_small: int = int(os.getenv("HOT_CACHE_SMALL", str(64 * 1024)))
+    # Packfiles con las imágenes de meses archivados (app.jobs.archivar_packs)
+    pack_dir: str = os.getenv("PACK_DIR", str(Path(__file__).resolve().parents[2] / "packs"))
+    # Particiones mensuales de captura_versiones que se mantienen creadas por adelantado
+    partition_months_ahead: int = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    # Retención de captura_versiones (0 días = fase deshabilitada). Corre a las 04:00.
+    # KEEP_DAYS: pasado ese plazo solo se conserva la última versión de cada captura.
+    retention_keep_days: int = int(os.getenv("RETENTION_KEEP_DAYS", "0"))
+    # ARCHIVE_DAYS: pasado ese plazo la versión se re-codifica a calidad de archivo.
+    retention_archive_days: int = int(os.getenv("RETENTION_ARCHIVE_DAYS", "0"))
+    retention_archive_max_w: int = int(os.getenv("RETENTION_ARCHIVE_MAX_W", "1280"))
+    retention_archive_quality: int = int(os.getenv("RETENTION_ARCHIVE_QUALITY", "60"))
+    retention_batch: int = int(os.getenv("RETENTION_BATCH", "100"))
+    retention_pause: float = float(os.getenv("RETENTION_PAUSE", "0.5"))
+    retention_dry_run: bool = os.getenv("RETENTION_DRY_RUN", "0") in ("1", "true", "yes")
+
     def __init__(self, **data):
         super().__init__(**data)
         cors = os.getenv("ALLOWED_ORIGINS", "")
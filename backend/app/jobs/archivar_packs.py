@@ -0,0 +1,166 @@
+# app/jobs/archivar_packs.py
+"""
+Archiva las imágenes de un mes en un packfile (app.services.packs) y libera los blobs.
+
+    python -m app.jobs.archivar_packs --mes 2025-01 [--batch 200] [--pausa 0.2] [--dry-run]
+
+1) Recorre las versiones del mes (una sola partición de captura_versiones) que aún
+   tienen bytes en blob o en la columna legada y los escribe en un pack nuevo
+   capver_YYYY_MM_<sufijo>; versiones con el mismo contenido comparten los bytes.
+2) Con el pack ya publicado (fsync), marca cada versión con archivo_pack y suelta su
+   referencia al blob; los blobs que quedan sin referencias se borran del store y de
+   la BD, y sus thumbs en disco (purge_freed).
+
+Si se corta entre 1) y 2) queda un pack huérfano sin efecto: relanzar crea otro.
+Solo acepta meses ya cerrados.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import func, or_, select, update
+
+from app.db.session import SessionLocal
+from app.models.capturas import CapturaVersion
+from app.services.blobs import purge_freed, release_blobs, version_bytes
+from app.services.images import content_hash
+from app.services.packs import PackWriter
+
+
+def _rango(mes: str) -> tuple[datetime, datetime]:
+    desde = datetime.strptime(mes, "%Y-%m")
+    hasta = desde.replace(year=desde.year + 1, month=1) if desde.month == 12 else desde.replace(month=desde.month + 1)
+    return desde, hasta
+
+
+def _archivables(desde: datetime, hasta: datetime):
+    return (
+        CapturaVersion.tomada_en >= desde,
+        CapturaVersion.tomada_en < hasta,
+        CapturaVersion.archivo_pack.is_(None),
+        or_(CapturaVersion.blob_hash.is_not(None), CapturaVersion.imagen_bytes.is_not(None)),
+    )
+
+
+async def reporte(desde: datetime, hasta: datetime) -> dict:
+    async with SessionLocal() as db:
+        n, peso = (
+            await db.execute(
+                select(func.count(), func.coalesce(func.sum(CapturaVersion.peso_bytes), 0))
+                .where(*_archivables(desde, hasta))
+            )
+        ).one()
+    return {"versiones": n, "bytes": int(peso)}
+
+
+async def empaquetar(writer: PackWriter, desde: datetime, hasta: datetime, batch: int, pausa: float) -> dict[int, str | None]:
+    """Escribe los bytes en el pack; devuelve {version_id: blob_hash original (None si legada)}."""
+    origen: dict[int, str | None] = {}
+    ultimo = 0
+    while True:
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(CapturaVersion.id, CapturaVersion.blob_hash)
+                    .where(*_archivables(desde, hasta), CapturaVersion.id > ultimo)
+                    .order_by(CapturaVersion.id)
+                    .limit(batch)
+                )
+            ).all()
+            if not rows:
+                break
+            for vid, h in rows:
+                ultimo = vid
+                data = await version_bytes(db, vid)
+                if not data:
+                    print(f"[archivar] WARNING versión {vid} sin bytes; se omite", flush=True)
+                    continue
+                await asyncio.to_thread(writer.agregar, vid, data, h or content_hash(data))
+                origen[vid] = h
+        print(f"[archivar] empaquetadas {len(origen)} versiones ({writer.bytes_escritos / 1e6:.1f} MB)", flush=True)
+        await asyncio.sleep(pausa)
+    return origen
+
+
+async def marcar(nombre: str, origen: dict[int, str | None], batch: int, pausa: float) -> dict:
+    res = {"versiones": 0, "blobs_liberados": 0}
+    ids = sorted(origen)
+    for i in range(0, len(ids), batch):
+        async with SessionLocal() as db:
+            soltar = []
+            for vid in ids[i:i + batch]:
+                h = origen[vid]
+                hit = (
+                    await db.execute(
+                        update(CapturaVersion)
+                        .where(
+                            CapturaVersion.id == vid,
+                            CapturaVersion.archivo_pack.is_(None),
+                            # si la compactación u otro proceso la cambió, el pack ya no la representa
+                            CapturaVersion.blob_hash.is_not_distinct_from(h),
+                        )
+                        .values(archivo_pack=nombre, blob_hash=None, imagen_bytes=None)
+                        .returning(CapturaVersion.id)
+                    )
+                ).scalar_one_or_none()
+                if hit is not None:
+                    res["versiones"] += 1
+                    if h:
+                        soltar.append(h)
+            freed = await release_blobs(db, soltar)
+            await db.commit()
+            await purge_freed(db, freed)
+        res["blobs_liberados"] += len(freed)
+        await asyncio.sleep(pausa)
+    return res
+
+
+async def archivar_mes(mes: str, batch: int = 200, pausa: float = 0.2, dry_run: bool = False) -> dict:
+    desde, hasta = _rango(mes)
+    if hasta > datetime.combine(date.today().replace(day=1), datetime.min.time()):
+        raise SystemExit(f"{mes} no es un mes cerrado")
+    if dry_run:
+        informe = {"mes": mes, "dry_run": True, **await reporte(desde, hasta)}
+        print(f"[archivar] {informe}", flush=True)
+        return informe
+
+    t0 = time.perf_counter()
+    nombre = f"capver_{desde:%Y_%m}_{uuid.uuid4().hex[:8]}"
+    writer = PackWriter(nombre)
+    try:
+        origen = await empaquetar(writer, desde, hasta, batch, pausa)
+    except BaseException:
+        writer.descartar()
+        raise
+    if not origen:
+        writer.descartar()
+        print(f"[archivar] {mes}: nada que archivar", flush=True)
+        return {"mes": mes, "versiones": 0}
+    await asyncio.to_thread(writer.cerrar)
+
+    res = await marcar(nombre, origen, batch, pausa)
+    informe = {
+        "mes": mes,
+        "pack": nombre,
+        "bytes_pack": writer.bytes_escritos,
+        **res,
+        "segundos": round(time.perf_counter() - t0, 1),
+    }
+    print(f"[archivar] {informe}", flush=True)
+    return informe
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Archiva las imágenes de un mes en un packfile.")
+    ap.add_argument("--mes", required=True, help="YYYY-MM (mes cerrado)")
+    ap.add_argument("--batch", type=int, default=200, help="versiones por transacción")
+    ap.add_argument("--pausa", type=float, default=0.2, help="segundos entre lotes (baja la carga)")
+    ap.add_argument("--dry-run", action="store_true", help="solo informa cuántas versiones y bytes")
+    args = ap.parse_args(argv)
+    await archivar_mes(args.mes, args.batch, args.pausa, args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+# app/jobs/barrer_blobs.py
+"""
+Barre objetos del blob store que no tienen fila en imagen_blobs.
+
+put_blob escribe el objeto antes del commit de su fila: un rollback (carrera de
+Idempotency-Key, error en el ingest, una migración que pierde la fila) o una caída
+entre ambos dejan el objeto sin referencia. Solo se borran los que tienen más de
+--gracia-horas, con el lock del hash y rechequeando la fila. El scheduler lo corre a
+las 05:00.
+
+    python -m app.jobs.barrer_blobs [--gracia-horas 24] [--dry-run]
+"""
+import argparse
+import asyncio
+import time
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.blobs import barrer_huerfanos
+from app.services.blobstore import get_store
+
+
+async def ejecutar(gracia_horas: int | None = None, dry_run: bool = False) -> dict:
+    horas = settings.blob_sweep_grace_hours if gracia_horas is None else gracia_horas
+    t0 = time.perf_counter()
+    async with SessionLocal() as db:
+        res = await barrer_huerfanos(db, max(0, horas) * 3600, dry_run=dry_run)
+    print(
+        f"[barrer-blobs] {res['objetos']} objetos, {res['huerfanos']} huérfanos, "
+        f"{res['borrados']} borrados{' (dry-run)' if dry_run else ''} en {time.perf_counter() - t0:.1f}s",
+        flush=True,
+    )
+    return res
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Borra objetos del blob store sin fila en imagen_blobs.")
+    ap.add_argument("--gracia-horas", type=int, default=None, help="antigüedad mínima (BLOB_SWEEP_GRACE_HOURS)")
+    ap.add_argument("--dry-run", action="store_true", help="solo cuenta los huérfanos")
+    args = ap.parse_args(argv)
+    if get_store() is None:
+        raise SystemExit("BLOB_BACKEND=db: no hay store externo que barrer")
+    await ejecutar(args.gracia_horas, args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+# app/jobs/migrar_blobs.py
+"""
+Mueve los bytes de imagen de Postgres al blob store configurado (BLOB_BACKEND=fs|s3).
+
+    python -m app.jobs.migrar_blobs [--batch 50] [--pausa 0.2] [--limite N] [--dry-run]
+
+Fases, cada una en lotes cortos con su propio commit (se puede cortar y relanzar:
+solo toma filas que todavía tienen bytes en la BD):
+
+    1) imagen_blobs con data y sin storage_key      -> store, data = NULL
+    2) imagen_renditions con data y sin storage_key  -> store, data = NULL
+    3) captura_versiones legadas con imagen_bytes    -> blob direccionado por contenido
+       (ref_count + 1) en el store; la versión queda con blob_hash e imagen_bytes = NULL
+
+Corre en línea con la API: cada UPDATE vuelve a exigir que la fila siga teniendo
+bytes, así que un borrado o una migración concurrente no se pisan. Si la fila
+desapareció entretanto, el objeto recién escrito se borra del store tras el commit.
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select, tuple_, update
+
+from app.db.session import SessionLocal
+from app.models.capturas import CapturaVersion, ImagenBlob, ImagenRendition
+from app.services.blobs import borrar_si_huerfanos, purge_freed, put_blob, release_blobs
+from app.services.blobstore import blob_key, get_store, rendition_key
+from app.services.images import content_hash
+
+
+async def migrar_blobs(store, batch: int, pausa: float, limite: int | None, dry_run: bool) -> int:
+    movidos, ultimo = 0, ""
+    while limite is None or movidos < limite:
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(ImagenBlob.hash, ImagenBlob.data)
+                    .where(ImagenBlob.data.is_not(None), ImagenBlob.storage_key.is_(None), ImagenBlob.hash > ultimo)
+                    .order_by(ImagenBlob.hash)
+                    .limit(batch)
+                )
+            ).all()
+            if not rows:
+                break
+            perdidos = []
+            for h, data in rows:
+                ultimo = h
+                if dry_run:
+                    continue
+                key = blob_key(h)
+                await store.put(key, data)
+                hit = (
+                    await db.execute(
+                        update(ImagenBlob)
+                        .where(ImagenBlob.hash == h, ImagenBlob.storage_key.is_(None))
+                        .values(storage_key=key, data=None)
+                        .returning(ImagenBlob.hash)
+                    )
+                ).scalar_one_or_none()
+                if hit is None:
+                    perdidos.append(h)
+            await db.commit()
+            await borrar_si_huerfanos(db, perdidos)
+        movidos += len(rows)
+        print(f"[migrar-blobs] blobs: {movidos} (último {ultimo[:12]})", flush=True)
+        await asyncio.sleep(pausa)
+    return movidos
+
+
+async def migrar_renditions(store, batch: int, pausa: float, limite: int | None, dry_run: bool) -> int:
+    movidos, ultimo = 0, ("", "")
+    while limite is None or movidos < limite:
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(ImagenRendition.blob_hash, ImagenRendition.variante, ImagenRendition.data)
+                    .where(
+                        ImagenRendition.data.is_not(None),
+                        ImagenRendition.storage_key.is_(None),
+                        tuple_(ImagenRendition.blob_hash, ImagenRendition.variante) > tuple_(*ultimo),
+                    )
+                    .order_by(ImagenRendition.blob_hash, ImagenRendition.variante)
+                    .limit(batch)
+                )
+            ).all()
+            if not rows:
+                break
+            perdidos = []
+            for h, variante, data in rows:
+                ultimo = (h, variante)
+                if dry_run:
+                    continue
+                key = rendition_key(h, variante)
+                await store.put(key, data)
+                hit = (
+                    await db.execute(
+                        update(ImagenRendition)
+                        .where(
+                            ImagenRendition.blob_hash == h,
+                            ImagenRendition.variante == variante,
+                            ImagenRendition.storage_key.is_(None),
+                        )
+                        .values(storage_key=key, data=None)
+                        .returning(ImagenRendition.blob_hash)
+                    )
+                ).scalar_one_or_none()
+                if hit is None:
+                    perdidos.append(h)
+            await db.commit()
+            await borrar_si_huerfanos(db, perdidos)
+        movidos += len(rows)
+        print(f"[migrar-blobs] variantes: {movidos}", flush=True)
+        await asyncio.sleep(pausa)
+    return movidos
+
+
+async def migrar_versiones_legadas(batch: int, pausa: float, limite: int | None, dry_run: bool) -> int:
+    movidos, ultimo = 0, 0
+    while limite is None or movidos < limite:
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(
+                        CapturaVersion.id,
+                        CapturaVersion.imagen_bytes,
+                        CapturaVersion.content_type,
+                        CapturaVersion.ancho,
+                        CapturaVersion.alto,
+                    )
+                    .where(CapturaVersion.imagen_bytes.is_not(None), CapturaVersion.id > ultimo)
+                    .order_by(CapturaVersion.id)
+                    .limit(batch)
+                )
+            ).all()
+            if not rows:
+                break
+            freed = []
+            for vid, data, ctype, ancho, alto in rows:
+                ultimo = vid
+                if dry_run:
+                    continue
+                h = content_hash(data)
+                await put_blob(db, h, data, ctype, ancho, alto)
+                hit = (
+                    await db.execute(
+                        update(CapturaVersion)
+                        .where(CapturaVersion.id == vid, CapturaVersion.imagen_bytes.is_not(None))
+                        .values(blob_hash=h, imagen_bytes=None, peso_bytes=len(data))
+                        .returning(CapturaVersion.id)
+                    )
+                ).scalar_one_or_none()
+                if hit is None:
+                    # la versión se borró o migró entretanto: devolver la referencia recién sumada
+                    freed += await release_blobs(db, [h])
+            await db.commit()
+            await purge_freed(db, freed)
+        movidos += len(rows)
+        print(f"[migrar-blobs] versiones legadas: {movidos} (id {ultimo})", flush=True)
+        await asyncio.sleep(pausa)
+    return movidos
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Mueve los bytes de imagen de Postgres al blob store.")
+    ap.add_argument("--batch", type=int, default=50, help="filas por transacción")
+    ap.add_argument("--pausa", type=float, default=0.2, help="segundos entre lotes (baja la carga)")
+    ap.add_argument("--limite", type=int, default=None, help="máximo de filas por fase")
+    ap.add_argument("--dry-run", action="store_true", help="solo cuenta lo pendiente")
+    args = ap.parse_args(argv)
+
+    store = get_store()
+    if store is None:
+        raise SystemExit("BLOB_BACKEND=db: no hay store externo al que migrar")
+
+    t0 = time.perf_counter()
+    n1 = await migrar_blobs(store, args.batch, args.pausa, args.limite, args.dry_run)
+    n2 = await migrar_renditions(store, args.batch, args.pausa, args.limite, args.dry_run)
+    n3 = await migrar_versiones_legadas(args.batch, args.pausa, args.limite, args.dry_run)
+    accion = "pendientes" if args.dry_run else "movidos"
+    print(
+        f"[migrar-blobs] listo en {time.perf_counter() - t0:.1f}s ({store.name}): "
+        f"{accion} blobs={n1} variantes={n2} versiones_legadas={n3}",
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+# app/jobs/recalcular_uso.py
+"""
+Rehace el rollup uso_almacenamiento con un full scan (normalmente no hace falta:
+el backend lo mantiene en cada alta/baja de versión).
+
+    python -m app.jobs.recalcular_uso [--desde YYYY-MM-DD]
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+
+from app.db.session import SessionLocal
+from app.services import uso
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Recalcula uso_almacenamiento desde captura_versiones.")
+    ap.add_argument("--desde", type=date.fromisoformat, default=None, help="solo fechas >= YYYY-MM-DD")
+    args = ap.parse_args(argv)
+    t0 = time.perf_counter()
+    async with SessionLocal() as db:
+        n = await uso.recalcular(db, args.desde)
+    print(f"[uso] {n} filas recalculadas en {time.perf_counter() - t0:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
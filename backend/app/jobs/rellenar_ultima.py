@@ -0,0 +1,32 @@
+# app/jobs/rellenar_ultima.py
+"""
+Backfill del puntero a la última versión (capturas.ultima_version_id / ultima_tomada_en /
+version_count). Normalmente no hace falta: sql/010 lo llena y el backend lo mantiene en
+cada alta/baja de versión. Sirve para tablas grandes (lotes cortos con commit) o para
+corregir derivas tras borrados a mano.
+
+    python -m app.jobs.rellenar_ultima [--lote 5000] [--desde YYYY-MM-DD]
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, datetime
+
+from app.db.session import SessionLocal
+from app.services import ultima
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Rellena el puntero a la última versión de cada captura.")
+    ap.add_argument("--lote", type=int, default=5000, help="capturas por transacción")
+    ap.add_argument("--desde", type=date.fromisoformat, default=None, help="solo capturas creadas desde YYYY-MM-DD")
+    args = ap.parse_args(argv)
+    desde = datetime.combine(args.desde, datetime.min.time()) if args.desde else None
+    t0 = time.perf_counter()
+    async with SessionLocal() as db:
+        n = await ultima.rellenar(db, lote=max(1, args.lote), desde=desde)
+    print(f"[ultima] {n} capturas actualizadas en {time.perf_counter() - t0:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
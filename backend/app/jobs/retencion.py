@@ -0,0 +1,336 @@
+# app/jobs/retencion.py
+"""
+Retención y compactación de captura_versiones.
+
+    python -m app.jobs.retencion [--keep-days N] [--archive-days M] [--batch 100] [--pausa 0.5]
+                                 [--limite N] [--dry-run]
+
+Fases (cada una deshabilitada con 0 días; por defecto RETENTION_KEEP_DAYS / RETENTION_ARCHIVE_DAYS):
+
+    1) poda        versiones con más de N días que no son la última de su captura
+                   -> se borran; se libera su referencia al blob y, si el blob queda
+                   sin referencias, sus thumbs en disco y sus objetos en el store
+    2) compactar   versiones con más de M días aún no compactadas -> se re-codifican
+                   a RETENTION_ARCHIVE_MAX_W / RETENTION_ARCHIVE_QUALITY en el pool de
+                   imágenes (nuevo blob + variantes) y se libera el blob original
+
+Lotes cortos con su propio commit y una pausa entre lotes; la re-codificación comparte
+el pool con los uploads y espera (Retry-After) si está saturado. Con --dry-run solo
+informa cuántas versiones y bytes tocaría. El scheduler la corre a las 04:00.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, or_, select, tuple_, update
+from sqlalchemy.orm import aliased
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.capturas import CapturaVersion, ImagenBlob, ImagenRendition
+from app.services import hot_cache, image_pool, ultima, uso
+from app.services.blobs import purge_freed, put_blob, put_renditions, release_blobs, version_bytes
+from app.services.image_pool import ImagePoolSaturated
+from app.services.images import ImagenRechazada, procesar_upload
+from app.services.thumbs import purge_thumbs, save_thumb, thumb_key
+
+# intentos de encolar en el pool saturado antes de dejar la versión para la próxima corrida
+_POOL_REINTENTOS = 5
+
+
+def _podables(cutoff: datetime):
+    """Versiones anteriores a cutoff que tienen una versión posterior en su misma captura."""
+    posterior = aliased(CapturaVersion)
+    return (
+        CapturaVersion.tomada_en < cutoff,
+        exists().where(
+            posterior.captura_id == CapturaVersion.captura_id,
+            tuple_(posterior.tomada_en, posterior.id) > tuple_(CapturaVersion.tomada_en, CapturaVersion.id),
+        ),
+    )
+
+
+def _compactables(cutoff: datetime):
+    return (
+        CapturaVersion.tomada_en < cutoff,
+        CapturaVersion.compactada_en.is_(None),
+        or_(CapturaVersion.blob_hash.is_not(None), CapturaVersion.imagen_bytes.is_not(None)),
+    )
+
+
+def _purge_legadas(version_ids) -> int:
+    """Thumbs en disco de versiones legadas (clave por id, no por hash)."""
+    return purge_thumbs(thumb_key(vid, None) for vid in version_ids)
+
+
+# ————— 1) poda —————
+async def reporte_poda(cutoff: datetime) -> dict:
+    """Lo que borraría la poda, sin tocar nada."""
+    where = _podables(cutoff)
+    async with SessionLocal() as db:
+        n, peso = (
+            await db.execute(
+                select(func.count(), func.coalesce(func.sum(CapturaVersion.peso_bytes), 0)).where(*where)
+            )
+        ).one()
+        legado = (
+            await db.execute(
+                select(func.coalesce(func.sum(func.octet_length(CapturaVersion.imagen_bytes)), 0)).where(*where)
+            )
+        ).scalar_one()
+        # un blob se libera solo si todas sus referencias están entre las versiones podadas
+        refs = (
+            select(CapturaVersion.blob_hash, func.count().label("n"))
+            .where(*where, CapturaVersion.blob_hash.is_not(None))
+            .group_by(CapturaVersion.blob_hash)
+            .subquery()
+        )
+        liberados = (
+            select(ImagenBlob.hash, ImagenBlob.peso_bytes)
+            .join(refs, refs.c.blob_hash == ImagenBlob.hash)
+            .where(refs.c.n >= ImagenBlob.ref_count)
+            .subquery()
+        )
+        blobs, blob_bytes = (
+            await db.execute(select(func.count(), func.coalesce(func.sum(liberados.c.peso_bytes), 0)))
+        ).one()
+        rend_bytes = (
+            await db.execute(
+                select(func.coalesce(func.sum(ImagenRendition.peso_bytes), 0))
+                .where(ImagenRendition.blob_hash.in_(select(liberados.c.hash)))
+            )
+        ).scalar_one()
+    return {
+        "versiones": n,
+        "bytes_versiones": int(peso),
+        "blobs_liberados": blobs,
+        "bytes_recuperables": int(legado) + int(blob_bytes) + int(rend_bytes),
+    }
+
+
+async def podar(cutoff: datetime, batch: int, pausa: float, limite: int | None) -> dict:
+    res = {"versiones": 0, "blobs_liberados": 0, "thumbs_borrados": 0}
+    ultimo = 0
+    while limite is None or res["versiones"] < limite:
+        async with SessionLocal() as db:
+            ids = (
+                await db.execute(
+                    select(CapturaVersion.id)
+                    .where(*_podables(cutoff), CapturaVersion.id > ultimo)
+                    .order_by(CapturaVersion.id)
+                    .limit(batch)
+                )
+            ).scalars().all()
+            if not ids:
+                break
+            ultimo = ids[-1]
+            # la condición se re-evalúa en el DELETE: si entretanto se borró la última
+            # versión de una captura, la que pasa a ser última se conserva
+            borradas = (
+                await db.execute(
+                    delete(CapturaVersion)
+                    .where(CapturaVersion.id.in_(ids), *_podables(cutoff))
+                    .returning(
+                        CapturaVersion.id, CapturaVersion.captura_id, CapturaVersion.blob_hash, CapturaVersion.peso_bytes
+                    )
+                )
+            ).all()
+            freed = await release_blobs(db, [b.blob_hash for b in borradas])
+            await uso.ajustar(db, ((b.captura_id, -1, -(b.peso_bytes or 0)) for b in borradas))
+            await ultima.refrescar(db, (b.captura_id for b in borradas))
+            await db.commit()
+            await purge_freed(db, freed)
+        res["versiones"] += len(borradas)
+        res["blobs_liberados"] += len(freed)
+        res["thumbs_borrados"] += _purge_legadas(b.id for b in borradas if not b.blob_hash)
+        print(f"[retencion] poda: {res['versiones']} versiones (id {ultimo})", flush=True)
+        await asyncio.sleep(pausa)
+    return res
+
+
+# ————— 2) compactación —————
+async def reporte_compactacion(cutoff: datetime) -> dict:
+    async with SessionLocal() as db:
+        n, peso = (
+            await db.execute(
+                select(func.count(), func.coalesce(func.sum(CapturaVersion.peso_bytes), 0))
+                .where(*_compactables(cutoff))
+            )
+        ).one()
+    return {"versiones": n, "bytes_actuales": int(peso)}
+
+
+async def _recodificar(raw: bytes, max_w: int, quality: int) -> dict | None:
+    for _ in range(_POOL_REINTENTOS):
+        try:
+            return await image_pool.run(procesar_upload, raw, max_w, quality)
+        except ImagePoolSaturated as e:
+            # los uploads tienen prioridad: esperar en vez de competir por el pool
+            await asyncio.sleep(e.retry_after)
+        except ImagenRechazada:
+            return None
+    return None
+
+
+async def _marcar(db, version_id: int):
+    await db.execute(
+        update(CapturaVersion).where(CapturaVersion.id == version_id).values(compactada_en=datetime.utcnow())
+    )
+
+
+async def compactar(
+    cutoff: datetime, batch: int, pausa: float, limite: int | None, max_w: int, quality: int
+) -> dict:
+    res = {"versiones": 0, "recodificadas": 0, "bytes_ahorrados": 0, "blobs_liberados": 0}
+    ultimo = 0
+    while limite is None or res["versiones"] < limite:
+        thumbs, legadas, viejas = [], [], []
+        # blob original -> (resultado, peso original): en el lote, las versiones que comparten
+        # blob se re-codifican una vez
+        hechos: dict[str, tuple[dict | None, int]] = {}
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(CapturaVersion.id, CapturaVersion.captura_id, CapturaVersion.blob_hash, CapturaVersion.peso_bytes)
+                    .where(*_compactables(cutoff), CapturaVersion.id > ultimo)
+                    .order_by(CapturaVersion.id)
+                    .limit(batch)
+                )
+            ).all()
+            if not rows:
+                break
+            freed = []
+            for vid, captura_id, old_hash, old_peso in rows:
+                ultimo = vid
+                # blob ya re-codificado en este lote: no se vuelve a leer el original
+                if old_hash and old_hash in hechos:
+                    img, peso_orig = hechos[old_hash]
+                else:
+                    raw = await version_bytes(db, vid)
+                    img, peso_orig = None, len(raw) if raw else 0
+                    if raw:
+                        img = await _recodificar(raw, max_w, quality)
+                    del raw
+                    if old_hash:
+                        hechos[old_hash] = (img, peso_orig)
+                if not peso_orig or not img or img["peso_bytes"] >= peso_orig:
+                    # nada que ganar (o no decodificable): no volver a intentarlo
+                    await _marcar(db, vid)
+                    continue
+
+                if await put_blob(db, img["hash"], img["bytes"], img["content_type"], img["ancho"], img["alto"]):
+                    await put_renditions(db, img["hash"], img["renditions"])
+                hit = (
+                    await db.execute(
+                        update(CapturaVersion)
+                        .where(
+                            CapturaVersion.id == vid,
+                            CapturaVersion.compactada_en.is_(None),
+                            CapturaVersion.blob_hash.is_not_distinct_from(old_hash),
+                        )
+                        .values(
+                            blob_hash=img["hash"],
+                            imagen_bytes=None,
+                            content_type=img["content_type"],
+                            ancho=img["ancho"],
+                            alto=img["alto"],
+                            peso_bytes=img["peso_bytes"],
+                            compactada_en=datetime.utcnow(),
+                        )
+                        .returning(CapturaVersion.id)
+                    )
+                ).scalar_one_or_none()
+                if hit is None:
+                    # la versión se borró o cambió entretanto: devolver la referencia recién sumada
+                    freed += await release_blobs(db, [img["hash"]])
+                    continue
+                if old_hash:
+                    freed += await release_blobs(db, [old_hash])
+                else:
+                    legadas.append(vid)
+                await uso.ajustar(db, [(captura_id, 0, img["peso_bytes"] - (old_peso or 0))])
+                thumbs.append((vid, img))
+                viejas.append(thumb_key(vid, old_hash))
+                res["recodificadas"] += 1
+                res["bytes_ahorrados"] += peso_orig - img["peso_bytes"]
+            await db.commit()
+            await purge_freed(db, freed)
+        # el version_id sigue igual pero el contenido no: las claves viejas ya no se sirven
+        # (ETag y caches van por thumb_key); se sueltan de memoria si el job corre en el proceso
+        hot_cache.descartar(viejas)
+
+        def _thumbs():
+            for vid, img in thumbs:
+                save_thumb(thumb_key(vid, img["hash"]), img["thumb"], max_w=360, quality=70)
+            _purge_legadas(legadas)
+
+        await asyncio.to_thread(_thumbs)
+        res["versiones"] += len(rows)
+        res["blobs_liberados"] += len(freed)
+        print(
+            f"[retencion] compactación: {res['versiones']} versiones, "
+            f"{res['bytes_ahorrados'] / 1e6:.1f} MB ahorrados (id {ultimo})",
+            flush=True,
+        )
+        await asyncio.sleep(pausa)
+    return res
+
+
+async def ejecutar(
+    *,
+    keep_days: int | None = None,
+    archive_days: int | None = None,
+    batch: int | None = None,
+    pausa: float | None = None,
+    limite: int | None = None,
+    dry_run: bool = False,
+) -> dict:
+    """Corre las fases habilitadas y devuelve el informe (también lo imprime)."""
+    keep_days = settings.retention_keep_days if keep_days is None else keep_days
+    archive_days = settings.retention_archive_days if archive_days is None else archive_days
+    batch = batch or settings.retention_batch
+    pausa = settings.retention_pause if pausa is None else pausa
+    ahora = datetime.utcnow()
+    informe: dict = {"dry_run": dry_run}
+
+    t0 = time.perf_counter()
+    if keep_days > 0:
+        cutoff = ahora - timedelta(days=keep_days)
+        informe["poda"] = await reporte_poda(cutoff) if dry_run else await podar(cutoff, batch, pausa, limite)
+    if archive_days > 0:
+        cutoff = ahora - timedelta(days=archive_days)
+        informe["compactacion"] = (
+            await reporte_compactacion(cutoff)
+            if dry_run
+            else await compactar(
+                cutoff, batch, pausa, limite,
+                settings.retention_archive_max_w, settings.retention_archive_quality,
+            )
+        )
+    informe["segundos"] = round(time.perf_counter() - t0, 1)
+    print(f"[retencion] {informe}", flush=True)
+    return informe
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description="Retención y compactación de captura_versiones.")
+    ap.add_argument("--keep-days", type=int, default=None, help="días con todas las versiones (0 = no podar)")
+    ap.add_argument("--archive-days", type=int, default=None, help="días antes de compactar (0 = no compactar)")
+    ap.add_argument("--batch", type=int, default=None, help="versiones por transacción")
+    ap.add_argument("--pausa", type=float, default=None, help="segundos entre lotes (baja la carga)")
+    ap.add_argument("--limite", type=int, default=None, help="máximo de versiones por fase")
+    ap.add_argument("--dry-run", action="store_true", help="solo informa lo que haría")
+    args = ap.parse_args(argv)
+    await ejecutar(
+        keep_days=args.keep_days,
+        archive_days=args.archive_days,
+        batch=args.batch,
+        pausa=args.pausa,
+        limite=args.limite,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,11 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from datetime import datetime
 from pytz import timezone
 from app.core.config import settings
+from app.db.session import SessionLocal
+from app.jobs import barrer_blobs, retencion
+from app.services import idempotency, ingest_spool, particiones, thumbs, upload_sessions
 
 
 _scheduler: AsyncIOScheduler | None = None
@@ -13,11 +17,73 @@ async def disparar_capturas_08():
     print("[job] Disparar capturas 08:00")
 
 
+async def limpiar_spool():
+    n = ingest_spool.limpiar_estados()
+    if n:
+        print(f"[job] spool: {n} estados de tickets viejos eliminados", flush=True)
+
+
+async def limpiar_sesiones_upload():
+    n = upload_sessions.limpiar_expiradas()
+    if n:
+        print(f"[job] uploads: {n} sesiones reanudables expiradas eliminadas", flush=True)
+
+
+async def purgar_idempotency_keys():
+    async with SessionLocal() as db:
+        n = await idempotency.purgar_expiradas(db)
+    if n:
+        print(f"[job] idempotency: {n} claves expiradas eliminadas", flush=True)
+
+
+async def limpiar_thumbs_huerfanos():
+    async with SessionLocal() as db:
+        n = await thumbs.limpiar_huerfanos(db)
+    if n:
+        print(f"[job] thumbs: {n} miniaturas huérfanas eliminadas", flush=True)
+
+
+async def crear_particiones():
+    try:
+        async with SessionLocal() as db:
+            n = await particiones.asegurar_particiones(db)
+        if n:
+            print(f"[job] particiones: captura_versiones cubierta ({n} meses)", flush=True)
+    except Exception as e:
+        print(f"[job] particiones falló: {e!r}", flush=True)
+
+
+async def retencion_versiones():
+    if settings.retention_keep_days <= 0 and settings.retention_archive_days <= 0:
+        return
+    try:
+        await retencion.ejecutar(dry_run=settings.retention_dry_run)
+    except Exception as e:
+        print(f"[job] retención falló: {e!r}", flush=True)
+
+
+async def barrer_blobs_huerfanos():
+    try:
+        await barrer_blobs.ejecutar()
+    except Exception as e:
+        print(f"[job] barrido de blobs falló: {e!r}", flush=True)
+
+
 def start_jobs():
     global _scheduler
     if _scheduler is None:
         _scheduler = AsyncIOScheduler(timezone=timezone(settings.tz))
         _scheduler.add_job(disparar_capturas_08, CronTrigger(hour=8, minute=0))
+        _scheduler.add_job(limpiar_spool, CronTrigger(hour=3, minute=30))
+        _scheduler.add_job(limpiar_sesiones_upload, CronTrigger(minute=15))
+        _scheduler.add_job(purgar_idempotency_keys, CronTrigger(hour=3, minute=45))
+        _scheduler.add_job(retencion_versiones, CronTrigger(hour=4, minute=0))
+        _scheduler.add_job(limpiar_thumbs_huerfanos, CronTrigger(hour=4, minute=30))
+        _scheduler.add_job(barrer_blobs_huerfanos, CronTrigger(hour=5, minute=0))
+        # también al arrancar: un INSERT sin partición para el mes fallaría
+        _scheduler.add_job(
+            crear_particiones, CronTrigger(hour=2, minute=0), next_run_time=datetime.now(_scheduler.timezone)
+        )
         _scheduler.start()
         print("[jobs] scheduler started", flush=True)
 
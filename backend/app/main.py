@@ -18,6 +18,7 @@ import app.models
 from contextlib import suppress
 from app.db.session import get_db
 from app.routers import centros as centros_router 
+from app.services import image_pool, ingest_spool, thumb_warmer
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -65,6 +66,9 @@ async def _startup_monitor():
     with suppress(Exception):
         start_jobs()
     app.state.monitor_task = asyncio.create_task(_monitor_loop(threshold_sec=70, interval_sec=5))
+    await ingest_spool.start()
+    # miniaturas del board de hoy en segundo plano (y luego tras cada ingest)
+    await thumb_warmer.start()
 
 @app.on_event("shutdown")
 async def _shutdown_monitor():
@@ -74,5 +78,8 @@ async def _shutdown_monitor():
         with suppress(asyncio.CancelledError):
             await task
         print("[monitor] detenido", flush=True)
+    await ingest_spool.stop()
+    await thumb_warmer.stop()
     with suppress(Exception):
         stop_jobs()
+    image_pool.shutdown()
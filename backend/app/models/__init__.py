@@ -2,6 +2,8 @@
 from .clientes import Cliente
 from .centros import Centro
 from .dispositivos import Dispositivo
-from .capturas import Captura, CapturaVersion
+from .capturas import Captura, CapturaVersion, ImagenBlob, ImagenRendition
 from .ordenes import OrdenCaptura
 from .users import User
+from .idempotencia import IdempotencyKey
+from .uso import UsoAlmacenamiento
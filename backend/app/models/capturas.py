@@ -1,7 +1,7 @@
 ﻿from datetime import datetime, date
 from typing import Optional
 
-from sqlalchemy import ForeignKey, Integer, LargeBinary, String, TIMESTAMP, Text, Index
+from sqlalchemy import ForeignKey, Integer, LargeBinary, String, TIMESTAMP, Text, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.base import Base
@@ -11,8 +11,17 @@ class Captura(Base):
     __tablename__ = "capturas"
     __table_args__ = (
         Index("ix_capturas_centro_fecha_disp", "centro_id", "fecha_reporte", "dispositivo_id"),
+        # una captura por (centro, dispositivo, día); COALESCE para que NULL cuente como un valor
+        Index(
+            "ux_capturas_centro_disp_fecha",
+            "centro_id", text("COALESCE(dispositivo_id, 0)"), "fecha_reporte",
+            unique=True,
+        ),
         Index("ix_capturas_cliente_fecha", "cliente_id", "fecha_reporte"),
         Index("ix_capturas_created_at", "created_at"),
+        # append-mostly por fecha: BRIN para barridos por rango (sql/007)
+        Index("brin_capturas_created_at", "created_at", postgresql_using="brin"),
+        Index("brin_capturas_fecha_reporte", "fecha_reporte", postgresql_using="brin"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -29,22 +38,75 @@ class Captura(Base):
     grabacion: Mapped[Optional[str]] = mapped_column(Text, default="correcto")
     notas: Mapped[Optional[str]] = mapped_column(Text)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow)
+    # puntero a la última versión (app.services.ultima, sql/010); sin FK porque la PK de
+    # captura_versiones es (id, tomada_en): unir por ambas columnas para descartar particiones
+    ultima_version_id: Mapped[Optional[int]] = mapped_column(Integer)
+    ultima_tomada_en: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    version_count: Mapped[int] = mapped_column(Integer, default=0, server_default=text("0"))
+
+
+class ImagenBlob(Base):
+    """Bytes de imagen direccionados por contenido (BLAKE2b-256); varias versiones pueden compartir uno."""
+    __tablename__ = "imagen_blobs"
+
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    # bytes en el blob store externo (storage_key) o, si es NULL, todavía en `data`
+    storage_key: Mapped[Optional[str]] = mapped_column(String(200))
+    data: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True, deferred_raiseload=True)
+    content_type: Mapped[Optional[str]] = mapped_column(String(50))
+    ancho: Mapped[Optional[int]]
+    alto: Mapped[Optional[int]]
+    peso_bytes: Mapped[Optional[int]]
+    ref_count: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow)
+
+
+class ImagenRendition(Base):
+    """Variante derivada de un blob (thumb, pdf, placeholder...), generada en el ingest."""
+    __tablename__ = "imagen_renditions"
+
+    blob_hash: Mapped[str] = mapped_column(
+        ForeignKey("imagen_blobs.hash", ondelete="CASCADE"), primary_key=True
+    )
+    variante: Mapped[str] = mapped_column(String(20), primary_key=True)
+    content_type: Mapped[Optional[str]] = mapped_column(String(50))
+    ancho: Mapped[Optional[int]]
+    alto: Mapped[Optional[int]]
+    peso_bytes: Mapped[Optional[int]]
+    storage_key: Mapped[Optional[str]] = mapped_column(String(200))
+    data: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True, deferred_raiseload=True)
 
 
 class CapturaVersion(Base):
+    """
+    Particionada por mes sobre tomada_en (sql/007); la PK incluye la columna de partición.
+    Las consultas por fecha deben acotar tomada_en para que Postgres descarte particiones.
+    """
     __tablename__ = "captura_versiones"
     __table_args__ = (
         Index("ix_capver_captura_fecha", "captura_id", "tomada_en"),
+        Index("ix_capver_blob_hash", "blob_hash"),
+        # candidatas de la compactación (app.jobs.retencion)
+        Index("ix_capver_sin_compactar", "tomada_en", postgresql_where=text("compactada_en IS NULL")),
+        Index("brin_capver_tomada_en", "tomada_en", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (tomada_en)"},
     )
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     captura_id: Mapped[int] = mapped_column(ForeignKey("capturas.id", ondelete="CASCADE"))
-    tomada_en: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow)
+    tomada_en: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, default=datetime.utcnow)
     origen: Mapped[str] = mapped_column(String(20), default="auto")
-    imagen_bytes: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
+    # legado: las versiones nuevas guardan los bytes en imagen_blobs y solo referencian blob_hash.
+    # deferred + raiseload: cargar la fila nunca trae los bytes (leerlos con blobs.version_bytes/stream)
+    imagen_bytes: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True, deferred_raiseload=True)
+    blob_hash: Mapped[Optional[str]] = mapped_column(ForeignKey("imagen_blobs.hash"), nullable=True)
     content_type: Mapped[Optional[str]] = mapped_column(String(50))
     ancho: Mapped[Optional[int]]
     alto: Mapped[Optional[int]]
     peso_bytes: Mapped[Optional[int]]
     imagen_url: Mapped[Optional[str]]
     thumbnail_url: Mapped[Optional[str]]
+    # re-codificada a calidad de archivo por la retención (NULL = original)
+    compactada_en: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    # archivada en un packfile (app.services.packs): los bytes ya no están en blob ni columna
+    archivo_pack: Mapped[Optional[str]] = mapped_column(String(60))
@@ -0,0 +1,18 @@
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Integer, String, TIMESTAMP, Index
+from datetime import datetime
+from app.db.base import Base
+
+
+class IdempotencyKey(Base):
+    """Resultado de un upload ya aplicado, para responder igual a los reintentos del agente."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+    # scope = "upload" | "version:{captura_id}"; la misma clave en otro endpoint es otra operación
+    scope: Mapped[str] = mapped_column(String(40), primary_key=True)
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    captura_id: Mapped[int] = mapped_column(Integer)
+    version_id: Mapped[int] = mapped_column(Integer)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow)
@@ -0,0 +1,27 @@
+from datetime import date, datetime
+
+from sqlalchemy import BigInteger, Date, Integer, TIMESTAMP, Index
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class UsoAlmacenamiento(Base):
+    """
+    Rollup de versiones y bytes por (cliente, centro, fecha_reporte), mantenido en la
+    misma transacción que inserta/borra versiones (app.services.uso). Sin FKs: al borrar
+    un centro o cliente sus filas se eliminan explícitamente.
+    """
+    __tablename__ = "uso_almacenamiento"
+    __table_args__ = (
+        Index("ix_uso_almacenamiento_fecha", "fecha"),
+        Index("ix_uso_almacenamiento_centro_fecha", "centro_id", "fecha"),
+    )
+
+    cliente_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    centro_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    fecha: Mapped[date] = mapped_column(Date, primary_key=True)
+    versiones: Mapped[int] = mapped_column(Integer, default=0)
+    # suma de peso_bytes (lógico: un blob compartido cuenta en cada versión)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=datetime.utcnow)
@@ -1,56 +1,55 @@
-﻿from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, Request
-from fastapi.responses import StreamingResponse, Response
+﻿from fastapi import APIRouter, UploadFile, File, Form, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc, func, and_, or_
 from datetime import date, datetime, timedelta, timezone
-from io import BytesIO
 from pathlib import Path
+import asyncio
+import json
 
 
 from app.db.session import get_db
 from app.models.capturas import Captura, CapturaVersion
 from app.models.ordenes import OrdenCaptura
-from app.services.images import to_webp_bytes
+from app.core.config import settings
+from app.services import catalog, hot_cache, idempotency, image_pool, ingest_spool, packs, sprites, ultima, upload_sessions, uso
+from app.services.uploads import read_body_capped, read_upload_capped
+from app.services.blobs import (
+    abrir_stream,
+    get_rendition,
+    purge_freed,
+    release_versions,
+    metas_de_capturas,
+    metas_de_versiones,
+    rendition_bytes,
+    ruta_local,
+    ruta_rendition,
+    ultima_version_meta,
+    version_bytes,
+    version_meta,
+)
+from app.services.ingest import (
+    agregar_version,
+    confirmar_version,
+    ingest_captura,
+    ingest_lote,
+    procesar_imagen,
+    procesar_lote,
+    resolver_destino,
+    upsert_captura,
+)
+from app.services.image_pool import ImagePoolSaturated
+from app.services.images import RENDITIONS, generar_thumbs
+from app.services.archivos import responder_archivo
+from app.services.thumbs import save_thumb, snap, thumb_key, thumb_en_disco
 from pydantic import BaseModel
 from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from app.models.centros import Centro 
 from app.models.dispositivos import Dispositivo
 
 
 from typing import Optional
-# Cache simple en disco para thumbs: static/thumbs/{version_id}-w{max_w}-q{quality}.webp
-THUMB_DIR = Path(__file__).resolve().parent.parent / "static" / "thumbs"
-THUMB_DIR.mkdir(parents=True, exist_ok=True)
-
-def _save_thumb(version_id: int, raw_bytes: bytes, max_w: int = 360, quality: int = 70) -> Path | None:
-    """Genera y guarda miniatura en disco para reutilizarla."""
-    cache_path = THUMB_DIR / f"thumb_v{version_id}_w{max_w}_q{quality}.webp"
-    try:
-        from PIL import Image
-        import io
-
-        img = Image.open(BytesIO(raw_bytes))
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGB")
-
-        w, h = img.size
-        if w > max_w:
-            scale = max_w / float(w)
-            img = img.resize((int(w * scale), int(h * scale)))
-
-        out = io.BytesIO()
-        img.save(out, format="WEBP", quality=quality, method=6)
-        cache_path.write_bytes(out.getvalue())
-        return cache_path
-    except Exception as e:
-        try:
-            cache_path.write_bytes(raw_bytes)
-            return cache_path
-        except Exception as e2:
-            print(f"[thumb-pre] WARNING v_id={version_id} no se pudo escribir thumb: {e!r} / {e2!r}", flush=True)
-            return None
-
-
 router = APIRouter(prefix="/api/capturas", tags=["capturas"])
 
 class CapturaUpdate(BaseModel):
@@ -79,130 +78,362 @@ async def upload_captura(
     fecha_reporte: date = Form(...),
     origen: str = Form("auto"),
     file: UploadFile = File(...),
+    orden_id: Optional[int] = Form(None),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db),
 ):
+    # reintento de un upload ya aplicado: misma respuesta, sin Pillow ni inserts
+    idem_key = idempotency.normalizar(idempotency_header, idempotency_key)
+    previo = await idempotency.buscar(db, "upload", idem_key)
+    if previo:
+        print(f"[upload] idempotency-key repetida -> {previo}", flush=True)
+        return previo
+
     # ­ƒæë LOG de depuraci├│n para confirmar qu├® lleg├│
     print(f"[upload] form: uuid={uuid_equipo!r} cliente_id={cliente_id} centro_id={centro_id} disp_id={dispositivo_id} fecha={fecha_reporte} origen={origen}", flush=True)
 
-    # 0) Resolver por UUID si viene
-    if uuid_equipo:
-        cen = (
-            await db.execute(select(Centro).where(Centro.uuid_equipo == uuid_equipo))
-        ).scalar_one_or_none()
-        if not cen:
-            raise HTTPException(status_code=404, detail="centro no encontrado para uuid_equipo")
+    # 0-1) Resolver por UUID o exigir los 3 IDs
+    cliente_id, centro_id, dispositivo_id = await resolver_destino(
+        db, uuid_equipo, cliente_id, centro_id, dispositivo_id
+    )
 
-        # Consistencia si adem├ís mandaron IDs
-        if cliente_id and cliente_id != cen.cliente_id:
-            raise HTTPException(status_code=400, detail="cliente_id no coincide con uuid_equipo")
-        if centro_id and centro_id != cen.id:
-            raise HTTPException(status_code=400, detail="centro_id no coincide con uuid_equipo")
+    # 2) Leer/convertir imagen (en el pool de procesos)
+    raw = await read_upload_capped(file)
+    img = await procesar_imagen(raw)
+
+    # 3) Captura del día (la crea si no existe) + nueva versión
+    return await ingest_captura(
+        db,
+        cliente_id=cliente_id,
+        centro_id=centro_id,
+        dispositivo_id=dispositivo_id,
+        fecha_reporte=fecha_reporte,
+        origen=origen,
+        img=img,
+        idempotency_key=idem_key,
+        orden_id=orden_id,
+    )
 
-        cliente_id = cen.cliente_id
-        centro_id  = cen.id
 
-        # Resolver dispositivo_id (opcional y seguro)
-        if dispositivo_id is None:
-            last = (
-                await db.execute(
-                    select(Captura.dispositivo_id)
-                    .where(Captura.centro_id == centro_id)
-                    .order_by(desc(Captura.created_at))
-                    .limit(1)
-                )
-            ).first()
-            dispositivo_id = last[0] if (last and last[0] is not None) else None
-
-        # Si tenemos un dispositivo_id, verificar que exista en tabla dispositivos.
-        if dispositivo_id is not None:
-            exists_disp = (
-                await db.execute(select(Dispositivo.id).where(Dispositivo.id == dispositivo_id))
-            ).scalar_one_or_none()
-            if not exists_disp:
-                # Evita romper FK: dejarlo en NULL
-                print(f"[upload] dispositivo_id={dispositivo_id} no existe -> usando NULL", flush=True)
-                dispositivo_id = None
-
-    # 1) Si no vino uuid_equipo, exigir los 3 IDs (como antes)
-    if not uuid_equipo and not all([cliente_id, centro_id, dispositivo_id]):
-        raise HTTPException(
-            status_code=400,
-            detail="Faltan identificadores: env├¡a uuid_equipo o los campos cliente_id, centro_id, dispositivo_id."
-        )
 
-    # 2) Leer/convertir imagen (igual que ten├¡as) ÔÇª
-    raw = await file.read()
-    bytes_, ctype, w, h, size = to_webp_bytes(raw)
+# =========================
+# SUBIR CAPTURA CON CUERPO CRUDO (sin multipart; lo usa el agente)
+# =========================
+RAW_CONTENT_TYPES = ("application/octet-stream", "image/jpeg", "image/png", "image/webp")
 
-    # 3) Buscar si ya existe captura del d├¡a (usa dispositivo_id que puede ser NULL y no rompe)
-    captura = (
-        await db.execute(
-            select(Captura).where(
-                Captura.centro_id == centro_id,
-                Captura.dispositivo_id == dispositivo_id,
-                Captura.fecha_reporte == fecha_reporte,
-            )
-        )
-    ).scalar_one_or_none()
 
-    if not captura:
-        captura = Captura(
-            cliente_id=cliente_id,
-            centro_id=centro_id,
-            dispositivo_id=dispositivo_id,  # <- puede ser None, y est├í permitido en tu modelo
-            fecha_reporte=fecha_reporte,
-            estado="pendiente",
+@router.post("/upload/raw")
+async def upload_captura_raw(
+    request: Request,
+    fecha_reporte: date = Query(...),
+    uuid_equipo: Optional[str] = Query(None),
+    cliente_id: Optional[int] = Query(None),
+    centro_id: Optional[int] = Query(None),
+    dispositivo_id: Optional[int] = Query(None),
+    origen: str = Query("auto"),
+    orden_id: Optional[int] = Query(None, description="orden que esta captura completa (se marca tomada)"),
+    spool: bool = Query(False, description="true = encolar en el spool y responder 202 con ticket"),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Igual que /upload (o /upload/spool con spool=true), pero la imagen es el cuerpo
+    del request y la metadata va en la query. Evita el parser multipart y la copia
+    intermedia a SpooledTemporaryFile. El multipart sigue disponible para el front.
+    """
+    ctype = (request.headers.get("content-type") or "application/octet-stream").split(";")[0].strip().lower()
+    if ctype not in RAW_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail=f"content-type no soportado: {ctype}")
+
+    idem_key = idempotency.normalizar(idempotency_header, None)
+    previo = await idempotency.buscar(db, "upload", idem_key)
+    if previo:
+        print(f"[upload-raw] idempotency-key repetida -> {previo}", flush=True)
+        return previo
+
+    if spool:
+        raw = await read_body_capped(request)
+        ticket = await ingest_spool.submit(raw, {
+            "uuid_equipo": uuid_equipo,
+            "cliente_id": cliente_id,
+            "centro_id": centro_id,
+            "dispositivo_id": dispositivo_id,
+            "fecha_reporte": fecha_reporte.isoformat(),
+            "origen": origen,
+            "orden_id": orden_id,
+            "idempotency_key": idem_key,
+        })
+        print(f"[upload-raw] spool ticket={ticket} uuid={uuid_equipo!r} fecha={fecha_reporte} origen={origen}", flush=True)
+        return JSONResponse(
+            {"ticket": ticket, "estado": "pendiente", "estado_url": f"/api/capturas/upload/spool/{ticket}"},
+            status_code=202,
         )
-        db.add(captura)
-        await db.flush()
 
-    version = CapturaVersion(
-        captura_id=captura.id,
+    cliente_id, centro_id, dispositivo_id = await resolver_destino(
+        db, uuid_equipo, cliente_id, centro_id, dispositivo_id
+    )
+    raw = await read_body_capped(request)
+    img = await procesar_imagen(raw)
+    return await ingest_captura(
+        db,
+        cliente_id=cliente_id,
+        centro_id=centro_id,
+        dispositivo_id=dispositivo_id,
+        fecha_reporte=fecha_reporte,
         origen=origen,
-        imagen_bytes=bytes_,
-        content_type=ctype,
-        ancho=w,
-        alto=h,
-        peso_bytes=size,
+        img=img,
+        idempotency_key=idem_key,
+        orden_id=orden_id,
     )
-    db.add(version)
-    await db.commit()
-    await db.refresh(version)
-    _save_thumb(version.id, bytes_, max_w=360, quality=70)
-    return {"captura_id": captura.id, "version_id": version.id}
 
 
 
+# =========================
+# SUBIR VARIAS CAPTURAS EN UNA LLAMADA (un commit para todo el lote)
+# =========================
+class LoteItem(BaseModel):
+    fecha_reporte: date
+    origen: str = "auto"
+    dispositivo_id: Optional[int] = None
+
+
+@router.post("/upload/batch")
+async def upload_captura_batch(
+    uuid_equipo: Optional[str] = Form(None),
+    cliente_id: Optional[int] = Form(None),
+    centro_id: Optional[int] = Form(None),
+    dispositivo_id: Optional[int] = Form(None),
+    items: str = Form(..., description='JSON: [{"fecha_reporte": "YYYY-MM-DD", "origen": "auto", "dispositivo_id": null}, ...]'),
+    files: list[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    N imágenes (files[i] <-> items[i]) del mismo centro. El centro se resuelve una vez,
+    las imágenes se procesan en el pool y todas las versiones válidas se guardan en una
+    sola transacción. Responde un resultado por item; los que fallan no frenan al resto.
+    """
+    try:
+        lote = [LoteItem.model_validate(x) for x in json.loads(items)]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"items inválido: {e}")
+    if len(lote) != len(files):
+        raise HTTPException(status_code=400, detail=f"items ({len(lote)}) y files ({len(files)}) no coinciden")
+    if not lote:
+        raise HTTPException(status_code=400, detail="lote vacío")
+    if len(lote) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"máximo {settings.batch_max_items} imágenes por lote")
+
+    cliente_id, centro_id, dispositivo_id = await resolver_destino(
+        db, uuid_equipo, cliente_id, centro_id, dispositivo_id
+    )
+
+    # dispositivos explícitos por item: validarlos todos en una consulta (inexistente -> NULL, como /upload)
+    pedidos = {it.dispositivo_id for it in lote if it.dispositivo_id is not None}
+    validos = set()
+    if pedidos:
+        validos = set(
+            (await db.execute(select(Dispositivo.id).where(Dispositivo.id.in_(pedidos)))).scalars().all()
+        )
+
+    # un archivo que supera el tope (413) falla solo su item
+    leidos: list[bytes | HTTPException] = []
+    for f in files:
+        try:
+            leidos.append(await read_upload_capped(f))
+        except HTTPException as e:
+            leidos.append(e)
+    leibles = [i for i, r in enumerate(leidos) if not isinstance(r, HTTPException)]
+    procesados = list(leidos)
+    for i, img in zip(leibles, await procesar_lote([leidos[i] for i in leibles])):
+        procesados[i] = img
+
+    resultados: list[dict] = [None] * len(lote)
+    entradas, posiciones = [], []
+    for i, (it, img) in enumerate(zip(lote, procesados)):
+        if isinstance(img, HTTPException):
+            resultados[i] = {"index": i, "ok": False, "status_code": img.status_code, "detail": img.detail}
+            continue
+        disp = dispositivo_id
+        if it.dispositivo_id is not None:
+            disp = it.dispositivo_id if it.dispositivo_id in validos else None
+        entradas.append({"fecha_reporte": it.fecha_reporte, "origen": it.origen, "dispositivo_id": disp, "img": img})
+        posiciones.append(i)
+
+    if entradas:
+        guardados = await ingest_lote(db, cliente_id=cliente_id, centro_id=centro_id, entradas=entradas)
+        for i, r in zip(posiciones, guardados):
+            resultados[i] = {"index": i, "ok": True, **r}
+
+    print(f"[upload-batch] centro={centro_id} items={len(lote)} ok={len(entradas)}", flush=True)
+    return {"centro_id": centro_id, "resultados": resultados}
+
+
+
+# =========================
+# SUBIR CAPTURA ASÍNCRONA (spool en disco -> 202 + ticket)
+# =========================
+@router.post("/upload/spool", status_code=202)
+async def upload_captura_spool(
+    uuid_equipo: Optional[str] = Form(None),
+    cliente_id: Optional[int] = Form(None),
+    centro_id: Optional[int] = Form(None),
+    dispositivo_id: Optional[int] = Form(None),
+    fecha_reporte: date = Form(...),
+    origen: str = Form("auto"),
+    orden_id: Optional[int] = Form(None),
+    file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Igual que /upload pero sin Pillow en el request: guarda el archivo en el spool
+    (fsync) y responde 202. Las retomas se procesan antes que las automáticas.
+    Con Idempotency-Key, un upload ya aplicado responde 200 con su resultado y el
+    worker registra la clave al ingestarlo (un reintento encolado dos veces no duplica).
+    """
+    idem_key = idempotency.normalizar(idempotency_header, idempotency_key)
+    previo = await idempotency.buscar(db, "upload", idem_key)
+    if previo:
+        print(f"[upload-spool] idempotency-key repetida -> {previo}", flush=True)
+        return JSONResponse(previo, status_code=200)
+
+    raw = await read_upload_capped(file)
+    ticket = await ingest_spool.submit(raw, {
+        "uuid_equipo": uuid_equipo,
+        "cliente_id": cliente_id,
+        "centro_id": centro_id,
+        "dispositivo_id": dispositivo_id,
+        "fecha_reporte": fecha_reporte.isoformat(),
+        "origen": origen,
+        "orden_id": orden_id,
+        "idempotency_key": idem_key,
+    })
+    print(f"[upload-spool] ticket={ticket} uuid={uuid_equipo!r} fecha={fecha_reporte} origen={origen}", flush=True)
+    return {"ticket": ticket, "estado": "pendiente", "estado_url": f"/api/capturas/upload/spool/{ticket}"}
+
+
+@router.get("/upload/spool/{ticket}")
+async def estado_ticket_spool(ticket: str):
+    rec = ingest_spool.estado(ticket)
+    if not rec:
+        raise HTTPException(status_code=404, detail="ticket no encontrado")
+    return JSONResponse(rec, headers={"Cache-Control": "no-store, max-age=0"})
+
+
+# =========================
+# UPLOAD REANUDABLE POR TROZOS (enlaces inestables)
+# =========================
+@router.post("/upload/sesiones", status_code=201)
+async def crear_sesion_upload(
+    size: int = Form(...),
+    uuid_equipo: Optional[str] = Form(None),
+    cliente_id: Optional[int] = Form(None),
+    centro_id: Optional[int] = Form(None),
+    dispositivo_id: Optional[int] = Form(None),
+    fecha_reporte: date = Form(...),
+    origen: str = Form("auto"),
+    orden_id: Optional[int] = Form(None),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Abre una sesión para subir `size` bytes en trozos; el destino se resuelve al finalizar."""
+    ses = await asyncio.to_thread(upload_sessions.crear, size, {
+        "uuid_equipo": uuid_equipo,
+        "cliente_id": cliente_id,
+        "centro_id": centro_id,
+        "dispositivo_id": dispositivo_id,
+        "fecha_reporte": fecha_reporte.isoformat(),
+        "origen": origen,
+        "orden_id": orden_id,
+        "idempotency_key": idempotency.normalizar(idempotency_header, idempotency_key),
+    })
+    print(f"[upload-ses] nueva {ses['session_id']} size={size} uuid={uuid_equipo!r} origen={origen}", flush=True)
+    return ses
+
+
+@router.get("/upload/sesiones/{session_id}")
+async def estado_sesion_upload(session_id: str):
+    ses = upload_sessions.consultar(session_id)
+    return JSONResponse(
+        ses,
+        headers={"Upload-Offset": str(ses["offset"]), "Cache-Control": "no-store, max-age=0"},
+    )
+
+
+@router.put("/upload/sesiones/{session_id}")
+async def subir_trozo_upload(session_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Cuerpo = bytes crudos del trozo que empieza en `offset`."""
+    chunk = await read_body_capped(request, settings.upload_chunk_max)
+    ses = await upload_sessions.agregar_trozo(session_id, offset, chunk)
+    return JSONResponse(ses, headers={"Upload-Offset": str(ses["offset"])})
+
+
+@router.post("/upload/sesiones/{session_id}/finalizar")
+async def finalizar_sesion_upload(session_id: str, db: AsyncSession = Depends(get_db)):
+    """
+    Con todos los bytes recibidos, sigue el mismo camino que /upload. Repetir la
+    llamada devuelve el resultado ya guardado sin crear otra versión.
+    """
+    async with upload_sessions.lock(session_id):
+        ses = upload_sessions.consultar(session_id)
+        if ses["resultado"]:
+            return ses["resultado"]
+        meta, raw = await upload_sessions.leer_completo(session_id)
+        res = await idempotency.buscar(db, "upload", meta.get("idempotency_key"))
+        if res:
+            # la misma captura ya entró por /upload directo
+            await asyncio.to_thread(upload_sessions.marcar_finalizada, session_id, meta, res)
+            return res
+
+        cliente_id, centro_id, dispositivo_id = await resolver_destino(
+            db, meta.get("uuid_equipo"), meta.get("cliente_id"), meta.get("centro_id"), meta.get("dispositivo_id")
+        )
+        img = await procesar_imagen(raw)
+        res = await ingest_captura(
+            db,
+            cliente_id=cliente_id,
+            centro_id=centro_id,
+            dispositivo_id=dispositivo_id,
+            fecha_reporte=date.fromisoformat(meta["fecha_reporte"]),
+            origen=meta.get("origen") or "auto",
+            img=img,
+            idempotency_key=meta.get("idempotency_key"),
+            orden_id=meta.get("orden_id"),
+        )
+        await asyncio.to_thread(upload_sessions.marcar_finalizada, session_id, meta, res)
+    print(f"[upload-ses] {session_id} finalizada -> {res}", flush=True)
+    return res
+
+
 @router.post("/{captura_id}/version")
 async def subir_version_captura(
     captura_id: int,
     file: UploadFile = File(...),
     origen: str = Form("manual"),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_header: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db),
 ):
+    scope = f"version:{captura_id}"
+    idem_key = idempotency.normalizar(idempotency_header, idempotency_key)
+    previo = await idempotency.buscar(db, scope, idem_key)
+    if previo:
+        return {"ok": True, "version_id": previo["version_id"]}
+
     cap = (
         await db.execute(select(Captura).where(Captura.id == captura_id))
     ).scalar_one_or_none()
     if not cap:
         raise HTTPException(status_code=404, detail="captura no encontrada")
 
-    raw = await file.read()
-    bytes_, ctype, w, h, size = to_webp_bytes(raw)
+    raw = await read_upload_capped(file)
+    img = await procesar_imagen(raw)
 
-    version = CapturaVersion(
-        captura_id=captura_id,
-        origen=origen,
-        imagen_bytes=bytes_,
-        content_type=ctype,
-        ancho=w,
-        alto=h,
-        peso_bytes=size,
-    )
-    db.add(version)
-    await db.commit()
-    await db.refresh(version)
-    _save_thumb(version.id, bytes_, max_w=360, quality=70)
-    return {"ok": True, "version_id": version.id}
+    version = await agregar_version(db, captura_id, origen, img)
+    res = await confirmar_version(db, version, img, scope, idem_key)
+    return {"ok": True, "version_id": res["version_id"]}
 
 
 @router.post("/create")
@@ -210,29 +441,16 @@ async def crear_captura_vacia(
     payload: CapturaCreate,
     db: AsyncSession = Depends(get_db),
 ):
-    # ┬┐ya existe una captura para esa combinaci├│n y fecha?
-    cap = (
-        await db.execute(
-            select(Captura).where(
-                Captura.cliente_id == payload.cliente_id,
-                Captura.centro_id == payload.centro_id,
-                Captura.dispositivo_id == payload.dispositivo_id,
-                Captura.fecha_reporte == payload.fecha_reporte,
-            )
-        )
-    ).scalar_one_or_none()
-
-    if not cap:
-        cap = Captura(
-            cliente_id=payload.cliente_id,
-            centro_id=payload.centro_id,
-            dispositivo_id=payload.dispositivo_id,
-            fecha_reporte=payload.fecha_reporte,
-            estado=payload.estado or "pendiente",
-        )
-        db.add(cap)
-        await db.commit()
-        await db.refresh(cap)
+    # upsert: si ya existe la captura de ese centro/dispositivo/fecha se devuelve esa
+    cap = await upsert_captura(
+        db,
+        payload.cliente_id,
+        payload.centro_id,
+        payload.dispositivo_id,
+        payload.fecha_reporte,
+        estado=payload.estado or "pendiente",
+    )
+    await db.commit()
 
     return {
         "id": cap.id,
@@ -262,35 +480,12 @@ async def retomar_captura(
     target = fecha or date.today()
 
     # 2) Buscar/crear captura para esa fecha (mismo cliente/centro/dispositivo)
-    same = (
-        await db.execute(
-            select(Captura).where(
-                Captura.cliente_id == base.cliente_id,
-                Captura.centro_id == base.centro_id,
-                Captura.dispositivo_id == base.dispositivo_id,
-                Captura.fecha_reporte == target,
-            )
-        )
-    ).scalar_one_or_none()
-
-    if not same:
-        same = Captura(
-            cliente_id=base.cliente_id,
-            centro_id=base.centro_id,
-            dispositivo_id=base.dispositivo_id,
-            fecha_reporte=target,
-            estado="pendiente",
-        )
-        db.add(same)
-        await db.flush()
+    same = await upsert_captura(db, base.cliente_id, base.centro_id, base.dispositivo_id, target)
 
     # 3) Crear orden apuntando a la captura de esa fecha
 # ÔÜá´©Å NUEVO: traer uuid_equipo desde el centro de esta captura
-    uuid_equipo = (
-        await db.execute(
-            select(Centro.uuid_equipo).where(Centro.id == same.centro_id)
-        )
-    ).scalar_one_or_none()
+    cen = await catalog.centro_por_id(db, same.centro_id)
+    uuid_equipo = cen.uuid_equipo if cen else None
 
 
     orden = OrdenCaptura(
@@ -321,57 +516,20 @@ async def retomar_por_centro(
     db: AsyncSession = Depends(get_db),
 ):
     # 1) Centro existe
-    cen = (await db.execute(select(Centro).where(Centro.id == centro_id))).scalar_one_or_none()
+    cen = await catalog.centro_por_id(db, centro_id)
     if not cen:
         raise HTTPException(status_code=404, detail="centro no encontrado")
 
     target = fecha or date.today()
 
-    # 2) Resolver dispositivo_id si no viene
+    # 2) Resolver dispositivo_id si no viene (último usado por el centro, ya validado)
     if dispositivo_id is None:
-        last_cap = (
-            await db.execute(
-                select(Captura.dispositivo_id)
-                .where(Captura.centro_id == centro_id)
-                .order_by(desc(Captura.created_at))
-                .limit(1)
-            )
-        ).first()
-        dispositivo_id = (last_cap[0] if last_cap and last_cap[0] else None)
-
-    # Ô£à si tenemos un id, verifica que exista realmente en dispositivos
-    if dispositivo_id is not None:
-        from app.models.dispositivos import Dispositivo
-        exists = (
-            await db.execute(
-                select(Dispositivo.id).where(Dispositivo.id == dispositivo_id)
-            )
-        ).scalar_one_or_none()
-        if not exists:
-            dispositivo_id = None  # ÔåÉ no existe, deja NULL
+        dispositivo_id = await catalog.dispositivo_por_defecto(db, centro_id)
+    elif not await catalog.dispositivo_existe(db, dispositivo_id):
+        dispositivo_id = None  # no existe, deja NULL
 
     # 3) Buscar/crear la captura del d├¡a para ese centro+dispositivo
-    cap = (
-        await db.execute(
-            select(Captura).where(
-                Captura.cliente_id == cen.cliente_id,
-                Captura.centro_id == cen.id,
-                Captura.dispositivo_id == dispositivo_id,
-                Captura.fecha_reporte == target,
-            )
-        )
-    ).scalar_one_or_none()
-
-    if not cap:
-        cap = Captura(
-            cliente_id=cen.cliente_id,
-            centro_id=cen.id,
-            dispositivo_id=dispositivo_id,
-            fecha_reporte=target,
-            estado="pendiente",
-        )
-        db.add(cap)
-        await db.flush()
+    cap = await upsert_captura(db, cen.cliente_id, cen.id, dispositivo_id, target)
 
     # 4) Crear la orden hacia el agente
     orden = OrdenCaptura(
@@ -391,33 +549,18 @@ async def retomar_por_centro(
     }
 
 
-
-# =========================
-# LISTAR CAPTURAS (paginado y sin N+1)
-# =========================
-@router.get("")
-async def listar_capturas(
-    cliente_id: int | None = Query(None),
-    centro_id: int | None = Query(None),
-    fecha: date | None = Query(None, description="Fecha objetivo YYYY-MM-DD"),
-    page: int = Query(1, ge=1, description="Pagina (1-indexada)"),
-    page_size: int = Query(15, ge=1, le=100, description="Filas por pagina"),
-    estado: str | None = Query(None, description="Filtrar por estado exacto (case-insensitive)"),
-    online: bool | None = Query(None, description="Filtrar por estado online calculado"),
-    threshold_sec: int = Query(50, ge=5, le=3600, description="Umbral de online en segundos"),
-    db: AsyncSession = Depends(get_db),
+def _board_query(
+    cliente_id: int,
+    centro_id: int | None,
+    target: date,
+    estado: str | None,
+    online: bool | None,
+    limit_dt: datetime,
 ):
     """
-    Devuelve filas paginadas (una por centro) con la ultima captura del dia y su ultima version.
-    Incluye online/last_seen calculado en el backend para evitar N+1 y doble polling en el front.
+    Una fila por centro del cliente con la ultima captura del dia (y el id de su ultima
+    version). Compartida por el listado del board y el sprite de miniaturas.
     """
-    if not cliente_id:
-        return {"items": [], "total": 0, "page": page, "page_size": page_size, "total_pages": 0}
-
-    target = fecha or date.today()
-    now = datetime.now(timezone.utc)
-    ONLINE_THRESHOLD = timedelta(seconds=threshold_sec)
-
     cap_sq = (
         select(
             Captura.id.label("cap_id"),
@@ -427,6 +570,7 @@ async def listar_capturas(
             Captura.observacion.label("cap_observacion"),
             Captura.grabacion.label("cap_grabacion"),
             Captura.fecha_reporte.label("cap_fecha"),
+            Captura.ultima_version_id.label("ver_id"),
             func.row_number()
             .over(partition_by=Captura.centro_id, order_by=Captura.created_at.desc())
             .label("rn"),
@@ -434,17 +578,6 @@ async def listar_capturas(
         .where(Captura.fecha_reporte == target)
     ).subquery()
 
-    ver_sq = (
-        select(
-            CapturaVersion.id.label("ver_id"),
-            CapturaVersion.captura_id.label("ver_captura_id"),
-            CapturaVersion.tomada_en.label("ver_tomada_en"),
-            func.row_number()
-            .over(partition_by=CapturaVersion.captura_id, order_by=CapturaVersion.tomada_en.desc())
-            .label("rn"),
-        )
-    ).subquery()
-
     base = (
         select(
             Centro.id.label("centro_id"),
@@ -460,11 +593,10 @@ async def listar_capturas(
             cap_sq.c.cap_observacion,
             cap_sq.c.cap_grabacion,
             cap_sq.c.cap_fecha,
-            ver_sq.c.ver_id,
-            ver_sq.c.ver_tomada_en,
+            # puntero desnormalizado (app.services.ultima): sin ventana sobre captura_versiones
+            cap_sq.c.ver_id,
         )
         .join(cap_sq, and_(cap_sq.c.cap_centro_id == Centro.id, cap_sq.c.rn == 1), isouter=True)
-        .join(ver_sq, and_(ver_sq.c.ver_captura_id == cap_sq.c.cap_id, ver_sq.c.rn == 1), isouter=True)
         .where(Centro.cliente_id == cliente_id)
     )
 
@@ -475,12 +607,42 @@ async def listar_capturas(
         base = base.where(func.lower(cap_sq.c.cap_estado) == estado.lower())
 
     if online is not None:
-        limit_dt = now - ONLINE_THRESHOLD
         if online:
             base = base.where(and_(Centro.last_seen.is_not(None), Centro.last_seen >= limit_dt))
         else:
             base = base.where(or_(Centro.last_seen.is_(None), Centro.last_seen < limit_dt))
 
+    return base
+
+
+# =========================
+# LISTAR CAPTURAS (paginado y sin N+1)
+# =========================
+@router.get("")
+async def listar_capturas(
+    cliente_id: int | None = Query(None),
+    centro_id: int | None = Query(None),
+    fecha: date | None = Query(None, description="Fecha objetivo YYYY-MM-DD"),
+    page: int = Query(1, ge=1, description="Pagina (1-indexada)"),
+    page_size: int = Query(15, ge=1, le=100, description="Filas por pagina"),
+    estado: str | None = Query(None, description="Filtrar por estado exacto (case-insensitive)"),
+    online: bool | None = Query(None, description="Filtrar por estado online calculado"),
+    threshold_sec: int = Query(50, ge=5, le=3600, description="Umbral de online en segundos"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Devuelve filas paginadas (una por centro) con la ultima captura del dia y su ultima version.
+    Incluye online/last_seen calculado en el backend para evitar N+1 y doble polling en el front.
+    """
+    if not cliente_id:
+        return {"items": [], "total": 0, "page": page, "page_size": page_size, "total_pages": 0}
+
+    target = fecha or date.today()
+    now = datetime.now(timezone.utc)
+    ONLINE_THRESHOLD = timedelta(seconds=threshold_sec)
+
+    base = _board_query(cliente_id, centro_id, target, estado, online, now - ONLINE_THRESHOLD)
+
     subq = base.subquery()
     total_res = await db.execute(select(func.count()).select_from(subq))
     total = int(total_res.scalar_one() or 0)
@@ -565,48 +727,270 @@ async def listar_capturas(
 # =========================
 @router.get("/{captura_id}/estado")
 async def estado_captura(captura_id: int, db: AsyncSession = Depends(get_db)):
-    # ├║ltima version id + timestamp
+    # ultima version id + timestamp, desde el puntero de la captura (una lectura por PK)
     res = await db.execute(
         select(
-            CapturaVersion.id.label("ultima_version_id"),
-            CapturaVersion.tomada_en.label("tomada_en"),
-        )
-        .where(CapturaVersion.captura_id == captura_id)
-        .order_by(desc(CapturaVersion.tomada_en))
-        .limit(1)
+            Captura.ultima_version_id,
+            Captura.ultima_tomada_en.label("tomada_en"),
+            Captura.version_count,
+        ).where(Captura.id == captura_id)
     )
     row = res.mappings().first()  # <<< clave: devolver dict-like
 
-    if not row:
-        return {"ultima_version_id": None, "tomada_en": None}
+    if not row or row["ultima_version_id"] is None:
+        return {"ultima_version_id": None, "tomada_en": None, "version_count": 0}
 
     return {
         "ultima_version_id": row["ultima_version_id"],
         "tomada_en": row["tomada_en"].isoformat() if row["tomada_en"] else None,
+        "version_count": row["version_count"],
     }
 
 # =========================
 # OBTENER IMAGEN POR VERSION
 # =========================
 @router.get("/version/{version_id}/image")
-async def get_version_image(version_id: int, db: AsyncSession = Depends(get_db)):
-    v = (
-        await db.execute(
-            select(CapturaVersion).where(CapturaVersion.id == version_id)
+async def get_version_image(request: Request, version_id: int, db: AsyncSession = Depends(get_db)):
+    meta = await version_meta(db, version_id)
+    if not meta or not meta.tiene_imagen:
+        raise HTTPException(status_code=404, detail="sin imagen")
+
+    # blob direccionado por contenido: el hash sirve de ETag fuerte (el pack guarda el mismo hash)
+    content_hash = meta.blob_hash
+    if meta.archivo_pack:
+        content_hash = await asyncio.to_thread(packs.hash_en_pack, meta.archivo_pack, meta.id)
+    etag = f'"{content_hash}"' if content_hash else None
+    inm = request.headers.get("if-none-match")
+    if etag and inm and inm == etag:
+        return Response(status_code=304)
+
+    if meta.archivo_pack:
+        # mes archivado: se copia del pack mapeado en un hilo (el mmap pagina desde disco)
+        data = await asyncio.to_thread(packs.leer_bytes, meta.archivo_pack, meta.id)
+        if data is None:
+            raise HTTPException(status_code=404, detail="sin imagen")
+        return Response(
+            content=data,
+            media_type=meta.content_type or "image/webp",
+            headers={"Cache-Control": "no-cache", "ETag": etag} if etag else {"Cache-Control": "no-cache"},
         )
-    ).scalar_one_or_none()
-    if not v or not v.imagen_bytes:
+
+    headers = {"Cache-Control": "no-cache"} if etag else {"Cache-Control": "no-store, max-age=0"}
+    if etag:
+        headers["ETag"] = etag
+    return await _servir_completa(request, db, meta, headers)
+
+
+async def _servir_completa(
+    request: Request, db: AsyncSession, meta, headers: dict, revisar_cache: bool = True
+) -> Response:
+    """
+    Imagen completa de una versión: desde el cache en memoria; si vive en el store fs,
+    el archivo (sin copiarlo, con Range); si no, cargada y admitida si el cache la acepta
+    por tamaño, o en streaming por trozos.
+    """
+    clave = thumb_key(meta.id, meta.blob_hash)
+    hit = hot_cache.get(clave, "full") if revisar_cache else None
+    if hit:
+        return Response(content=hit[0], media_type=hit[1], headers=headers)
+    media_type = meta.content_type or "image/webp"
+    ruta = await ruta_local(db, meta)
+    if ruta is not None:
+        resp = await responder_archivo(request, ruta, media_type=media_type, headers=headers)
+        if resp is not None:
+            return resp
+    if hot_cache.admitiria(clave, "full", meta.peso_bytes):
+        data = await version_bytes(db, meta.id)
+        if data:
+            hot_cache.put(clave, "full", data, media_type)
+            return Response(content=data, media_type=media_type, headers=headers)
+
+    fuente = await abrir_stream(db, meta)
+    if not fuente:
         raise HTTPException(status_code=404, detail="sin imagen")
-    return StreamingResponse(
-        BytesIO(v.imagen_bytes),
-        media_type=v.content_type or "image/webp",
-        headers={"Cache-Control": "no-store, max-age=0"},
+    size, chunks = fuente
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+# =========================
+# OBTENER VARIANTE (thumb / pdf / placeholder) POR VERSION
+# =========================
+@router.get("/version/{version_id}/rendition/{variante}")
+async def get_version_rendition(
+    request: Request, version_id: int, variante: str, db: AsyncSession = Depends(get_db)
+):
+    if variante not in RENDITIONS:
+        raise HTTPException(status_code=404, detail="variante desconocida")
+    blob_hash = (
+        await db.execute(select(CapturaVersion.blob_hash).where(CapturaVersion.id == version_id))
+    ).scalar_one_or_none()
+    rend = await get_rendition(db, blob_hash, variante)
+    if not rend:
+        raise HTTPException(status_code=404, detail="sin variante")
+
+    etag = f'"{blob_hash}-{variante}"'
+    inm = request.headers.get("if-none-match")
+    if inm and inm == etag:
+        return Response(status_code=304)
+    headers = {
+        "Cache-Control": "public, max-age=86400",
+        "ETag": etag,
+        "X-Image-Size": f"{rend.ancho}x{rend.alto}",
+    }
+    clave = thumb_key(version_id, blob_hash)
+    hit = hot_cache.get(clave, f"r-{variante}")
+    if hit:
+        return Response(content=hit[0], media_type=hit[1], headers=headers)
+    ruta = await ruta_rendition(rend)
+    if ruta is not None:
+        resp = await responder_archivo(request, ruta, media_type=rend.content_type or "image/webp", headers=headers)
+        if resp is not None:
+            return resp
+    data = await rendition_bytes(db, rend)
+    if not data:
+        raise HTTPException(status_code=404, detail="sin variante")
+    media_type = rend.content_type or "image/webp"
+    hot_cache.put(clave, f"r-{variante}", data, media_type)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+# =========================
+# SPRITE DE MINIATURAS (una imagen + mapa de offsets por pagina del board)
+# =========================
+_SPRITE_MAX_CELDAS = 200
+
+
+def _parse_ids(valor: str | None, nombre: str) -> list[int]:
+    if not valor:
+        return []
+    try:
+        ids = [int(x) for x in valor.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{nombre}: lista de enteros separados por coma")
+    if len(ids) > _SPRITE_MAX_CELDAS:
+        raise HTTPException(status_code=422, detail=f"{nombre}: máximo {_SPRITE_MAX_CELDAS} ids")
+    return ids
+
+
+@router.get("/sprite")
+async def sprite_miniaturas(
+    captura_ids: str | None = Query(None, description="ids de captura separados por coma (ultima version de cada una)"),
+    version_ids: str | None = Query(None, description="ids de version separados por coma"),
+    cliente_id: int | None = Query(None, description="sin ids: la misma pagina que GET /api/capturas"),
+    centro_id: int | None = Query(None),
+    fecha: date | None = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(15, ge=1, le=100),
+    estado: str | None = Query(None),
+    online: bool | None = Query(None),
+    threshold_sec: int = Query(50, ge=5, le=3600),
+    max_w: int = Query(180, ge=64, le=360, description="ancho de celda"),
+    quality: int = Query(70, ge=40, le=95),
+    cols: int = Query(10, ge=1, le=20),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Mapa de offsets + URL de un sprite con la miniatura de cada captura/version pedida.
+    El sprite se cachea por la tupla de version_id: si ninguna captura cambio, la URL es
+    la misma y el navegador la reutiliza (immutable).
+    """
+    max_w, quality = snap(max_w, quality)
+    cell_h = max(1, round(max_w * 9 / 16))
+
+    if version_ids:
+        vids = _parse_ids(version_ids, "version_ids")
+        por_id = await metas_de_versiones(db, vids)
+        celdas = [(por_id[v].captura_id if v in por_id else None, por_id.get(v)) for v in vids]
+    else:
+        if captura_ids:
+            cids = _parse_ids(captura_ids, "captura_ids")
+        elif cliente_id:
+            now = datetime.now(timezone.utc)
+            base = _board_query(
+                cliente_id, centro_id, fecha or date.today(), estado, online,
+                now - timedelta(seconds=threshold_sec),
+            )
+            filas = (
+                await db.execute(
+                    base.order_by(Centro.nombre.asc(), Centro.id.asc())
+                    .offset((page - 1) * page_size)
+                    .limit(page_size)
+                )
+            ).mappings().all()
+            cids = [r["cap_id"] for r in filas if r["cap_id"]]
+        else:
+            raise HTTPException(status_code=422, detail="indicar captura_ids, version_ids o cliente_id")
+        por_cap = await metas_de_capturas(db, cids)
+        celdas = [(c, por_cap.get(c)) for c in cids]
+
+    metas = [m if m is not None and m.tiene_imagen else None for _, m in celdas]
+    ancho, alto, pos = sprites.layout(len(celdas), cols, max_w, cell_h)
+    if alto > 16383:
+        raise HTTPException(status_code=422, detail="demasiadas filas para un sprite; subir cols o bajar max_w")
+    cols_efectivas = ancho // max_w
+    key = sprites.sprite_key(
+        [thumb_key(m.id, m.blob_hash) if m else None for m in metas], max_w, quality, cols_efectivas, cell_h
     )
+    if any(metas):
+        try:
+            await sprites.asegurar(db, key, metas, max_w, cell_h, quality, cols_efectivas)
+        except ImagePoolSaturated as e:
+            raise HTTPException(
+                status_code=503,
+                detail="procesador de imágenes saturado, reintente más tarde",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+    items = [
+        {
+            "captura_id": cid,
+            "version_id": m.id if m else None,
+            **({"x": x, "y": y, "w": max_w, "h": cell_h} if m else {}),
+        }
+        for (cid, _), m, (x, y) in zip(celdas, metas, pos)
+    ]
+    return {
+        "sprite_url": f"/api/capturas/sprite/{key}?w={max_w}&q={quality}" if any(metas) else None,
+        "ancho": ancho,
+        "alto": alto,
+        "celda": {"w": max_w, "h": cell_h},
+        "items": items,
+    }
+
+
+@router.get("/sprite/{key}")
+async def get_sprite(
+    request: Request,
+    key: str,
+    w: int = Query(..., ge=64, le=360),
+    q: int = Query(..., ge=40, le=95),
+):
+    """Imagen del sprite (clave de contenido: cache largo e inmutable). 404 si se desalojo: pedir el mapa de nuevo."""
+    if len(key) != 33 or key[0] != "s" or any(c not in "0123456789abcdef" for c in key[1:]):
+        raise HTTPException(status_code=404, detail="sprite desconocido")
+    etag = f'"{key}-w{w}-q{q}"'
+    inm = request.headers.get("if-none-match")
+    if inm and inm == etag:
+        return Response(status_code=304)
+    ruta = await asyncio.to_thread(thumb_en_disco, key, w, q)
+    resp = None
+    if ruta is not None:
+        headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+        resp = await responder_archivo(request, ruta, media_type="image/webp", headers=headers)
+    if resp is None:
+        raise HTTPException(status_code=404, detail="sprite no disponible")
+    return resp
 
 
 # =========================
 # OBTENER MINIATURA OPTIMIZADA (con ETag/304)
 # =========================
+def _etag_ultima(version_id: int, clave: str, sufijo: str) -> str:
+    """ETag débil de /ultima: versión + prefijo de la clave de contenido (cambia si se compacta)."""
+    return f'W/"capv-{version_id}-{clave[:17]}-{sufijo}"'
+
+
 @router.get("/{captura_id}/ultima/thumb")
 async def get_ultima_thumb(
     request: Request,
@@ -615,64 +999,78 @@ async def get_ultima_thumb(
     quality: int = Query(70, ge=40, le=95),
     db: AsyncSession = Depends(get_db),
 ):
-    v = (
-        await db.execute(
-            select(CapturaVersion)
-            .where(CapturaVersion.captura_id == captura_id)
-            .order_by(desc(CapturaVersion.tomada_en))
-            .limit(1)
-        )
-    ).scalar_one_or_none()
-    if not v or not v.imagen_bytes:
+    # pocos tamaños posibles: el cache en disco no crece con cada combinación pedida
+    max_w, quality = snap(max_w, quality)
+    variante = f"thumb-w{max_w}-q{quality}"
+
+    # camino rápido: la ETag y el cache en memoria solo dependen de la última versión y
+    # de su contenido (puntero en capturas + PK de la versión), así que el 304 no lee bytes
+    ult = await ultima.version(db, captura_id)
+    if ult is None:
         raise HTTPException(status_code=404, detail="sin imagen")
-
-    etag = f'W/"capv-{v.id}-w{max_w}-q{quality}"'
+    clave = thumb_key(*ult)
+    etag = _etag_ultima(ult[0], clave, f"w{max_w}-q{quality}")
     inm = request.headers.get("if-none-match")
     if inm and inm == etag:
         return Response(status_code=304)
 
-    # path en disco para cache persistente
-    cache_path = THUMB_DIR / f"thumb_v{v.id}_w{max_w}_q{quality}.webp"
-    if cache_path.exists():
-        data = cache_path.read_bytes()
-        headers = {
-            "Cache-Control": "public, max-age=300, stale-while-revalidate=120",
-            "ETag": etag,
-        }
-        return Response(content=data, media_type="image/webp", headers=headers)
-
-    try:
-        from PIL import Image
-        import io
-
-        img = Image.open(BytesIO(v.imagen_bytes))
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGB")
+    headers = {
+        "Cache-Control": "public, max-age=300, stale-while-revalidate=120",
+        "ETag": etag,
+    }
+    # 1) memoria del proceso; 2) cache persistente en disco (compartido entre versiones con el mismo contenido)
+    hit = hot_cache.get(clave, variante)
+    if hit:
+        return Response(content=hit[0], media_type=hit[1], headers=headers)
 
-        w, h = img.size
-        if w > max_w:
-            scale = max_w / float(w)
-            img = img.resize((int(w * scale), int(h * scale)))
+    v = await ultima_version_meta(db, captura_id)
+    if not v or not v.tiene_imagen:
+        raise HTTPException(status_code=404, detail="sin imagen")
+    key = thumb_key(v.id, v.blob_hash)
+    if key != clave:
+        # llegó una versión nueva (o se compactó) entre las dos lecturas
+        headers["ETag"] = _etag_ultima(v.id, key, f"w{max_w}-q{quality}")
+    ruta = await asyncio.to_thread(thumb_en_disco, key, max_w, quality)
+    if ruta is not None:
+        # sin leer el archivo: sendfile/pread por trozos, con Last-Modified y Range
+        resp = await responder_archivo(request, ruta, media_type="image/webp", headers=headers)
+        if resp is not None:
+            return resp
+
+    # variante estándar del board: ya se generó en el ingest, no hace falta decodificar
+    thumb_w, _, thumb_q = RENDITIONS["thumb"]
+    if (max_w, quality) == (thumb_w, thumb_q):
+        rend = await get_rendition(db, v.blob_hash, "thumb")
+        data = await rendition_bytes(db, rend)
+        if data:
+            await asyncio.to_thread(save_thumb, key, data, max_w, quality)
+            media_type = rend.content_type or "image/webp"
+            hot_cache.put(key, variante, data, media_type)
+            return Response(content=data, media_type=media_type, headers=headers)
+
+    raw = await version_bytes(db, v.id)
+    if not raw:
+        raise HTTPException(status_code=404, detail="sin imagen")
 
-        out = io.BytesIO()
-        img.save(out, format="WEBP", quality=quality, method=6)
-        data = out.getvalue()
+    # decode + resize + encode en el pool de procesos, no en el event loop
+    try:
+        res = await image_pool.run(generar_thumbs, raw, [(max_w, quality)])
+        data = res["thumbs"][(max_w, quality)]
         media_type = "image/webp"
+    except ImagePoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="procesador de imágenes saturado, reintente más tarde",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         print(f"[thumb] WARNING captura_id={captura_id} fallback original: {e!r}", flush=True)
-        data = v.imagen_bytes
+        data = raw
         media_type = v.content_type or "application/octet-stream"
 
-    # Guardar en disco para reutilizar
-    try:
-        cache_path.write_bytes(data)
-    except Exception as e:
-        print(f"[thumb] WARNING no se pudo escribir cache {cache_path}: {e!r}", flush=True)
-
-    headers = {
-        "Cache-Control": "public, max-age=300, stale-while-revalidate=120",
-        "ETag": etag,
-    }
+    # Guardar en disco (y en memoria) para reutilizar
+    await asyncio.to_thread(save_thumb, key, data, max_w, quality)
+    hot_cache.put(key, variante, data, media_type)
     return Response(content=data, media_type=media_type, headers=headers)
 
 
@@ -681,20 +1079,12 @@ async def get_ultima_thumb(
 # =========================
 @router.get("/{captura_id}/ultima/image")
 async def get_ultima_image(request: Request, captura_id: int, db: AsyncSession = Depends(get_db)):
-    v = (
-        await db.execute(
-            select(CapturaVersion)
-            .where(CapturaVersion.captura_id == captura_id)
-            .order_by(desc(CapturaVersion.tomada_en))
-            .limit(1)
-        )
-    ).scalar_one_or_none()
-
-    if not v or not v.imagen_bytes:
+    # ETag por version-id y contenido para permitir 304 (camino rápido: puntero de la captura)
+    ult = await ultima.version(db, captura_id)
+    if ult is None:
         raise HTTPException(status_code=404, detail="sin imagen")
-
-    # ETag basada en version-id para permitir 304
-    etag = f"W/\"capv-{v.id}-full\""
+    clave = thumb_key(*ult)
+    etag = _etag_ultima(ult[0], clave, "full")
     inm = request.headers.get("if-none-match")
     if inm and inm == etag:
         return Response(status_code=304)
@@ -704,7 +1094,18 @@ async def get_ultima_image(request: Request, captura_id: int, db: AsyncSession =
         "Cache-Control": "public, max-age=120, stale-while-revalidate=60",
         "ETag": etag,
     }
-    return Response(content=v.imagen_bytes, media_type=v.content_type or "image/webp", headers=headers)
+    hit = hot_cache.get(clave, "full")
+    if hit:
+        return Response(content=hit[0], media_type=hit[1], headers=headers)
+
+    v = await ultima_version_meta(db, captura_id)
+    if not v or not v.tiene_imagen:
+        raise HTTPException(status_code=404, detail="sin imagen")
+    key = thumb_key(v.id, v.blob_hash)
+    if key != clave:
+        headers["ETag"] = _etag_ultima(v.id, key, "full")
+    # el cache en memoria ya se consultó para esa clave
+    return await _servir_completa(request, db, v, headers, revisar_cache=key != clave)
 
 
 @router.patch("/{captura_id}")
@@ -717,18 +1118,45 @@ async def actualizar_captura(
     if not cap:
         raise HTTPException(status_code=404, detail="captura no encontrada")
 
-    if payload.fecha_reporte is not None:
-        cap.fecha_reporte = payload.fecha_reporte
-    if payload.estado is not None:
-        cap.estado = payload.estado
-    if payload.observacion is not None:
-        cap.observacion = payload.observacion
-    if payload.grabacion is not None:
-        cap.grabacion = payload.grabacion
-    if payload.dispositivo_id is not None:         # ­ƒæê faltaba aplicar el cambio
-        cap.dispositivo_id = payload.dispositivo_id
+    nueva_fecha = payload.fecha_reporte if payload.fecha_reporte is not None else cap.fecha_reporte
+    nuevo_disp = payload.dispositivo_id if payload.dispositivo_id is not None else cap.dispositivo_id
+    centro_id = cap.centro_id
+    try:
+        if (nueva_fecha, nuevo_disp) != (cap.fecha_reporte, cap.dispositivo_id):
+            # otro día/dispositivo: puede chocar con ux_capturas_centro_disp_fecha.
+            # El rollup de almacenamiento va por fecha_reporte: mover las versiones de día.
+            await uso.restar_versiones(db, CapturaVersion.captura_id == cap.id)
+            cap.fecha_reporte = nueva_fecha
+            cap.dispositivo_id = nuevo_disp
+            await db.flush()
+            await uso.sumar_versiones(db, CapturaVersion.captura_id == cap.id)
+        if payload.estado is not None:
+            cap.estado = payload.estado
+        if payload.observacion is not None:
+            cap.observacion = payload.observacion
+        if payload.grabacion is not None:
+            cap.grabacion = payload.grabacion
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        otra = (
+            await db.execute(
+                select(Captura.id).where(
+                    Captura.centro_id == centro_id,
+                    func.coalesce(Captura.dispositivo_id, 0) == (nuevo_disp or 0),
+                    Captura.fecha_reporte == nueva_fecha,
+                    Captura.id != captura_id,
+                )
+            )
+        ).scalar_one_or_none()
+        if otra is None:
+            # otra restricción (p.ej. dispositivo_id inexistente)
+            raise HTTPException(status_code=409, detail="no se pudo actualizar la captura (restricción de la BD)")
+        raise HTTPException(
+            status_code=409,
+            detail=f"ya existe la captura {otra} de ese centro/dispositivo para esa fecha",
+        )
 
-    await db.commit()
     await db.refresh(cap)
     return {
         "id": cap.id,
@@ -753,8 +1181,11 @@ async def eliminar_captura(
         raise HTTPException(status_code=404, detail="captura no encontrada")
 
     # Eliminamos versiones expl├¡citamente por si el FK no tiene ON DELETE CASCADE
+    freed = await release_versions(db, CapturaVersion.captura_id == captura_id)
+    await uso.restar_versiones(db, CapturaVersion.captura_id == captura_id)
     await db.execute(delete(CapturaVersion).where(CapturaVersion.captura_id == captura_id))
     await db.delete(cap)
     await db.commit()
+    await purge_freed(db, freed)
     return {"ok": True}
 
@@ -15,6 +15,8 @@ from sqlalchemy import delete
 from app.models.capturas import Captura, CapturaVersion
 from app.models.ordenes import OrdenCaptura
 from app.models.dispositivos import Dispositivo
+from app.services import catalog, uso
+from app.services.blobs import purge_freed, release_versions
 
 import asyncio
 
@@ -78,6 +80,8 @@ async def crear_centro(payload: CentroCreate, db: AsyncSession = Depends(get_db)
     db.add(cen)
     await db.commit()
     await db.refresh(cen)
+    # un agente pudo haber consultado este uuid antes de que existiera (404 cacheado)
+    catalog.invalidar_centro(centro_id=cen.id, uuids=[cen.uuid_equipo])
     return {
         "id": cen.id,
         "cliente_id": cen.cliente_id,
@@ -127,6 +131,7 @@ async def actualizar_centro(centro_id: int, payload: CentroUpdate, db: AsyncSess
         cen.observacion = payload.observacion
     if payload.grabacion is not None:
         cen.grabacion = payload.grabacion
+    old_uuid = cen.uuid_equipo
     if payload.uuid_equipo is not None:
         new_uuid = payload.uuid_equipo or slugify(cen.nombre)
         if new_uuid != cen.uuid_equipo:
@@ -137,6 +142,7 @@ async def actualizar_centro(centro_id: int, payload: CentroUpdate, db: AsyncSess
 
     await db.commit()
     await db.refresh(cen)
+    catalog.invalidar_centro(centro_id=cen.id, uuids=[old_uuid, cen.uuid_equipo])
     return {
         "id": cen.id,
         "cliente_id": cen.cliente_id,
@@ -159,8 +165,10 @@ async def eliminar_centro(centro_id: int, db: AsyncSession = Depends(get_db)):
         r[0] for r in (await db.execute(select(Captura.id).where(Captura.centro_id == centro_id))).all()
     ]
 
+    freed = []
     if cap_ids:
-        # 2) borrar versiones
+        # 2) borrar versiones (liberando antes sus blobs compartidos)
+        freed = await release_versions(db, CapturaVersion.captura_id.in_(cap_ids))
         await db.execute(delete(CapturaVersion).where(CapturaVersion.captura_id.in_(cap_ids)))
         # 3) borrar órdenes
         await db.execute(delete(OrdenCaptura).where(OrdenCaptura.captura_id.in_(cap_ids)))
@@ -170,39 +178,24 @@ async def eliminar_centro(centro_id: int, db: AsyncSession = Depends(get_db)):
     # 5) (opcional) borrar dispositivos del centro
     await db.execute(delete(Dispositivo).where(Dispositivo.centro_id == centro_id))
 
-    # 6) borrar el centro
+    # 6) borrar el centro (y su rollup de almacenamiento)
+    await uso.olvidar(db, centro_id=centro_id)
     await db.delete(cen)
 
     await db.commit()
+    # también se borraron sus dispositivos: se descarta el catálogo completo
+    catalog.invalidar_todo()
+    await purge_freed(db, freed)
     return {"ok": True}
 
 @router.get("/resolve")
 async def resolve_por_uuid(uuid_equipo: str, db: AsyncSession = Depends(get_db)):
-    cen = (await db.execute(select(Centro).where(Centro.uuid_equipo == uuid_equipo))).scalar_one_or_none()
+    cen = await catalog.centro_por_uuid(db, uuid_equipo)
     if not cen:
         raise HTTPException(status_code=404, detail="uuid_equipo no encontrado")
 
-    # Dispositivo "por defecto": último usado en este centro, o 1 si no hay historial
-    last = (
-        await db.execute(
-            select(Captura.dispositivo_id)
-            .where(Captura.centro_id == cen.id)
-            .order_by(desc(Captura.created_at))
-            .limit(1)
-        )
-    ).first()
-    dispositivo_id = (last[0] if last and last[0] else None)
-
-    # valida existencia
-    if dispositivo_id is not None:
-        from app.models.dispositivos import Dispositivo
-        exists = (
-            await db.execute(
-                select(Dispositivo.id).where(Dispositivo.id == dispositivo_id)
-            )
-        ).scalar_one_or_none()
-        if not exists:
-            dispositivo_id = None
+    # Dispositivo "por defecto": último usado en este centro (validado), o None si no hay historial
+    dispositivo_id = await catalog.dispositivo_por_defecto(db, cen.id)
 
     return {
         "cliente_id": cen.cliente_id,
@@ -6,7 +6,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import get_db
 from app.models.clientes import Cliente
 from app.models.centros import Centro
-from app.models.capturas import Captura
+from app.models.capturas import Captura, CapturaVersion
+from app.services import catalog, uso
+from app.services.blobs import purge_freed, release_versions
 
 
 router = APIRouter(prefix="/api/clientes", tags=["clientes"])
@@ -36,6 +38,7 @@ async def crear(payload: ClienteCreate, db: AsyncSession = Depends(get_db)):
     db.add(cliente)
     await db.commit()
     await db.refresh(cliente)
+    catalog.invalidar_cliente(cliente.id)
     return serialize(cliente)
 
 
@@ -48,6 +51,7 @@ async def actualizar(cliente_id: int, payload: ClienteUpdate, db: AsyncSession =
     cliente.nombre = payload.nombre.strip()
     await db.commit()
     await db.refresh(cliente)
+    catalog.invalidar_cliente(cliente.id)
     return serialize(cliente)
 
 
@@ -58,9 +62,16 @@ async def eliminar(cliente_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cliente no encontrado")
 
     # elimina capturas y centros asociados antes de borrar el cliente
+    # (las versiones caen por cascada; sus blobs compartidos se liberan primero)
+    freed = await release_versions(
+        db, CapturaVersion.captura_id.in_(select(Captura.id).where(Captura.cliente_id == cliente_id))
+    )
     await db.execute(delete(Captura).where(Captura.cliente_id == cliente_id))
     await db.execute(delete(Centro).where(Centro.cliente_id == cliente_id))
+    await uso.olvidar(db, cliente_id=cliente_id)
 
     await db.delete(cliente)
     await db.commit()
+    catalog.invalidar_todo()
+    await purge_freed(db, freed)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
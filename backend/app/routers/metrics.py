@@ -1,11 +1,14 @@
 ﻿# app/routers/metrics.py
-from fastapi import APIRouter, Depends
+from datetime import date
+
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
 from app.models.clientes import Cliente   # ajusta el import segn tu proyecto
 from app.models.centros import Centro     # ajusta el import segn tu proyecto
+from app.services import catalog, hot_cache, image_pool, particiones, thumb_warmer, thumbs, uso
 
 router = APIRouter(prefix="/api/metrics", tags=["metrics"])
 
@@ -38,3 +41,57 @@ async def centros_por_cliente(db: AsyncSession = Depends(get_db)):
     return {"items": items, "total_clientes": total_clientes, "total_centros": total_centros}
 
 
+@router.get("/images")
+async def images_pool_stats():
+    """Estado del pool de transcodificación: en vuelo, rechazos y tiempos por etapa."""
+    return image_pool.stats()
+
+
+@router.get("/catalog")
+async def catalog_cache_stats():
+    """Hits/misses del cache de catálogo (centros/dispositivos por uuid) por tabla."""
+    return catalog.stats()
+
+
+@router.get("/thumbs")
+async def thumbs_cache_stats():
+    """Cache de miniaturas en disco: ocupación vs presupuesto, hits/misses, desalojos y precalentado."""
+    return {**thumbs.stats(), "warmer": thumb_warmer.stats()}
+
+
+@router.get("/hot-cache")
+async def hot_cache_stats():
+    """Cache en memoria de imágenes por (version_id, variante): hits/misses, admisiones y desalojos."""
+    return hot_cache.stats()
+
+
+@router.get("/particiones")
+async def particiones_captura_versiones(db: AsyncSession = Depends(get_db)):
+    """Particiones mensuales de captura_versiones con su rango y tamaño (vacío si no está particionada)."""
+    return {"items": await particiones.listar_particiones(db)}
+
+
+@router.get("/almacenamiento")
+async def almacenamiento(
+    agrupar: str = Query("cliente", pattern="^(cliente|centro|dia)$"),
+    desde: date | None = Query(None, description="fecha_reporte desde (inclusive)"),
+    hasta: date | None = Query(None, description="fecha_reporte hasta (inclusive)"),
+    cliente_id: int | None = Query(None),
+    centro_id: int | None = Query(None),
+    limite: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Versiones y bytes guardados por cliente, centro o día, desde el rollup incremental
+    (sin recorrer captura_versiones). Con `hasta` = hoy - N días da lo que liberaría
+    una retención de N días.
+    """
+    return await uso.consultar(
+        db,
+        agrupar=agrupar,
+        desde=desde,
+        hasta=hasta,
+        cliente_id=cliente_id,
+        centro_id=centro_id,
+        limite=limite,
+    )
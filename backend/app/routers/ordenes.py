@@ -1,7 +1,7 @@
 # app/routers/ordenes.py
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import asyncio
@@ -10,7 +10,7 @@ from app.db.session import get_db
 from app.models.ordenes import OrdenCaptura
 from app.models.capturas import Captura
 from app.models.centros import Centro
-from app.models.dispositivos import Dispositivo  # legado (fallback)
+from app.services import catalog
 
 CHILE_TZ = ZoneInfo("America/Santiago")
 
@@ -39,7 +39,7 @@ async def _find_pending_order_by_uuid(
         return row  # (orden, cap)
 
     # 2) LEGADO #1: si hay centro con ese uuid_equipo, buscar órdenes pendientes cuya captura sea de ese centro
-    cen = (await db.execute(select(Centro).where(Centro.uuid_equipo == uuid_equipo))).scalar_one_or_none()
+    cen = await catalog.centro_por_uuid(db, uuid_equipo)
     if cen:
         q2 = (
             select(OrdenCaptura, Captura)
@@ -56,14 +56,14 @@ async def _find_pending_order_by_uuid(
             return row
 
     # 3) LEGADO #2: camino original por dispositivos (si aún los usas)
-    d = (await db.execute(select(Dispositivo).where(Dispositivo.uuid_equipo == uuid_equipo))).scalar_one_or_none()
-    if d:
+    disp_id = await catalog.dispositivo_por_uuid(db, uuid_equipo)
+    if disp_id:
         q3 = (
             select(OrdenCaptura, Captura)
             .join(Captura, Captura.id == OrdenCaptura.captura_id)
             .where(
                 OrdenCaptura.estado == "pendiente",
-                Captura.dispositivo_id == d.id,
+                Captura.dispositivo_id == disp_id,
             )
             .order_by(OrdenCaptura.created_at.asc())
             .limit(1)
@@ -90,22 +90,23 @@ async def pull_orden(
     """
 
     # ⬇️⬇️⬇️ NUEVO: comprobar si el centro existe; si no, cortar con 410
-    cen = (await db.execute(select(Centro).where(Centro.uuid_equipo == uuid_equipo))).scalar_one_or_none()
+    cen = await catalog.centro_por_uuid(db, uuid_equipo)
     if not cen:
         # el centro fue eliminado o no existe para ese UUID
         raise HTTPException(status_code=410, detail="centro eliminado para este uuid_equipo")
     # ⬆️⬆️⬆️
 
-    # Actualizar last_seen al inicio del pull
-    cen.last_seen = datetime.now(timezone.utc)
+    # Actualizar last_seen al inicio del pull (UPDATE directo, sin cargar la fila)
+    last_seen = datetime.now(timezone.utc)
+    await db.execute(update(Centro).where(Centro.id == cen.id).values(last_seen=last_seen))
     await db.commit()
 
     # (log opcional)
     try:
         print(
             f"[pull] last_seen actualizado para {uuid_equipo} -> "
-            f"UTC={cen.last_seen.isoformat()}  "
-            f"LOCAL={cen.last_seen.astimezone(CHILE_TZ).isoformat()}",
+            f"UTC={last_seen.isoformat()}  "
+            f"LOCAL={last_seen.astimezone(CHILE_TZ).isoformat()}",
             flush=True
         )
     except Exception:
@@ -141,9 +142,12 @@ async def pull_orden(
 
 @router.post("/{orden_id}/ack")
 async def ack_orden(orden_id: int, db: AsyncSession = Depends(get_db)):
+    # idempotente: el upload con orden_id ya pudo haberla marcado; repetir el ack no escribe
     orden = (await db.execute(select(OrdenCaptura).where(OrdenCaptura.id == orden_id))).scalar_one_or_none()
     if not orden:
         raise HTTPException(status_code=404, detail="orden no encontrada")
+    if orden.estado == "tomada":
+        return {"ok": True, "ya_tomada": True}
     orden.estado = "tomada"
     await db.commit()
     return {"ok": True}
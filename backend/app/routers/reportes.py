@@ -2,7 +2,7 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc, func, and_
+from sqlalchemy import select, desc, func, and_, case, or_
 from datetime import date, datetime, timezone
 from zoneinfo import ZoneInfo
 from reportlab.lib.pagesizes import A4
@@ -11,6 +11,7 @@ from reportlab.lib.utils import ImageReader
 from reportlab.lib import colors
 from reportlab.lib.units import cm
 from PIL import Image
+import asyncio
 import io
 import textwrap
 import re
@@ -19,8 +20,9 @@ from pathlib import Path
 
 from app.db.session import get_db
 from app.models.centros import Centro
-from app.models.capturas import Captura, CapturaVersion
-from app.models.clientes import Cliente
+from app.models.capturas import Captura, CapturaVersion, ImagenBlob, ImagenRendition
+from app.services import catalog, packs
+from app.services.blobs import load_bytes
 
 router = APIRouter(prefix="/api/reportes", tags=["reportes"])
 
@@ -43,11 +45,10 @@ async def reporte_pdf(
     db: AsyncSession = Depends(get_db),
 ):
     # === Cliente ===
-    cliente_nombre = (await db.execute(
-        select(Cliente.nombre).where(Cliente.id == cliente_id)
-    )).scalar_one_or_none()
-    if not cliente_nombre:
+    cliente = await catalog.cliente_por_id(db, cliente_id)
+    if not cliente:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    cliente_nombre = cliente.nombre
 
     # === Centros/Capturas del dia (sin N+1) ===
     cap_sq = (
@@ -57,22 +58,13 @@ async def reporte_pdf(
             Captura.estado.label("cap_estado"),
             Captura.observacion.label("cap_observacion"),
             Captura.grabacion.label("cap_grabacion"),
+            Captura.ultima_version_id.label("cap_ultima_id"),
+            Captura.ultima_tomada_en.label("cap_ultima_tomada"),
             func.row_number().over(partition_by=Captura.centro_id, order_by=Captura.created_at.desc()).label("rn"),
         )
         .where(Captura.fecha_reporte == fecha)
     ).subquery()
 
-    ver_sq = (
-        select(
-            CapturaVersion.id.label("ver_id"),
-            CapturaVersion.captura_id.label("ver_captura_id"),
-            CapturaVersion.tomada_en.label("ver_tomada_en"),
-            CapturaVersion.imagen_bytes.label("ver_bytes"),
-            CapturaVersion.content_type.label("ver_content_type"),
-            func.row_number().over(partition_by=CapturaVersion.captura_id, order_by=CapturaVersion.tomada_en.desc()).label("rn"),
-        )
-    ).subquery()
-
     q = (
         select(
             Centro.id.label("centro_id"),
@@ -85,28 +77,67 @@ async def reporte_pdf(
             cap_sq.c.cap_estado,
             cap_sq.c.cap_observacion,
             cap_sq.c.cap_grabacion,
-            ver_sq.c.ver_id,
-            ver_sq.c.ver_bytes,
-            ver_sq.c.ver_content_type,
+            CapturaVersion.id.label("ver_id"),
+            # si existe la variante JPEG para PDF (generada en el ingest) no se trae el original
+            case(
+                (or_(ImagenRendition.data.is_not(None), ImagenRendition.storage_key.is_not(None)), None),
+                else_=func.coalesce(CapturaVersion.imagen_bytes, ImagenBlob.data),
+            ).label("ver_bytes"),
+            case(
+                (or_(ImagenRendition.data.is_not(None), ImagenRendition.storage_key.is_not(None)), None),
+                else_=ImagenBlob.storage_key,
+            ).label("ver_key"),
+            CapturaVersion.archivo_pack.label("ver_pack"),
+            CapturaVersion.content_type.label("ver_content_type"),
+            ImagenRendition.data.label("pdf_bytes"),
+            ImagenRendition.storage_key.label("pdf_key"),
+            ImagenRendition.ancho.label("pdf_w"),
+            ImagenRendition.alto.label("pdf_h"),
         )
         .join(cap_sq, and_(cap_sq.c.cap_centro_id == Centro.id, cap_sq.c.rn == 1), isouter=True)
-        .join(ver_sq, and_(ver_sq.c.ver_captura_id == cap_sq.c.cap_id, ver_sq.c.rn == 1), isouter=True)
+        # última versión por el puntero de la captura: (id, tomada_en) es la PK particionada
+        .join(
+            CapturaVersion,
+            and_(
+                CapturaVersion.id == cap_sq.c.cap_ultima_id,
+                CapturaVersion.tomada_en == cap_sq.c.cap_ultima_tomada,
+            ),
+            isouter=True,
+        )
+        .join(ImagenBlob, ImagenBlob.hash == CapturaVersion.blob_hash, isouter=True)
+        .join(
+            ImagenRendition,
+            and_(ImagenRendition.blob_hash == CapturaVersion.blob_hash, ImagenRendition.variante == "pdf"),
+            isouter=True,
+        )
         .where(Centro.cliente_id == cliente_id)
         .order_by(Centro.nombre.asc())
     )
 
     rows_db = (await db.execute(q)).mappings().all()
 
+    # bytes que viven en el blob store o en un pack archivado (la fila solo trae la
+    # clave / el pack): se piden en paralelo
+    async def _cargar(r):
+        if r["pdf_key"]:
+            return None, await load_bytes(r["pdf_key"], r["pdf_bytes"])
+        if r["ver_pack"] and r["ver_id"]:
+            return await asyncio.to_thread(packs.leer_bytes, r["ver_pack"], r["ver_id"]), None
+        return await load_bytes(r["ver_key"], r["ver_bytes"]), r["pdf_bytes"]
+
+    cargados = await asyncio.gather(*(_cargar(r) for r in rows_db))
+
     rows, con_imagen = [], 0
-    for r in rows_db:
+    for r, (ver_bytes, pdf_bytes) in zip(rows_db, cargados):
         obs = r["cap_observacion"] if r["cap_observacion"] not in (None, "") else r["centro_observacion"] or ""
         grab = r["cap_grabacion"] if r["cap_grabacion"] not in (None, "") else r["centro_grabacion"] or ""
         if r["cap_id"]:
             estado = r["cap_estado"] or "pendiente"
         else:
             estado = "sin_reporte"
-        img_bytes = r["ver_bytes"]
-        if img_bytes:
+        img_bytes = ver_bytes
+        pdf_img = (pdf_bytes, r["pdf_w"], r["pdf_h"]) if pdf_bytes else None
+        if img_bytes or pdf_img:
             con_imagen += 1
 
         rows.append({
@@ -117,6 +148,7 @@ async def reporte_pdf(
             "observacion": obs,
             "grabacion": grab,
             "imagen_bytes": img_bytes,
+            "pdf_img": pdf_img,
             "content_type": r["ver_content_type"],
         })
 
@@ -318,7 +350,7 @@ async def reporte_pdf(
                 c.drawString(left, line, header_text)
                 line -= 16
 
-    def draw_image_block(idx: int, nombre: str, imagen_bytes: bytes | None):
+    def draw_image_block(idx: int, nombre: str, imagen_bytes: bytes | None, pdf_img: tuple | None = None):
         """Dibuja (titulo + imagen) como bloque indivisible (o titulo + '(Sin imagen)')."""
         nonlocal line
 
@@ -332,7 +364,13 @@ async def reporte_pdf(
         draw_h = 0
         ibytes = None
         has_image = False
-        if imagen_bytes:
+        if pdf_img:
+            # JPEG ya preparado en el ingest: reportlab lo embebe sin decodificar/recodificar
+            jpeg, iw, ih = pdf_img
+            draw_h = ih * (max_img_w / float(iw))
+            ibytes = io.BytesIO(jpeg)
+            has_image = True
+        elif imagen_bytes:
             try:
                 img = Image.open(io.BytesIO(imagen_bytes)).convert("RGB")
                 iw, ih = img.size
@@ -379,7 +417,7 @@ async def reporte_pdf(
 
     # Recorrido de filas (cada bloque nombre+imagen no se separa en salto de pAgina)
     for idx, r in enumerate(rows, start=1):
-        draw_image_block(idx, r["nombre"], r["imagen_bytes"])
+        draw_image_block(idx, r["nombre"], r["imagen_bytes"], r["pdf_img"])
 
     c.showPage()
     c.save()
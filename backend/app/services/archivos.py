@@ -0,0 +1,158 @@
+# app/services/archivos.py
+"""
+Respuestas de archivos en disco (miniaturas del cache, blobs y variantes del store fs)
+sin cargar el archivo en memoria ni bloquear el event loop.
+
+- El archivo se abre (en un hilo) antes de responder: si entretanto lo desaloja el LRU
+  de thumbs o lo reemplaza un os.replace, el descriptor abierto sigue siendo válido.
+- Si el servidor ASGI ofrece la extensión `http.response.zerocopysend` se usa sendfile
+  (sin copiar a Python); con `http.response.pathsend` el servidor envía la ruta entera.
+  Si no (uvicorn), se lee por trozos con os.pread en el threadpool.
+- Last-Modified + If-Modified-Since, y HTTP Range de un solo rango (206 / 416) con
+  If-Range. Varios rangos en una petición se ignoran y se envía el archivo completo,
+  como permite RFC 9110.
+"""
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.services.blobs import STREAM_CHUNK
+
+
+class RangoNoSatisfacible(Exception):
+    pass
+
+
+def parse_rango(valor: str | None, size: int) -> tuple[int, int] | None:
+    """(inicio, fin) inclusivos del rango pedido; None = servir completo."""
+    if not valor or not valor.strip().lower().startswith("bytes="):
+        return None
+    specs = valor.split("=", 1)[1].split(",")
+    if len(specs) != 1:
+        return None
+    ini, sep, fin = specs[0].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if ini == "":
+            n = int(fin)
+            if n <= 0 or size == 0:
+                raise RangoNoSatisfacible
+            return max(0, size - n), size - 1
+        a = int(ini)
+        b = int(fin) if fin else size - 1
+    except ValueError:
+        return None
+    if a >= size:
+        raise RangoNoSatisfacible
+    if b < a:
+        return None
+    return a, min(b, size - 1)
+
+
+def _if_range_ok(if_range: str | None, etag: str | None, last_modified: str) -> bool:
+    """If-Range: el rango solo vale si el validador coincide (comparación fuerte)."""
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return bool(etag) and not etag.startswith("W/") and if_range == etag
+    return if_range == last_modified
+
+
+def _no_modificado(request: Request, mtime: float) -> bool:
+    if request.headers.get("if-none-match"):
+        return False  # manda la ETag (ya comparada por la ruta)
+    ims = request.headers.get("if-modified-since")
+    if not ims:
+        return False
+    try:
+        return int(mtime) <= int(parsedate_to_datetime(ims).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+class _ArchivoResponse(Response):
+    def __init__(self, fh, offset: int, count: int, status_code: int, headers: dict, media_type: str):
+        self._fh = fh
+        self._offset = offset
+        self._count = count
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"].upper() == "HEAD" or self._count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            ext = scope.get("extensions") or {}
+            if "http.response.zerocopysend" in ext:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self._fh,
+                    "offset": self._offset,
+                    "count": self._count,
+                    "more_body": False,
+                })
+                return
+            if "http.response.pathsend" in ext and self.status_code == 200:
+                await send({"type": "http.response.pathsend", "path": self._fh.name})
+                return
+            fd = self._fh.fileno()
+            pos, fin = self._offset, self._offset + self._count
+            while pos < fin:
+                chunk = await asyncio.to_thread(os.pread, fd, min(STREAM_CHUNK, fin - pos), pos)
+                if not chunk:
+                    break  # truncado por fuera: se corta la respuesta
+                pos += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": pos < fin})
+            if pos < fin:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self._fh.close()
+
+
+def _abrir(path: Path):
+    fh = open(path, "rb")
+    return fh, os.fstat(fh.fileno())
+
+
+async def responder_archivo(request: Request, path: Path, *, media_type: str, headers: dict) -> Response | None:
+    """
+    Respuesta para servir `path` (200 / 206 / 304 / 416). `headers` trae ETag y
+    Cache-Control de la ruta. None si el archivo ya no existe (la ruta sigue por otro camino).
+    """
+    try:
+        fh, st = await asyncio.to_thread(_abrir, path)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = {**headers, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+    size = st.st_size
+
+    if _no_modificado(request, st.st_mtime):
+        fh.close()
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Accept-Ranges"})
+
+    rango = None
+    if _if_range_ok(request.headers.get("if-range"), headers.get("ETag"), last_modified):
+        try:
+            rango = parse_rango(request.headers.get("range"), size)
+        except RangoNoSatisfacible:
+            fh.close()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if rango is None:
+        headers["Content-Length"] = str(size)
+        return _ArchivoResponse(fh, 0, size, 200, headers, media_type)
+    ini, fin = rango
+    headers["Content-Range"] = f"bytes {ini}-{fin}/{size}"
+    headers["Content-Length"] = str(fin - ini + 1)
+    return _ArchivoResponse(fh, ini, fin - ini + 1, 206, headers, media_type)
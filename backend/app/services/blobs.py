@@ -0,0 +1,460 @@
+# app/services/blobs.py
+"""
+Almacén de imágenes direccionado por contenido (tabla imagen_blobs).
+
+Cada blob distinto se guarda una vez; las versiones lo referencian por hash y
+ref_count lleva la cuenta de referencias para poder liberarlo al borrar.
+Los bytes van al blob store configurado (fs/s3) y la fila guarda solo la clave;
+con BLOB_BACKEND=db, o en filas aún sin migrar, siguen en la columna `data`.
+
+Las columnas de bytes están diferidas en los modelos: las rutas calientes leen
+metadatos (version_meta) y los bytes solo se tocan al servirlos o decodificarlos.
+"""
+import asyncio
+import time
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import and_, bindparam, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import SessionLocal
+from app.models.capturas import Captura, CapturaVersion, ImagenBlob, ImagenRendition
+from app.services import packs
+from app.services.blobstore import blob_key, get_store, rendition_key
+from app.services.images import RENDITIONS
+from app.services.thumbs import purge_thumbs, thumb_key
+
+# trozo de lectura al servir imágenes completas (store o substring() sobre bytea)
+STREAM_CHUNK = 256 * 1024
+
+
+async def _lock_hash(db: AsyncSession, blob_hash: str) -> None:
+    """Lock transaccional por hash: serializa la alta del objeto en el store con su purga."""
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(blob_hash))))
+
+
+async def _sumar_refs(db: AsyncSession, blob_hash: str, refs: int) -> bool:
+    hit = (
+        await db.execute(
+            update(ImagenBlob)
+            .where(ImagenBlob.hash == blob_hash)
+            .values(ref_count=ImagenBlob.ref_count + refs)
+            .returning(ImagenBlob.hash)
+        )
+    ).scalar_one_or_none()
+    return hit is not None
+
+
+async def put_blob(
+    db: AsyncSession,
+    blob_hash: str,
+    data: bytes,
+    content_type: str | None,
+    ancho: int | None,
+    alto: int | None,
+    refs: int = 1,
+) -> bool:
+    """
+    Suma `refs` referencias al blob; si no existía lo inserta. Devuelve True si era nuevo.
+    El caso repetido es un UPDATE de una fila sin enviar los bytes.
+    """
+    hit = await _sumar_refs(db, blob_hash, refs)
+    if hit:
+        return False
+
+    # primero el store (idempotente por clave) y después la fila que lo referencia
+    store = get_store()
+    storage_key = None
+    if store is not None:
+        # con el lock del hash (hasta el commit) purge_freed no puede borrar el objeto
+        # entre la escritura y el commit de la fila; si purgó justo antes, se reescribe
+        await _lock_hash(db, blob_hash)
+        if await _sumar_refs(db, blob_hash, refs):
+            return False
+        storage_key = blob_key(blob_hash)
+        await store.put(storage_key, data)
+
+    # ON CONFLICT cubre la carrera con otro upload idéntico concurrente
+    stmt = pg_insert(ImagenBlob).values(
+        hash=blob_hash,
+        storage_key=storage_key,
+        data=None if storage_key else data,
+        content_type=content_type,
+        ancho=ancho,
+        alto=alto,
+        peso_bytes=len(data),
+        ref_count=refs,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImagenBlob.hash],
+        set_={"ref_count": ImagenBlob.ref_count + refs},
+    )
+    await db.execute(stmt)
+    return True
+
+
+async def put_renditions(db: AsyncSession, blob_hash: str, renditions: dict[str, dict]) -> None:
+    """Guarda las variantes generadas en el ingest (solo la primera vez que se ve el blob)."""
+    if not renditions:
+        return
+    store = get_store()
+    keys = {}
+    if store is not None:
+        for name, r in renditions.items():
+            keys[name] = rendition_key(blob_hash, name)
+            await store.put(keys[name], r["bytes"])
+    stmt = pg_insert(ImagenRendition).values([
+        {
+            "blob_hash": blob_hash,
+            "variante": name,
+            "content_type": r["content_type"],
+            "ancho": r["ancho"],
+            "alto": r["alto"],
+            "peso_bytes": r["peso_bytes"],
+            "storage_key": keys.get(name),
+            "data": None if name in keys else r["bytes"],
+        }
+        for name, r in renditions.items()
+    ])
+    await db.execute(stmt.on_conflict_do_nothing())
+
+
+async def get_rendition(db: AsyncSession, blob_hash: str | None, variante: str) -> ImagenRendition | None:
+    if not blob_hash:
+        return None
+    return (
+        await db.execute(
+            select(ImagenRendition).where(
+                ImagenRendition.blob_hash == blob_hash,
+                ImagenRendition.variante == variante,
+            )
+        )
+    ).scalar_one_or_none()
+
+
+async def release_blobs(db: AsyncSession, hashes) -> list[str]:
+    """
+    Resta una referencia por cada hash (puede repetirse) y elimina los blobs que
+    quedan sin referencias. Devuelve los hashes liberados. No hace commit.
+    """
+    counts = Counter(h for h in hashes if h)
+    if not counts:
+        return []
+
+    t = ImagenBlob.__table__
+    await db.execute(
+        update(t)
+        .where(t.c.hash == bindparam("b_hash"))
+        .values(ref_count=t.c.ref_count - bindparam("b_n")),
+        [{"b_hash": h, "b_n": n} for h, n in counts.items()],
+    )
+    freed = (
+        await db.execute(
+            delete(ImagenBlob)
+            .where(ImagenBlob.hash.in_(list(counts)), ImagenBlob.ref_count <= 0)
+            .returning(ImagenBlob.hash)
+        )
+    ).scalars().all()
+    return list(freed)
+
+
+async def release_versions(db: AsyncSession, *where) -> list[str]:
+    """
+    Libera los blobs de las versiones que cumplen `where` (llamar ANTES de borrarlas).
+    Devuelve los hashes liberados para purgar sus thumbs tras el commit.
+    """
+    hashes = (
+        await db.execute(select(CapturaVersion.blob_hash).where(*where, CapturaVersion.blob_hash.is_not(None)))
+    ).scalars().all()
+    return await release_blobs(db, hashes)
+
+
+def purge_blob_thumbs(freed_hashes) -> int:
+    return purge_thumbs(thumb_key(0, h) for h in freed_hashes)
+
+
+async def borrar_si_huerfanos(db: AsyncSession, hashes) -> list[str]:
+    """
+    Borra del store el blob y sus variantes de cada hash que no tiene fila en imagen_blobs.
+    Cada hash se revisa y borra con su lock tomado: un put_blob concurrente del mismo hash
+    espera al borrado y reescribe el objeto, o el borrado espera a que su fila se confirme
+    y lo conserva. Una transacción por hash. Devuelve los hashes borrados.
+    """
+    store = get_store()
+    if store is None:
+        return []
+    borrados = []
+    for h in sorted(set(hashes)):
+        try:
+            await _lock_hash(db, h)
+            existe = (
+                await db.execute(select(ImagenBlob.hash).where(ImagenBlob.hash == h))
+            ).scalar_one_or_none()
+            if existe is None:
+                await store.delete(blob_key(h))
+                for variante in RENDITIONS:
+                    await store.delete(rendition_key(h, variante))
+                borrados.append(h)
+        except Exception as e:
+            print(f"[blobstore] WARNING no se pudo borrar {h}: {e!r}", flush=True)
+        finally:
+            await db.rollback()  # solo lecturas: suelta el lock
+    return borrados
+
+
+async def purge_freed(db: AsyncSession, freed_hashes) -> None:
+    """
+    Tras el commit que liberó los blobs: borra sus objetos en el store y sus thumbs en
+    disco, salvo los que entretanto otro upload volvió a crear (borrar_si_huerfanos).
+    """
+    freed = [h for h in freed_hashes if h]
+    if not freed:
+        return
+    if get_store() is None:
+        purge_blob_thumbs(freed)
+        return
+    purge_blob_thumbs(await borrar_si_huerfanos(db, freed))
+
+
+async def barrer_huerfanos(db: AsyncSession, gracia_seg: int, dry_run: bool = False, lote: int = 500) -> dict:
+    """
+    Objetos del store sin fila en imagen_blobs (put_blob escribe antes del commit: un
+    rollback, una carrera de Idempotency-Key o una caída los deja atrás). Solo toma los
+    más viejos que `gracia_seg`, para no tocar uploads en curso, y los borra con
+    borrar_si_huerfanos. Devuelve {objetos, huerfanos, borrados}.
+    """
+    store = get_store()
+    res = {"objetos": 0, "huerfanos": 0, "borrados": 0}
+    if store is None:
+        return res
+    limite = time.time() - gracia_seg
+    pendientes: set[str] = set()
+
+    async def _revisar(hashes: set[str]):
+        existen = set(
+            (await db.execute(select(ImagenBlob.hash).where(ImagenBlob.hash.in_(list(hashes))))).scalars().all()
+        )
+        await db.rollback()
+        huerfanos = hashes - existen
+        res["huerfanos"] += len(huerfanos)
+        if huerfanos and not dry_run:
+            borrados = await borrar_si_huerfanos(db, huerfanos)
+            purge_blob_thumbs(borrados)
+            res["borrados"] += len(borrados)
+
+    async for key, mtime in store.listar():
+        res["objetos"] += 1
+        if mtime < limite:
+            pendientes.add(key.split(".", 1)[0])
+        if len(pendientes) >= lote:
+            await _revisar(pendientes)
+            pendientes = set()
+    if pendientes:
+        await _revisar(pendientes)
+    return res
+
+
+async def load_bytes(storage_key: str | None, data: bytes | None) -> bytes | None:
+    """Bytes de una fila blob/variante: del store si tiene clave, si no de la columna."""
+    if storage_key:
+        store = get_store()
+        if store is not None:
+            got = await store.get(storage_key)
+            if got is not None:
+                return got
+        print(f"[blobstore] WARNING {storage_key} no está en el store", flush=True)
+    return data
+
+
+async def rendition_bytes(db: AsyncSession, rend: ImagenRendition | None) -> bytes | None:
+    """Bytes de una variante; la columna `data` (diferida) solo se lee si no está en el store."""
+    if rend is None:
+        return None
+    if rend.storage_key and get_store() is not None:
+        got = await load_bytes(rend.storage_key, None)
+        if got is not None:
+            return got
+    data = (
+        await db.execute(
+            select(ImagenRendition.data).where(
+                ImagenRendition.blob_hash == rend.blob_hash,
+                ImagenRendition.variante == rend.variante,
+            )
+        )
+    ).scalar_one_or_none()
+    return data
+
+
+# ————— metadatos sin bytes —————
+_META_COLS = (
+    CapturaVersion.id,
+    CapturaVersion.captura_id,
+    CapturaVersion.tomada_en,
+    CapturaVersion.origen,
+    CapturaVersion.blob_hash,
+    CapturaVersion.content_type,
+    CapturaVersion.ancho,
+    CapturaVersion.alto,
+    CapturaVersion.peso_bytes,
+    CapturaVersion.archivo_pack,
+    CapturaVersion.imagen_bytes.is_not(None).label("legado"),
+    or_(
+        CapturaVersion.imagen_bytes.is_not(None),
+        CapturaVersion.blob_hash.is_not(None),
+        CapturaVersion.archivo_pack.is_not(None),
+    ).label("tiene_imagen"),
+)
+
+
+async def version_meta(db: AsyncSession, version_id: int):
+    """Fila con los metadatos de la versión (sin bytes), o None."""
+    return (await db.execute(select(*_META_COLS).where(CapturaVersion.id == version_id))).first()
+
+
+async def ultima_version_meta(db: AsyncSession, captura_id: int):
+    """
+    Metadatos de la versión más reciente de la captura (sin bytes), o None. Sigue el
+    puntero capturas.ultima_version_id: una lectura por PK, sin ordenar las versiones.
+    """
+    return (
+        await db.execute(
+            select(*_META_COLS)
+            .join(
+                Captura,
+                and_(
+                    Captura.ultima_version_id == CapturaVersion.id,
+                    Captura.ultima_tomada_en == CapturaVersion.tomada_en,
+                ),
+            )
+            .where(Captura.id == captura_id)
+        )
+    ).first()
+
+
+async def metas_de_capturas(db: AsyncSession, captura_ids) -> dict:
+    """{captura_id: metadatos de su última versión} para varias capturas, en una consulta."""
+    rows = (
+        await db.execute(
+            select(*_META_COLS, Captura.id.label("cap_id"))
+            .join(
+                Captura,
+                and_(
+                    Captura.ultima_version_id == CapturaVersion.id,
+                    Captura.ultima_tomada_en == CapturaVersion.tomada_en,
+                ),
+            )
+            .where(Captura.id.in_(list(captura_ids)))
+        )
+    ).all()
+    return {r.cap_id: r for r in rows}
+
+
+async def metas_de_versiones(db: AsyncSession, version_ids) -> dict:
+    """{version_id: metadatos} para varias versiones, en una consulta."""
+    rows = (await db.execute(select(*_META_COLS).where(CapturaVersion.id.in_(list(version_ids))))).all()
+    return {r.id: r for r in rows}
+
+
+async def version_bytes(db: AsyncSession, version_id: int) -> bytes | None:
+    """Bytes completos de una versión (columna legada, blob o pack); solo para quien los decodifica."""
+    row = (
+        await db.execute(
+            select(CapturaVersion.imagen_bytes, CapturaVersion.archivo_pack, ImagenBlob.storage_key, ImagenBlob.data)
+            .outerjoin(ImagenBlob, ImagenBlob.hash == CapturaVersion.blob_hash)
+            .where(CapturaVersion.id == version_id)
+        )
+    ).first()
+    if not row:
+        return None
+    if row.imagen_bytes:
+        return row.imagen_bytes
+    if row.archivo_pack:
+        return await asyncio.to_thread(packs.leer_bytes, row.archivo_pack, version_id)
+    return await load_bytes(row.storage_key, row.data)
+
+
+# ————— streaming por trozos —————
+async def _iter_columna(col, *where, size: int):
+    """Lee una columna bytea con substring() en trozos, en una sesión propia (la del request ya cerró)."""
+    async with SessionLocal() as db:
+        for off in range(0, size, STREAM_CHUNK):
+            chunk = (
+                await db.execute(select(func.substring(col, off + 1, STREAM_CHUNK)).where(*where))
+            ).scalar_one_or_none()
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _iter_vista(vista: memoryview):
+    for off in range(0, len(vista), STREAM_CHUNK):
+        yield vista[off:off + STREAM_CHUNK]
+
+
+# ————— archivos locales (servidos con archivos.responder_archivo, sin leerlos) —————
+async def _ruta_en_store(storage_key: str | None) -> Path | None:
+    store = get_store()
+    if not storage_key or store is None or store.name != "fs":
+        return None
+    return await asyncio.to_thread(store.local_path, storage_key)
+
+
+async def ruta_local(db: AsyncSession, meta) -> Path | None:
+    """Ruta en disco de la imagen de la versión si vive en el store fs; None si no."""
+    if meta.archivo_pack or meta.legado or not meta.blob_hash:
+        return None
+    store = get_store()
+    if store is None or store.name != "fs":
+        return None
+    key = (
+        await db.execute(select(ImagenBlob.storage_key).where(ImagenBlob.hash == meta.blob_hash))
+    ).scalar_one_or_none()
+    return await _ruta_en_store(key)
+
+
+async def ruta_rendition(rend: ImagenRendition | None) -> Path | None:
+    return await _ruta_en_store(rend.storage_key) if rend is not None else None
+
+
+async def abrir_stream(db: AsyncSession, meta) -> tuple[int, object] | None:
+    """
+    Fuente de bytes de una versión para StreamingResponse: (tamaño, iterador async de trozos)
+    o None si no hay imagen. Nunca carga la imagen entera en memoria.
+    """
+    if meta.archivo_pack:
+        vista = await asyncio.to_thread(packs.leer, meta.archivo_pack, meta.id)
+        if vista is None:
+            return None
+        return len(vista), _iter_vista(vista)
+
+    if meta.legado:
+        size = (
+            await db.execute(
+                select(func.octet_length(CapturaVersion.imagen_bytes)).where(CapturaVersion.id == meta.id)
+            )
+        ).scalar_one_or_none()
+        if not size:
+            return None
+        return size, _iter_columna(CapturaVersion.imagen_bytes, CapturaVersion.id == meta.id, size=size)
+
+    if not meta.blob_hash:
+        return None
+    row = (
+        await db.execute(
+            select(ImagenBlob.storage_key, func.octet_length(ImagenBlob.data).label("size"))
+            .where(ImagenBlob.hash == meta.blob_hash)
+        )
+    ).first()
+    if not row:
+        return None
+    store = get_store()
+    if row.storage_key and store is not None:
+        size = await store.size(row.storage_key)
+        if size is not None:
+            return size, store.iter_chunks(row.storage_key, STREAM_CHUNK)
+        print(f"[blobstore] WARNING {row.storage_key} no está en el store", flush=True)
+    if not row.size:
+        return None
+    return row.size, _iter_columna(ImagenBlob.data, ImagenBlob.hash == meta.blob_hash, size=row.size)
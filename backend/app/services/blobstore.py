@@ -0,0 +1,316 @@
+# app/services/blobstore.py
+"""
+Almacén de bytes de imagen fuera de Postgres. La BD guarda solo la clave
+(imagen_blobs.storage_key / imagen_renditions.storage_key).
+
+Backends (BLOB_BACKEND):
+    fs      archivos en BLOB_DIR con rutas por contenido: {root}/ab/cd/{clave}
+    s3      bucket S3 o compatible (MinIO); requiere boto3 instalado
+    memory  diccionario en proceso (pruebas / desarrollo local)
+    db      sin store externo: los bytes siguen en las columnas bytea (comportamiento anterior)
+
+Las claves son el hash del blob ("{hash}") o "{hash}.{variante}" para las
+variantes, así que una escritura repetida es idempotente.
+"""
+import asyncio
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from app.core.config import settings
+
+_KEY_RE = re.compile(r"^[0-9a-f]{8,}(\.[a-z0-9_-]+)?$")
+
+
+def blob_key(blob_hash: str) -> str:
+    return blob_hash
+
+
+def rendition_key(blob_hash: str, variante: str) -> str:
+    return f"{blob_hash}.{variante}"
+
+
+def _check_key(key: str) -> str:
+    if not _KEY_RE.match(key or ""):
+        raise ValueError(f"clave de blob inválida: {key!r}")
+    return key
+
+
+class BlobStore(ABC):
+    """Interfaz común. Todas las operaciones son async; las que bloquean van a un hilo."""
+
+    name = "base"
+
+    @abstractmethod
+    async def put(self, key: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def local_path(self, key: str) -> Path | None:
+        """Ruta en disco si el backend la tiene (para servir el archivo sin copiarlo); si no, None."""
+
+    @abstractmethod
+    def listar(self):
+        """Iterador async de (clave, mtime epoch) de todos los objetos (barrido de huérfanos)."""
+
+    async def size(self, key: str) -> int | None:
+        data = await self.get(key)
+        return None if data is None else len(data)
+
+    async def iter_chunks(self, key: str, chunk_size: int):
+        """Bytes del objeto en trozos; los backends que pueden leer por partes lo sobreescriben."""
+        data = await self.get(key)
+        if data is None:
+            return
+        view = memoryview(data)
+        for off in range(0, len(view), chunk_size):
+            yield bytes(view[off:off + chunk_size])
+
+
+class FsBlobStore(BlobStore):
+    name = "fs"
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        _check_key(key)
+        return self.root / key[:2] / key[2:4] / key
+
+    def local_path(self, key: str) -> Path | None:
+        p = self._path(key)
+        return p if p.exists() else None
+
+    def _put_sync(self, key: str, data: bytes):
+        dest = self._path(key)
+        if dest.exists() and dest.stat().st_size == len(data):
+            # mismo contenido (clave = hash): nada que escribir
+            return
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, dest)
+
+    def _get_sync(self, key: str) -> bytes | None:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _delete_sync(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put_sync, key, data)
+
+    async def get(self, key: str) -> bytes | None:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete_sync, key)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._path(key).exists)
+
+    async def size(self, key: str) -> int | None:
+        try:
+            return (await asyncio.to_thread(self._path(key).stat)).st_size
+        except FileNotFoundError:
+            return None
+
+    def _shards(self) -> list[Path]:
+        return sorted(p for p in self.root.glob("*/*") if p.is_dir())
+
+    @staticmethod
+    def _listar_dir(d: Path) -> list[tuple[str, float]]:
+        # los .tmp de escrituras en curso empiezan con punto
+        return [
+            (e.name, e.stat().st_mtime)
+            for e in os.scandir(d)
+            if e.is_file() and not e.name.startswith(".") and _KEY_RE.match(e.name)
+        ]
+
+    async def listar(self):
+        for d in await asyncio.to_thread(self._shards):
+            for item in await asyncio.to_thread(self._listar_dir, d):
+                yield item
+
+    async def iter_chunks(self, key: str, chunk_size: int):
+        try:
+            fh = await asyncio.to_thread(open, self._path(key), "rb")
+        except FileNotFoundError:
+            return
+        try:
+            while True:
+                chunk = await asyncio.to_thread(fh.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            fh.close()
+
+
+class S3BlobStore(BlobStore):
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None, region: str | None = None):
+        try:
+            import boto3  # opcional: solo se necesita con BLOB_BACKEND=s3
+        except ImportError as e:
+            raise RuntimeError("BLOB_BACKEND=s3 requiere boto3 (pip install boto3)") from e
+        if not bucket:
+            raise RuntimeError("BLOB_BACKEND=s3 requiere BLOB_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+
+    def _obj(self, key: str) -> str:
+        _check_key(key)
+        shard = f"{key[:2]}/{key[2:4]}/{key}"
+        return f"{self.prefix}/{shard}" if self.prefix else shard
+
+    def local_path(self, key: str) -> Path | None:
+        return None
+
+    async def put(self, key: str, data: bytes) -> None:
+        await asyncio.to_thread(self.client.put_object, Bucket=self.bucket, Key=self._obj(key), Body=data)
+
+    async def get(self, key: str) -> bytes | None:
+        def _get():
+            try:
+                return self.client.get_object(Bucket=self.bucket, Key=self._obj(key))["Body"].read()
+            except self.client.exceptions.NoSuchKey:
+                return None
+        return await asyncio.to_thread(_get)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._obj(key))
+
+    async def size(self, key: str) -> int | None:
+        def _head():
+            try:
+                return self.client.head_object(Bucket=self.bucket, Key=self._obj(key))["ContentLength"]
+            except Exception:
+                return None
+        return await asyncio.to_thread(_head)
+
+    async def iter_chunks(self, key: str, chunk_size: int):
+        def _open():
+            try:
+                return self.client.get_object(Bucket=self.bucket, Key=self._obj(key))["Body"]
+            except self.client.exceptions.NoSuchKey:
+                return None
+        body = await asyncio.to_thread(_open)
+        if body is None:
+            return
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def exists(self, key: str) -> bool:
+        def _head():
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=self._obj(key))
+                return True
+            except Exception:
+                return False
+        return await asyncio.to_thread(_head)
+
+    async def listar(self):
+        pages = iter(
+            self.client.get_paginator("list_objects_v2").paginate(
+                Bucket=self.bucket, Prefix=f"{self.prefix}/" if self.prefix else ""
+            )
+        )
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                break
+            for obj in page.get("Contents", []):
+                key = obj["Key"].rsplit("/", 1)[-1]
+                if _KEY_RE.match(key):
+                    yield key, obj["LastModified"].timestamp()
+
+
+class MemoryBlobStore(BlobStore):
+    """Store en memoria para pruebas locales (se pierde al reiniciar)."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: dict[str, bytes] = {}
+
+    def local_path(self, key: str) -> Path | None:
+        return None
+
+    async def put(self, key: str, data: bytes) -> None:
+        self._data[_check_key(key)] = bytes(data)
+
+    async def get(self, key: str) -> bytes | None:
+        return self._data.get(key)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    async def exists(self, key: str) -> bool:
+        return key in self._data
+
+    async def listar(self):
+        # sin fechas: todo cuenta como viejo
+        for key in list(self._data):
+            yield key, 0.0
+
+
+_store: BlobStore | None = None
+_resolved = False
+
+
+def get_store() -> BlobStore | None:
+    """Store configurado, o None con BLOB_BACKEND=db (bytes en Postgres)."""
+    global _store, _resolved
+    if _resolved:
+        return _store
+    backend = settings.blob_backend
+    if backend == "fs":
+        _store = FsBlobStore(settings.blob_dir)
+    elif backend == "s3":
+        _store = S3BlobStore(
+            settings.blob_s3_bucket,
+            settings.blob_s3_prefix,
+            settings.blob_s3_endpoint,
+            settings.blob_s3_region,
+        )
+    elif backend == "memory":
+        _store = MemoryBlobStore()
+    elif backend == "db":
+        _store = None
+    else:
+        raise RuntimeError(f"BLOB_BACKEND desconocido: {backend!r} (fs|s3|memory|db)")
+    _resolved = True
+    print(f"[blobstore] backend={backend}", flush=True)
+    return _store
+
+
+def set_store(store: BlobStore | None):
+    """Reemplaza el store (pruebas)."""
+    global _store, _resolved
+    _store, _resolved = store, True
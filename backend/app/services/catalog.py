@@ -0,0 +1,190 @@
+# app/services/catalog.py
+"""
+Cache en proceso del catálogo clientes/centros/dispositivos.
+
+Los agentes hacen long-poll y upload con su uuid_equipo; sin esto cada llamada
+repite las mismas consultas (Centro por uuid, último dispositivo usado, existencia
+del dispositivo, Cliente por id). Los routers CRUD invalidan explícitamente al
+escribir y el TTL (CATALOG_TTL) cubre los cambios hechos desde otro proceso/worker
+o a mano en la BD.
+"""
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.capturas import Captura
+from app.models.centros import Centro
+from app.models.clientes import Cliente
+from app.models.dispositivos import Dispositivo
+
+
+@dataclass(frozen=True)
+class CentroRef:
+    """Lo que necesitan los caminos calientes de un centro (sin la fila ORM, que es de una sesión)."""
+    id: int
+    cliente_id: int
+    nombre: str
+    uuid_equipo: str | None
+
+
+@dataclass(frozen=True)
+class ClienteRef:
+    id: int
+    nombre: str
+
+
+# nombre -> {clave: (expira_en, valor)}; valor None = "no existe" (también se cachea)
+_tablas: dict[str, dict] = {
+    "cliente_id": {},
+    "centro_uuid": {},
+    "centro_id": {},
+    "dispositivo_uuid": {},
+    "dispositivo_existe": {},
+    "dispositivo_defecto": {},
+}
+_stats = {nombre: {"hits": 0, "misses": 0} for nombre in _tablas}
+_invalidaciones = 0
+_MISSING = object()
+
+
+def _get(tabla: str, key):
+    ent = _tablas[tabla].get(key)
+    if ent is not None and ent[0] > time.monotonic():
+        _stats[tabla]["hits"] += 1
+        return ent[1]
+    _stats[tabla]["misses"] += 1
+    return _MISSING
+
+
+def _put(tabla: str, key, value):
+    _tablas[tabla][key] = (time.monotonic() + settings.catalog_ttl, value)
+    return value
+
+
+def _ref(cen: Centro | None) -> CentroRef | None:
+    if cen is None:
+        return None
+    return CentroRef(id=cen.id, cliente_id=cen.cliente_id, nombre=cen.nombre, uuid_equipo=cen.uuid_equipo)
+
+
+async def cliente_por_id(db: AsyncSession, cliente_id: int) -> ClienteRef | None:
+    hit = _get("cliente_id", cliente_id)
+    if hit is not _MISSING:
+        return hit
+    row = (await db.execute(select(Cliente.id, Cliente.nombre).where(Cliente.id == cliente_id))).first()
+    return _put("cliente_id", cliente_id, ClienteRef(id=row.id, nombre=row.nombre) if row else None)
+
+
+async def centro_por_uuid(db: AsyncSession, uuid_equipo: str) -> CentroRef | None:
+    hit = _get("centro_uuid", uuid_equipo)
+    if hit is not _MISSING:
+        return hit
+    cen = (await db.execute(select(Centro).where(Centro.uuid_equipo == uuid_equipo))).scalar_one_or_none()
+    ref = _ref(cen)
+    if ref:
+        _put("centro_id", ref.id, ref)
+    return _put("centro_uuid", uuid_equipo, ref)
+
+
+async def centro_por_id(db: AsyncSession, centro_id: int) -> CentroRef | None:
+    hit = _get("centro_id", centro_id)
+    if hit is not _MISSING:
+        return hit
+    ref = _ref(await db.get(Centro, centro_id))
+    if ref and ref.uuid_equipo:
+        _put("centro_uuid", ref.uuid_equipo, ref)
+    return _put("centro_id", centro_id, ref)
+
+
+async def dispositivo_por_uuid(db: AsyncSession, uuid_equipo: str) -> int | None:
+    """Id del dispositivo registrado con ese uuid (camino legado de órdenes)."""
+    hit = _get("dispositivo_uuid", uuid_equipo)
+    if hit is not _MISSING:
+        return hit
+    did = (
+        await db.execute(select(Dispositivo.id).where(Dispositivo.uuid_equipo == uuid_equipo))
+    ).scalar_one_or_none()
+    return _put("dispositivo_uuid", uuid_equipo, did)
+
+
+async def dispositivo_existe(db: AsyncSession, dispositivo_id: int) -> bool:
+    hit = _get("dispositivo_existe", dispositivo_id)
+    if hit is not _MISSING:
+        return hit
+    ok = (
+        await db.execute(select(Dispositivo.id).where(Dispositivo.id == dispositivo_id))
+    ).scalar_one_or_none() is not None
+    return _put("dispositivo_existe", dispositivo_id, ok)
+
+
+async def dispositivo_por_defecto(db: AsyncSession, centro_id: int) -> int | None:
+    """Último dispositivo usado por el centro, solo si todavía existe (si no, None)."""
+    hit = _get("dispositivo_defecto", centro_id)
+    if hit is not _MISSING:
+        return hit
+    last = (
+        await db.execute(
+            select(Captura.dispositivo_id)
+            .where(Captura.centro_id == centro_id)
+            .order_by(desc(Captura.created_at))
+            .limit(1)
+        )
+    ).first()
+    did = last[0] if (last and last[0] is not None) else None
+    if did is not None and not await dispositivo_existe(db, did):
+        did = None
+    return _put("dispositivo_defecto", centro_id, did)
+
+
+# ————— invalidación —————
+def invalidar_centro(*, centro_id: int | None = None, uuids=()):
+    """Olvida un centro (por id y/o por sus uuid_equipo, p.ej. el viejo y el nuevo al renombrar)."""
+    global _invalidaciones
+    _invalidaciones += 1
+    if centro_id is not None:
+        ref = _tablas["centro_id"].pop(centro_id, (0, None))[1]
+        if ref and ref.uuid_equipo:
+            _tablas["centro_uuid"].pop(ref.uuid_equipo, None)
+        _tablas["dispositivo_defecto"].pop(centro_id, None)
+    for u in uuids:
+        if u:
+            _tablas["centro_uuid"].pop(u, None)
+
+
+def invalidar_cliente(cliente_id: int):
+    """Olvida un cliente (alta: puede haber un "no existe" cacheado con ese id; renombre)."""
+    global _invalidaciones
+    _invalidaciones += 1
+    _tablas["cliente_id"].pop(cliente_id, None)
+
+
+def nota_captura(centro_id: int, dispositivo_id: int | None):
+    """
+    Tras un upsert de Captura el 'último dispositivo usado' del centro puede cambiar;
+    solo se olvida si el dispositivo difiere del cacheado (el caso normal no invalida).
+    """
+    ent = _tablas["dispositivo_defecto"].get(centro_id)
+    if ent is not None and ent[1] != dispositivo_id:
+        _tablas["dispositivo_defecto"].pop(centro_id, None)
+
+
+def invalidar_todo():
+    global _invalidaciones
+    _invalidaciones += 1
+    for t in _tablas.values():
+        t.clear()
+
+
+def stats() -> dict:
+    out = {}
+    for nombre, st in _stats.items():
+        total = st["hits"] + st["misses"]
+        out[nombre] = {
+            **st,
+            "entradas": len(_tablas[nombre]),
+            "hit_rate": round(st["hits"] / total, 4) if total else None,
+        }
+    return {"ttl_sec": settings.catalog_ttl, "invalidaciones": _invalidaciones, "tablas": out}
@@ -0,0 +1,111 @@
+# app/services/hot_cache.py
+"""
+Cache en memoria (por proceso) de imágenes ya codificadas: (clave, variante) -> bytes.
+
+La clave es la de contenido de thumbs.thumb_key ("h{blob_hash}", o "v{version_id}" sin
+blob): la compactación re-codifica versiones viejas bajo el mismo version_id, pero el
+contenido nuevo tiene otro hash y por lo tanto otra clave. Una clave nunca cambia de
+bytes, así que no hay invalidación (descartar() solo adelanta el desalojo): desalojo
+LRU por presupuesto de bytes (HOT_CACHE_MAX_BYTES). La admisión depende del tamaño:
+
+- objetos mayores que HOT_CACHE_MAX_ITEM nunca entran;
+- los chicos (<= HOT_CACHE_SMALL) entran al primer miss (miniaturas del board);
+- los demás recién al segundo miss reciente ("doorkeeper"), para que una imagen
+  completa pedida una sola vez no desaloje cientos de miniaturas calientes.
+"""
+from collections import OrderedDict
+
+from app.core.config import settings
+
+# claves vistas hace poco sin admitir (para la segunda oportunidad de los objetos grandes)
+_DOORKEEPER_MAX = 4096
+
+_items: "OrderedDict[tuple[str, str], tuple[bytes, str]]" = OrderedDict()
+_vistos: "OrderedDict[tuple[str, str], None]" = OrderedDict()
+_bytes = 0
+_stats = {"hits": 0, "misses": 0, "admitted": 0, "rejected": 0, "evictions": 0, "evicted_bytes": 0}
+
+
+def get(clave: str, variante: str) -> tuple[bytes, str] | None:
+    """(bytes, media_type) si está en memoria; cuenta hit/miss."""
+    key = (clave, variante)
+    ent = _items.get(key)
+    if ent is None:
+        _stats["misses"] += 1
+        return None
+    _items.move_to_end(key)
+    _stats["hits"] += 1
+    return ent
+
+
+def admitiria(clave: str, variante: str, size: int | None) -> bool:
+    """
+    ¿Se admitiría un objeto de `size` bytes? Llamar en el miss, antes de cargarlo:
+    si es False conviene servirlo en streaming. Registra la clave en el doorkeeper.
+    """
+    if settings.hot_cache_max_bytes <= 0 or not size or size > settings.hot_cache_max_item:
+        return False
+    if size <= settings.hot_cache_small:
+        return True
+    key = (clave, variante)
+    if key in _vistos:
+        return True
+    _vistos[key] = None
+    if len(_vistos) > _DOORKEEPER_MAX:
+        _vistos.popitem(last=False)
+    return False
+
+
+def put(clave: str, variante: str, data: bytes, media_type: str) -> bool:
+    """Guarda si la política de admisión lo permite; devuelve True si quedó en memoria."""
+    global _bytes
+    key = (clave, variante)
+    if key in _items:
+        _items.move_to_end(key)
+        return True
+    size = len(data)
+    if not admitiria(clave, variante, size):
+        _stats["rejected"] += 1
+        return False
+    _vistos.pop(key, None)
+    _items[key] = (bytes(data), media_type)
+    _bytes += size
+    _stats["admitted"] += 1
+    while _bytes > settings.hot_cache_max_bytes and _items:
+        _, (old, _mt) = _items.popitem(last=False)
+        _bytes -= len(old)
+        _stats["evictions"] += 1
+        _stats["evicted_bytes"] += len(old)
+    return True
+
+
+def descartar(claves) -> int:
+    """Quita todas las variantes de las claves dadas (contenido que ya no se sirve)."""
+    global _bytes
+    claves = set(claves)
+    if not claves:
+        return 0
+    fuera = [k for k in _items if k[0] in claves]
+    for k in fuera:
+        old, _mt = _items.pop(k)
+        _bytes -= len(old)
+    return len(fuera)
+
+
+def clear():
+    global _bytes
+    _items.clear()
+    _vistos.clear()
+    _bytes = 0
+
+
+def stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "entradas": len(_items),
+        "bytes": _bytes,
+        "max_bytes": settings.hot_cache_max_bytes,
+        "max_item": settings.hot_cache_max_item,
+        "hit_rate": round(_stats["hits"] / total, 4) if total else None,
+    }
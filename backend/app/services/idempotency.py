@@ -0,0 +1,81 @@
+# app/services/idempotency.py
+"""
+Idempotency-Key para /upload y /{captura_id}/version.
+
+Si el servidor hizo commit pero la respuesta no llegó al agente, el reintento trae
+la misma clave y se devuelve el {captura_id, version_id} original sin pasar por
+Pillow ni insertar filas. La clave se inserta en la MISMA transacción que la
+versión: o quedan las dos o ninguna.
+"""
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.idempotencia import IdempotencyKey
+
+MAX_KEY_LEN = 128
+
+
+def normalizar(header_key: str | None, form_key: str | None) -> str | None:
+    """Acepta la clave por header (Idempotency-Key) o por campo de formulario."""
+    key = (header_key or form_key or "").strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LEN:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key supera {MAX_KEY_LEN} caracteres")
+    return key
+
+
+def _vigente_desde() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=settings.idempotency_ttl)
+
+
+async def buscar(db: AsyncSession, scope: str, key: str | None) -> dict | None:
+    """Resultado guardado para (scope, key) si existe y no expiró."""
+    if not key:
+        return None
+    row = (
+        await db.execute(
+            select(IdempotencyKey.captura_id, IdempotencyKey.version_id).where(
+                IdempotencyKey.scope == scope,
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at >= _vigente_desde(),
+            )
+        )
+    ).first()
+    if not row:
+        return None
+    return {"captura_id": row.captura_id, "version_id": row.version_id}
+
+
+async def registrar(db: AsyncSession, scope: str, key: str | None, captura_id: int, version_id: int) -> bool:
+    """
+    Inserta la clave en la transacción en curso (el commit lo hace quien llama).
+    Devuelve False si otra petición con la misma clave ganó la carrera: quien llama
+    debe hacer rollback y responder con buscar(). Una clave expirada se reemplaza.
+    """
+    if not key:
+        return True
+    stmt = pg_insert(IdempotencyKey).values(
+        scope=scope, key=key, captura_id=captura_id, version_id=version_id, created_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+        set_={
+            "captura_id": stmt.excluded.captura_id,
+            "version_id": stmt.excluded.version_id,
+            "created_at": stmt.excluded.created_at,
+        },
+        where=IdempotencyKey.created_at < _vigente_desde(),
+    ).returning(IdempotencyKey.key)
+    return (await db.execute(stmt)).scalar_one_or_none() is not None
+
+
+async def purgar_expiradas(db: AsyncSession) -> int:
+    res = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _vigente_desde()))
+    await db.commit()
+    return res.rowcount or 0
@@ -0,0 +1,113 @@
+# app/services/image_pool.py
+"""
+Pool de procesos para el trabajo de Pillow (decode / resize / encode WebP / thumbs).
+
+El event loop solo encola y espera el resultado; si hay demasiados trabajos en
+vuelo se rechaza con ImagePoolSaturated para que el router responda 503 con
+Retry-After en vez de acumular uploads en memoria.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core.config import settings
+
+_executor: ProcessPoolExecutor | None = None
+_inflight = 0
+
+# etapa -> {"count", "total_ms", "max_ms"}
+_stage_stats: dict[str, dict] = {}
+_counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+
+class ImagePoolSaturated(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"image pool saturado; reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _max_inflight() -> int:
+    return settings.image_queue_max or settings.image_workers * 4
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: no heredar el event loop ni conexiones abiertas del proceso padre
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        print(f"[images] pool iniciado (workers={settings.image_workers}, max_inflight={_max_inflight()})", flush=True)
+    return _executor
+
+
+def _record(stage: str, ms: float):
+    st = _stage_stats.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    st["count"] += 1
+    st["total_ms"] += ms
+    st["max_ms"] = max(st["max_ms"], ms)
+
+
+def hay_worker_libre() -> bool:
+    """True si algún worker está ocioso: el trabajo de fondo solo encola entonces."""
+    return _inflight < settings.image_workers
+
+
+async def run(fn, *args):
+    """
+    Ejecuta fn(*args) en el pool. fn debe ser una función de módulo (picklable);
+    si devuelve un dict con "timings" ({etapa: ms}) se agregan a las estadísticas.
+    """
+    global _inflight
+    if _inflight >= _max_inflight():
+        _counters["rejected"] += 1
+        raise ImagePoolSaturated(settings.image_retry_after)
+
+    _inflight += 1
+    _counters["submitted"] += 1
+    t0 = time.perf_counter()
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    except Exception:
+        _counters["failed"] += 1
+        raise
+    finally:
+        _inflight -= 1
+
+    _counters["completed"] += 1
+    total_ms = (time.perf_counter() - t0) * 1000.0
+    timings = result.get("timings") if isinstance(result, dict) else None
+    if timings:
+        for stage, ms in timings.items():
+            _record(stage, ms)
+        # lo que no es trabajo del worker es espera en cola + IPC
+        _record("queue", max(0.0, total_ms - sum(timings.values())))
+    _record("total", total_ms)
+    return result
+
+
+def stats() -> dict:
+    return {
+        "workers": settings.image_workers,
+        "max_inflight": _max_inflight(),
+        "inflight": _inflight,
+        **_counters,
+        "stages": {
+            stage: {
+                "count": st["count"],
+                "avg_ms": round(st["total_ms"] / st["count"], 2) if st["count"] else 0.0,
+                "max_ms": round(st["max_ms"], 2),
+            }
+            for stage, st in _stage_stats.items()
+        },
+    }
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        print("[images] pool detenido", flush=True)
@@ -1,16 +1,241 @@
 from PIL import Image
+import hashlib
 import io
+import time
+import warnings
 
+from app.core.config import settings
 
-def to_webp_bytes(raw: bytes, max_size: int = 1920, quality: int = 82) -> tuple[bytes, str, int | None, int | None, int]:
+# Pillow avisa/lanza según este límite; lo alineamos con el nuestro (se valida también en open_image)
+Image.MAX_IMAGE_PIXELS = settings.image_max_pixels
+
+
+def content_hash(data: bytes) -> str:
+    """Hash de contenido (BLAKE2b-256, hex) con el que se deduplican los blobs."""
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def _lap(timings: dict | None, stage: str, t0: float) -> float:
+    """Acumula en timings[stage] los ms desde t0 y devuelve el nuevo instante."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - t0) * 1000.0
+    return now
+
+
+class ImagenRechazada(ValueError):
+    """La imagen no se acepta (p. ej. bomba de descompresión); no debe guardarse tal cual."""
+
+
+def _target_size(w: int, h: int, max_size: int) -> tuple[int, int]:
+    """Tamaño final que dejaría thumbnail((max_size, max_size)), sin agrandar."""
+    scale = min(max_size / float(w), max_size / float(h), 1.0)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def _target_width(w: int, h: int, max_w: int) -> tuple[int, int]:
+    """Tamaño final de reducir solo por ancho a max_w (el alto no acota), sin agrandar."""
+    tw = min(max_w, w)
+    return tw, max(1, int(h * tw / float(w)))
+
+
+def open_image(
+    raw: bytes, max_size: int | None = None, max_pixels: int | None = None, max_w: int | None = None
+) -> Image.Image:
+    """
+    Abre sin decodificar, valida el número de píxeles declarado en la cabecera y,
+    si es JPEG y se pide max_size (caja cuadrada) o max_w (solo ancho), activa draft()
+    para que libjpeg decodifique directamente a 1/2, 1/4 u 1/8 (nunca por debajo del
+    tamaño final).
+    """
+    with warnings.catch_warnings():
+        # el aviso de Pillow es redundante: abajo rechazamos con nuestro propio límite
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        img = Image.open(io.BytesIO(raw))
+    limit = max_pixels or settings.image_max_pixels
+    w, h = img.size
+    if w * h > limit:
+        raise ImagenRechazada(f"imagen de {w}x{h} supera el máximo de {limit} píxeles")
+    if img.format == "JPEG":
+        if max_w:
+            img.draft("RGB", _target_width(w, h, max_w))
+        elif max_size:
+            img.draft("RGB", _target_size(w, h, max_size))
+    return img
+
+
+# Variantes derivadas que se generan en el ingest a partir de la misma decodificación:
+# nombre -> (ancho máximo, formato, calidad)
+RENDITIONS = {
+    "thumb": (360, "WEBP", 70),          # board (CentrosTable / CentroCard)
+    "pdf": (1000, "JPEG", 85),           # ancho útil del informe PDF (~17 cm a 150 dpi)
+    "placeholder": (32, "WEBP", 40),     # LQIP mientras carga la miniatura real
+}
+RENDITION_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def _decode_resized(raw: bytes, max_size: int, timings: dict | None) -> Image.Image:
+    """Decodifica una sola vez (draft JPEG) y deja la imagen RGB dentro de max_size."""
+    t = time.perf_counter()
+    img = open_image(raw, max_size=max_size)
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGB")
+    img.load()
+    t = _lap(timings, "decode", t)
+    img.thumbnail((max_size, max_size))
+    img = img.convert("RGB")
+    _lap(timings, "resize", t)
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=6)
+    else:
+        img.save(out, format=fmt, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def to_webp_bytes(
+    raw: bytes, max_size: int = 1920, quality: int = 82, timings: dict | None = None
+) -> tuple[bytes, str, int | None, int | None, int]:
     try:
-        img = Image.open(io.BytesIO(raw)).convert("RGB")
-        img.thumbnail((max_size, max_size))
+        img = _decode_resized(raw, max_size, timings)
+        t = time.perf_counter()
         out = io.BytesIO()
         img.save(out, format="WEBP", quality=quality)
         webp = out.getvalue()
+        _lap(timings, "encode", t)
         w, h = img.size
         return webp, "image/webp", w, h, len(webp)
+    except (ImagenRechazada, Image.DecompressionBombError) as e:
+        raise ImagenRechazada(str(e))
     except Exception:
     # fallback: devuelve original
-     return raw, "application/octet-stream", None, None, len(raw)
\ No newline at end of file
+     return raw, "application/octet-stream", None, None, len(raw)
+
+
+def render_renditions(
+    raw: bytes, max_size: int = 1920, quality: int = 82, timings: dict | None = None
+) -> dict[str, dict]:
+    """
+    Pipeline de una sola decodificación: WebP principal ("full") + cada variante de
+    RENDITIONS, todas derivadas del mismo frame ya reducido. Cada entrada lleva
+    bytes, content_type, ancho, alto y peso_bytes. Si no se puede decodificar,
+    devuelve solo "full" con el original (mismo fallback que to_webp_bytes).
+    """
+    try:
+        img = _decode_resized(raw, max_size, timings)
+    except (ImagenRechazada, Image.DecompressionBombError) as e:
+        raise ImagenRechazada(str(e))
+    except Exception:
+        return {"full": {"bytes": raw, "content_type": "application/octet-stream",
+                         "ancho": None, "alto": None, "peso_bytes": len(raw)}}
+
+    t = time.perf_counter()
+    out = io.BytesIO()
+    img.save(out, format="WEBP", quality=quality)
+    full = out.getvalue()
+    t = _lap(timings, "encode", t)
+    res = {"full": {"bytes": full, "content_type": "image/webp",
+                    "ancho": img.width, "alto": img.height, "peso_bytes": len(full)}}
+
+    for name, (max_w, fmt, q) in RENDITIONS.items():
+        r = img
+        if img.width > max_w:
+            scale = max_w / float(img.width)
+            r = img.resize((max_w, max(1, int(img.height * scale))))
+        data = _encode(r, fmt, q)
+        res[name] = {"bytes": data, "content_type": RENDITION_TYPES[fmt],
+                     "ancho": r.width, "alto": r.height, "peso_bytes": len(data)}
+        t = _lap(timings, name, t)
+    return res
+
+
+def generar_thumbs(raw: bytes, variantes: list[tuple[int, int]]) -> dict:
+    """
+    Varias miniaturas WebP (ancho, calidad, sin agrandar) desde una sola decodificación
+    (pensado para el pool de procesos: thumbs a demanda y precalentado).
+    Lanza excepción si no se puede decodificar.
+    """
+    timings: dict = {}
+    t = time.perf_counter()
+    # las miniaturas solo acotan el ancho: el draft sale de ese ancho, no de una caja
+    # cuadrada (en una imagen alta la caja dejaría decodificar por debajo de max_w)
+    img = open_image(raw, max_w=max(w for w, _ in variantes))
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    img.load()
+    t = _lap(timings, "decode", t)
+    res = {}
+    w, h = img.size
+    for max_w, quality in variantes:
+        r = img
+        if w > max_w:
+            scale = max_w / float(w)
+            r = img.resize((int(w * scale), int(h * scale)))
+        out = io.BytesIO()
+        r.save(out, format="WEBP", quality=quality, method=6)
+        res[(max_w, quality)] = out.getvalue()
+        t = _lap(timings, "warm_thumb", t)
+    return {"thumbs": res, "timings": timings}
+
+
+def componer_sprite(fuentes: list, cols: int, cell_w: int, cell_h: int, quality: int = 70) -> dict:
+    """
+    Sprite WebP (pensado para el pool de procesos): cada fuente (bytes de una miniatura,
+    o None) se reduce para caber en su celda de cell_w x cell_h y se centra.
+    Celdas en orden de fila; una fuente que no se puede decodificar deja la celda vacía.
+    """
+    timings: dict = {}
+    n = len(fuentes)
+    rows = max(1, -(-n // cols))
+    sheet = Image.new("RGB", (cols * cell_w, rows * cell_h), (24, 24, 24))
+    t = time.perf_counter()
+    for i, raw in enumerate(fuentes):
+        if not raw:
+            continue
+        try:
+            img = open_image(raw, max_size=max(cell_w, cell_h))
+            img.thumbnail((cell_w, cell_h))
+            img = img.convert("RGB")
+        except Exception:
+            continue
+        x = (i % cols) * cell_w + (cell_w - img.width) // 2
+        y = (i // cols) * cell_h + (cell_h - img.height) // 2
+        sheet.paste(img, (x, y))
+    t = _lap(timings, "sprite_decode", t)
+    data = _encode(sheet, "WEBP", quality)
+    _lap(timings, "sprite_encode", t)
+    return {"bytes": data, "ancho": sheet.width, "alto": sheet.height, "timings": timings}
+
+
+def procesar_upload(raw: bytes, max_size: int = 1920, quality: int = 82) -> dict:
+    """
+    Trabajo completo de un upload (pensado para correr en el pool de procesos):
+    todas las variantes desde una sola decodificación + hash de contenido del
+    WebP principal, con tiempos por etapa en ms. La retención lo reutiliza con
+    max_size/quality de archivo para re-codificar versiones viejas.
+    """
+    timings: dict = {}
+    renditions = render_renditions(raw, max_size=max_size, quality=quality, timings=timings)
+    full = renditions.pop("full")
+
+    t = time.perf_counter()
+    blob_hash = content_hash(full["bytes"])
+    _lap(timings, "hash", t)
+
+    # si no hubo decodificación, se cachea la imagen tal cual (comportamiento previo)
+    thumb = renditions["thumb"]["bytes"] if "thumb" in renditions else full["bytes"]
+    return {
+        "bytes": full["bytes"],
+        "hash": blob_hash,
+        "content_type": full["content_type"],
+        "ancho": full["ancho"],
+        "alto": full["alto"],
+        "peso_bytes": full["peso_bytes"],
+        "thumb": thumb,
+        "renditions": renditions,
+        "timings": timings,
+    }
@@ -0,0 +1,304 @@
+# app/services/ingest.py
+"""
+Ruta común de ingesta de imágenes: resolver centro/dispositivo, transcodificar
+en el pool y guardar Captura + CapturaVersion. La usan /upload, /version y el
+spool asíncrono, para que todas las entradas se comporten igual.
+"""
+import asyncio
+from collections import Counter
+from datetime import date
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.capturas import Captura, CapturaVersion
+from app.models.ordenes import OrdenCaptura
+from app.services import catalog, idempotency, image_pool, thumb_warmer, ultima, uso
+from app.services.blobs import borrar_si_huerfanos, put_blob, put_renditions
+from app.services.image_pool import ImagePoolSaturated
+from app.services.images import ImagenRechazada, procesar_upload
+from app.services.thumbs import save_thumb, thumb_key
+
+
+async def procesar_imagen(raw: bytes) -> dict:
+    """Transcodifica en el pool de procesos; si está saturado responde 503 + Retry-After."""
+    try:
+        res = await image_pool.run(procesar_upload, raw)
+    except ImagePoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="procesador de imágenes saturado, reintente más tarde",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ImagenRechazada as e:
+        raise HTTPException(status_code=413, detail=f"imagen rechazada: {e}")
+    t = res["timings"]
+    print(
+        "[upload] timings ms: " + " ".join(f"{k}={v:.0f}" for k, v in t.items()),
+        flush=True,
+    )
+    return res
+
+
+async def resolver_destino(
+    db: AsyncSession,
+    uuid_equipo: str | None,
+    cliente_id: int | None,
+    centro_id: int | None,
+    dispositivo_id: int | None,
+) -> tuple[int, int, int | None]:
+    """Devuelve (cliente_id, centro_id, dispositivo_id) a partir del uuid_equipo o de los IDs."""
+    # 0) Resolver por UUID si viene (cache de catálogo)
+    if uuid_equipo:
+        cen = await catalog.centro_por_uuid(db, uuid_equipo)
+        if not cen:
+            raise HTTPException(status_code=404, detail="centro no encontrado para uuid_equipo")
+
+        # Consistencia si además mandaron IDs
+        if cliente_id and cliente_id != cen.cliente_id:
+            raise HTTPException(status_code=400, detail="cliente_id no coincide con uuid_equipo")
+        if centro_id and centro_id != cen.id:
+            raise HTTPException(status_code=400, detail="centro_id no coincide con uuid_equipo")
+
+        cliente_id = cen.cliente_id
+        centro_id = cen.id
+
+        # Resolver dispositivo_id (opcional y seguro): último usado por el centro, ya validado
+        if dispositivo_id is None:
+            dispositivo_id = await catalog.dispositivo_por_defecto(db, centro_id)
+
+        # Si nos mandaron un dispositivo_id, verificar que exista en tabla dispositivos.
+        elif not await catalog.dispositivo_existe(db, dispositivo_id):
+            # Evita romper FK: dejarlo en NULL
+            print(f"[upload] dispositivo_id={dispositivo_id} no existe -> usando NULL", flush=True)
+            dispositivo_id = None
+
+    # 1) Si no vino uuid_equipo, exigir los 3 IDs (como antes)
+    if not uuid_equipo and not all([cliente_id, centro_id, dispositivo_id]):
+        raise HTTPException(
+            status_code=400,
+            detail="Faltan identificadores: envía uuid_equipo o los campos cliente_id, centro_id, dispositivo_id."
+        )
+    return cliente_id, centro_id, dispositivo_id
+
+
+# Debe coincidir con la expresión del índice único ux_capturas_centro_disp_fecha
+CAPTURA_DIA_CONFLICT = [Captura.centro_id, text("COALESCE(dispositivo_id, 0)"), Captura.fecha_reporte]
+
+
+async def upsert_captura(
+    db: AsyncSession,
+    cliente_id: int,
+    centro_id: int,
+    dispositivo_id: int | None,
+    fecha_reporte: date,
+    estado: str = "pendiente",
+) -> Captura:
+    """
+    Captura del día (dispositivo_id puede ser NULL) en un solo round trip:
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING. El DO UPDATE no cambia nada,
+    solo hace que RETURNING devuelva la fila existente. Si ya existía se respeta
+    su estado. No hace commit.
+    """
+    stmt = pg_insert(Captura).values(
+        cliente_id=cliente_id,
+        centro_id=centro_id,
+        dispositivo_id=dispositivo_id,
+        fecha_reporte=fecha_reporte,
+        estado=estado,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=CAPTURA_DIA_CONFLICT,
+        set_={"fecha_reporte": stmt.excluded.fecha_reporte},
+    ).returning(Captura)
+    captura = (
+        await db.execute(stmt, execution_options={"populate_existing": True})
+    ).scalar_one()
+    catalog.nota_captura(centro_id, dispositivo_id)
+    return captura
+
+
+async def captura_del_dia(
+    db: AsyncSession, cliente_id: int, centro_id: int, dispositivo_id: int | None, fecha_reporte: date
+) -> Captura:
+    """Captura del día para el ingest (la crea pendiente si no existe)."""
+    return await upsert_captura(db, cliente_id, centro_id, dispositivo_id, fecha_reporte)
+
+
+async def agregar_version(db: AsyncSession, captura_id: int, origen: str, img: dict) -> CapturaVersion:
+    """
+    Referencia (o guarda) el blob y agrega la CapturaVersion (su peso al rollup y el
+    puntero a la última versión de la captura). No hace commit.
+    """
+    if await put_blob(db, img["hash"], img["bytes"], img["content_type"], img["ancho"], img["alto"]):
+        await put_renditions(db, img["hash"], img["renditions"])
+    await uso.ajustar(db, [(captura_id, 1, img["peso_bytes"])])
+    version = CapturaVersion(
+        captura_id=captura_id,
+        origen=origen,
+        blob_hash=img["hash"],
+        content_type=img["content_type"],
+        ancho=img["ancho"],
+        alto=img["alto"],
+        peso_bytes=img["peso_bytes"],
+    )
+    db.add(version)
+    await db.flush()
+    await ultima.registrar(db, [(captura_id, version.id, version.tomada_en)])
+    return version
+
+
+def despues_de_commit(version: CapturaVersion, img: dict):
+    """Trabajo posterior al commit (fuera de la transacción): thumb en disco. Bloquea: va en un hilo."""
+    save_thumb(thumb_key(version.id, version.blob_hash), img["thumb"], max_w=360, quality=70)
+
+
+async def ingest_captura(
+    db: AsyncSession,
+    *,
+    cliente_id: int,
+    centro_id: int,
+    dispositivo_id: int | None,
+    fecha_reporte: date,
+    origen: str,
+    img: dict,
+    idempotency_key: str | None = None,
+    orden_id: int | None = None,
+) -> dict:
+    """
+    Guarda la imagen ya procesada en la captura del día y hace commit.
+    Con idempotency_key la clave se registra en la misma transacción; con orden_id
+    la orden queda 'tomada' en esa misma transacción (el agente no necesita el ack).
+    """
+    captura = await captura_del_dia(db, cliente_id, centro_id, dispositivo_id, fecha_reporte)
+    version = await agregar_version(db, captura.id, origen, img)
+    tomada = await tomar_orden(db, orden_id) if orden_id else False
+    res = await confirmar_version(db, version, img, "upload", idempotency_key)
+    if orden_id:
+        res["orden_tomada"] = tomada
+    return res
+
+
+async def tomar_orden(db: AsyncSession, orden_id: int) -> bool:
+    """Marca la orden como 'tomada' (idempotente). False si no existe. No hace commit."""
+    hit = (
+        await db.execute(
+            update(OrdenCaptura)
+            .where(OrdenCaptura.id == orden_id)
+            .values(estado="tomada")
+            .returning(OrdenCaptura.id)
+        )
+    ).scalar_one_or_none()
+    if hit is None:
+        print(f"[upload] orden_id={orden_id} no existe; se guarda la imagen igual", flush=True)
+    return hit is not None
+
+
+async def confirmar_version(
+    db: AsyncSession, version: CapturaVersion, img: dict, scope: str, idempotency_key: str | None
+) -> dict:
+    """
+    Commit de una versión recién agregada (+ su Idempotency-Key si viene). Si otra
+    petición con la misma clave ya hizo commit se descarta esta y se devuelve aquella.
+    """
+    await db.flush()
+    if not await idempotency.registrar(db, scope, idempotency_key, version.captura_id, version.id):
+        await db.rollback()
+        # el objeto que put_blob escribió en el store queda sin fila si el hash era nuevo
+        await borrar_si_huerfanos(db, [img["hash"]])
+        previo = await idempotency.buscar(db, scope, idempotency_key)
+        print(f"[upload] idempotency-key repetida en carrera ({scope}) -> {previo}", flush=True)
+        if previo:
+            return previo
+        raise HTTPException(status_code=409, detail="petición con la misma Idempotency-Key en curso")
+    await db.commit()
+    await db.refresh(version)
+    await asyncio.to_thread(despues_de_commit, version, img)
+    thumb_warmer.notificar([version.id])
+    return {"captura_id": version.captura_id, "version_id": version.id}
+
+
+async def procesar_lote(raws: list[bytes]) -> list[dict | HTTPException]:
+    """
+    Transcodifica varias imágenes sin ocupar más workers de los que tiene el pool.
+    Devuelve, por posición, el resultado o la HTTPException de esa imagen.
+    """
+    sem = asyncio.Semaphore(max(1, settings.image_workers))
+
+    async def uno(raw: bytes):
+        async with sem:
+            try:
+                return await procesar_imagen(raw)
+            except HTTPException as e:
+                return e
+
+    return await asyncio.gather(*(uno(r) for r in raws))
+
+
+async def ingest_lote(
+    db: AsyncSession,
+    *,
+    cliente_id: int,
+    centro_id: int,
+    entradas: list[dict],
+) -> list[dict]:
+    """
+    Guarda un lote ya procesado en UNA transacción. Cada entrada trae
+    fecha_reporte, origen, dispositivo_id e img. Las capturas del día se resuelven
+    una vez por (fecha, dispositivo) y las versiones se insertan con executemany.
+    Devuelve [{captura_id, version_id}] en el mismo orden.
+    """
+    capturas: dict[tuple, int] = {}
+    for e in entradas:
+        key = (e["fecha_reporte"], e["dispositivo_id"])
+        if key not in capturas:
+            cap = await captura_del_dia(db, cliente_id, centro_id, e["dispositivo_id"], e["fecha_reporte"])
+            capturas[key] = cap.id
+
+    # un put por blob distinto, sumando tantas referencias como versiones lo usan
+    refs = Counter(e["img"]["hash"] for e in entradas)
+    vistos: set[str] = set()
+    for e in entradas:
+        img = e["img"]
+        if img["hash"] in vistos:
+            continue
+        vistos.add(img["hash"])
+        if await put_blob(db, img["hash"], img["bytes"], img["content_type"], img["ancho"], img["alto"],
+                          refs=refs[img["hash"]]):
+            await put_renditions(db, img["hash"], img["renditions"])
+
+    rows = [
+        {
+            "captura_id": capturas[(e["fecha_reporte"], e["dispositivo_id"])],
+            "origen": e["origen"],
+            "blob_hash": e["img"]["hash"],
+            "content_type": e["img"]["content_type"],
+            "ancho": e["img"]["ancho"],
+            "alto": e["img"]["alto"],
+            "peso_bytes": e["img"]["peso_bytes"],
+        }
+        for e in entradas
+    ]
+    creadas = (
+        await db.execute(
+            insert(CapturaVersion).returning(
+                CapturaVersion.id, CapturaVersion.tomada_en, sort_by_parameter_order=True
+            ),
+            rows,
+        )
+    ).all()
+    ids = [c.id for c in creadas]
+    await uso.ajustar(db, ((r["captura_id"], 1, r["peso_bytes"]) for r in rows))
+    await ultima.registrar(db, ((r["captura_id"], c.id, c.tomada_en) for r, c in zip(rows, creadas)))
+    await db.commit()
+
+    def _thumbs():
+        for e, vid in zip(entradas, ids):
+            save_thumb(thumb_key(vid, e["img"]["hash"]), e["img"]["thumb"], max_w=360, quality=70)
+
+    await asyncio.to_thread(_thumbs)
+    thumb_warmer.notificar(ids)
+    return [{"captura_id": r["captura_id"], "version_id": vid} for r, vid in zip(rows, ids)]
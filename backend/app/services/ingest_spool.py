@@ -0,0 +1,252 @@
+# app/services/ingest_spool.py
+"""
+Spool durable en disco para la ingesta asíncrona (POST /api/capturas/upload/spool).
+
+El endpoint solo escribe el upload crudo + su metadata, hace fsync y responde
+202 con un ticket; los workers de este módulo lo drenan después hacia
+Captura/CapturaVersion usando la misma ruta que /upload.
+
+    spool/tmp/      escrituras en curso (se descartan al reiniciar)
+    spool/pending/  {lane}-{ns}-{ticket}.bin + .json  (el .json se publica último)
+    spool/status/   {ticket}.json  (estado consultable por el agente)
+
+El nombre ordena por línea y antigüedad: las retomas (lane 0) pasan antes que
+las automáticas (lane 1). Al arrancar se re-encola todo lo que quedó en pending.
+
+Cada item se ingesta con una Idempotency-Key (la del cliente, guardada en la meta, o
+"spool:{ticket}"): si el proceso cae después del commit y antes de borrar el item,
+el reintento devuelve el resultado guardado en vez de insertar otra versión.
+"""
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services import idempotency
+from app.services.ingest import ingest_captura, procesar_imagen, resolver_destino
+
+LANE_RETOMA = 0
+LANE_NORMAL = 1
+MAX_BACKOFF_SEC = 60
+
+SPOOL_DIR = Path(settings.spool_dir)
+TMP_DIR = SPOOL_DIR / "tmp"
+PENDING_DIR = SPOOL_DIR / "pending"
+STATUS_DIR = SPOOL_DIR / "status"
+for _d in (TMP_DIR, PENDING_DIR, STATUS_DIR):
+    _d.mkdir(parents=True, exist_ok=True)
+
+_TICKET_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_queue: asyncio.PriorityQueue | None = None
+_tasks: list[asyncio.Task] = []
+_seq = itertools.count()
+_attempts: dict[str, int] = {}
+
+
+def _lane(origen: str) -> int:
+    return LANE_RETOMA if origen == "retoma" else LANE_NORMAL
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_durable(dest: Path, data: bytes):
+    """Escribe en tmp/, fsync, y publica con rename atómico."""
+    tmp = TMP_DIR / f"{dest.name}.{uuid.uuid4().hex[:8]}"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, dest)
+
+
+def _write_status(ticket: str, **fields):
+    path = STATUS_DIR / f"{ticket}.json"
+    try:
+        rec = json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        rec = {"ticket": ticket}
+    rec.update(fields, actualizado=datetime.now(timezone.utc).isoformat())
+    _write_durable(path, json.dumps(rec).encode())
+
+
+def _spool_sync(raw: bytes, meta: dict) -> tuple[str, str, int]:
+    ticket = uuid.uuid4().hex
+    lane = _lane(meta.get("origen") or "auto")
+    name = f"{lane}-{time.time_ns():020d}-{ticket}"
+    meta = {**meta, "ticket": ticket, "recibido": datetime.now(timezone.utc).isoformat()}
+
+    # .bin primero; el .json es la marca de "listo para procesar"
+    _write_durable(PENDING_DIR / f"{name}.bin", raw)
+    _write_durable(PENDING_DIR / f"{name}.json", json.dumps(meta).encode())
+    _fsync_dir(PENDING_DIR)
+    _write_status(ticket, estado="pendiente", origen=meta.get("origen"), recibido=meta["recibido"])
+    return ticket, name, lane
+
+
+async def submit(raw: bytes, meta: dict) -> str:
+    """Persiste el upload en el spool (con fsync) y lo encola. Devuelve el ticket."""
+    ticket, name, lane = await asyncio.to_thread(_spool_sync, raw, meta)
+    if _queue is not None:
+        _queue.put_nowait((lane, next(_seq), name))
+    return ticket
+
+
+def estado(ticket: str) -> dict | None:
+    if not _TICKET_RE.match(ticket or ""):
+        return None
+    try:
+        return json.loads((STATUS_DIR / f"{ticket}.json").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _remove(name: str):
+    for ext in (".json", ".bin"):
+        try:
+            (PENDING_DIR / f"{name}{ext}").unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _load(name: str) -> tuple[dict, bytes]:
+    meta = json.loads((PENDING_DIR / f"{name}.json").read_text())
+    raw = (PENDING_DIR / f"{name}.bin").read_bytes()
+    return meta, raw
+
+
+async def _process(name: str):
+    meta, raw = await asyncio.to_thread(_load, name)
+    ticket = meta["ticket"]
+    await asyncio.to_thread(_write_status, ticket, estado="procesando")
+
+    idem_key = meta.get("idempotency_key") or f"spool:{ticket}"
+
+    async with SessionLocal() as db:
+        # ya aplicado (reintento tras caída, o el mismo upload encolado dos veces)
+        res = await idempotency.buscar(db, "upload", idem_key)
+        if res:
+            print(f"[spool] ticket={ticket} ya aplicado -> {res}", flush=True)
+        else:
+            cliente_id, centro_id, dispositivo_id = await resolver_destino(
+                db, meta.get("uuid_equipo"), meta.get("cliente_id"), meta.get("centro_id"), meta.get("dispositivo_id")
+            )
+            img = await procesar_imagen(raw)
+            res = await ingest_captura(
+                db,
+                cliente_id=cliente_id,
+                centro_id=centro_id,
+                dispositivo_id=dispositivo_id,
+                fecha_reporte=date.fromisoformat(meta["fecha_reporte"]),
+                origen=meta.get("origen") or "auto",
+                img=img,
+                idempotency_key=idem_key,
+                orden_id=meta.get("orden_id"),
+            )
+
+    await asyncio.to_thread(_write_status, ticket, estado="ok", **res)
+    await asyncio.to_thread(_remove, name)
+
+
+def _retry_later(item: tuple, delay: float):
+    asyncio.get_running_loop().call_later(delay, _queue.put_nowait, item)
+
+
+async def _worker(n: int):
+    while True:
+        item = await _queue.get()
+        name = item[2]
+        ticket = name.rsplit("-", 1)[-1]
+        try:
+            await _process(name)
+            _attempts.pop(ticket, None)
+        except asyncio.CancelledError:
+            raise
+        except FileNotFoundError:
+            # ya procesado por otro worker o borrado a mano
+            _attempts.pop(ticket, None)
+        except HTTPException as e:
+            if e.status_code == 503:
+                # pool de imágenes saturado: volver a intentar sin contar como fallo
+                _retry_later(item, float((e.headers or {}).get("Retry-After", 5)))
+            else:
+                # error definitivo (centro inexistente, imagen rechazada...): se informa y se descarta
+                print(f"[spool] ticket={ticket} error {e.status_code}: {e.detail}", flush=True)
+                await asyncio.to_thread(_write_status, ticket, estado="error", status_code=e.status_code, detail=e.detail)
+                await asyncio.to_thread(_remove, name)
+                _attempts.pop(ticket, None)
+        except Exception as e:
+            # transitorio (BD caída, etc.): backoff exponencial, el archivo sigue en pending
+            k = _attempts[ticket] = _attempts.get(ticket, 0) + 1
+            delay = min(MAX_BACKOFF_SEC, 2 ** k)
+            print(f"[spool] ticket={ticket} intento {k} falló: {e!r}; reintento en {delay}s", flush=True)
+            await asyncio.to_thread(_write_status, ticket, estado="pendiente", intentos=k, detail=repr(e))
+            _retry_later(item, delay)
+        finally:
+            _queue.task_done()
+
+
+def _recover() -> list[tuple]:
+    # escrituras a medio hacer de una ejecución anterior
+    for p in TMP_DIR.iterdir():
+        p.unlink(missing_ok=True)
+    items = []
+    for p in sorted(PENDING_DIR.glob("*.json")):
+        name = p.stem
+        lane = int(name.split("-", 1)[0])
+        items.append((lane, next(_seq), name))
+    return items
+
+
+async def start():
+    global _queue
+    if _tasks:
+        return
+    _queue = asyncio.PriorityQueue()
+    items = await asyncio.to_thread(_recover)
+    for it in items:
+        _queue.put_nowait(it)
+    for n in range(settings.spool_workers):
+        _tasks.append(asyncio.create_task(_worker(n)))
+    print(f"[spool] iniciado en {SPOOL_DIR} (workers={settings.spool_workers}, pendientes={len(items)})", flush=True)
+
+
+async def stop():
+    for t in _tasks:
+        t.cancel()
+    for t in _tasks:
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    print("[spool] detenido", flush=True)
+
+
+def limpiar_estados(max_age_sec: int = 7 * 24 * 3600) -> int:
+    """Borra estados de tickets terminados más viejos que max_age_sec (los pendientes se conservan)."""
+    limit = time.time() - max_age_sec
+    n = 0
+    for p in STATUS_DIR.glob("*.json"):
+        try:
+            if p.stat().st_mtime < limit and json.loads(p.read_text()).get("estado") in ("ok", "error"):
+                p.unlink()
+                n += 1
+        except (FileNotFoundError, ValueError):
+            pass
+    return n
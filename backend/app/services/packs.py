@@ -0,0 +1,182 @@
+# app/services/packs.py
+"""
+Archivo frío de imágenes en packfiles (app.jobs.archivar_packs).
+
+Un pack son dos archivos inmutables en PACK_DIR:
+
+    {nombre}.pack   MAGIC_PACK + bytes de cada imagen concatenados (sin separadores)
+    {nombre}.idx    MAGIC_IDX + n (u64) + n registros de tamaño fijo ordenados por version_id:
+                    version_id u64 | offset u64 | largo u32 | hash BLAKE2b-256 (32 bytes)
+
+Se leen con mmap: la búsqueda es binaria sobre el índice mapeado (O(log n), sin cargar
+nada) y la imagen se entrega como memoryview del .pack, sin copiarla. Versiones con
+el mismo contenido comparten offset dentro del pack.
+"""
+import mmap
+import os
+import struct
+import threading
+import uuid
+from pathlib import Path
+
+from app.core.config import settings
+
+MAGIC_PACK = b"ORCAPK1\n"
+MAGIC_IDX = b"ORCAIX1\n"
+_HEADER = struct.Struct(">Q")
+_REC = struct.Struct(">QQI32s")
+_IDX_DATA = len(MAGIC_IDX) + _HEADER.size
+
+
+def pack_dir() -> Path:
+    d = Path(settings.pack_dir)
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+
+def _paths(nombre: str) -> tuple[Path, Path]:
+    if not nombre or "/" in nombre or nombre.startswith("."):
+        raise ValueError(f"nombre de pack inválido: {nombre!r}")
+    d = pack_dir()
+    return d / f"{nombre}.pack", d / f"{nombre}.idx"
+
+
+class PackWriter:
+    """Escribe un pack nuevo en archivos temporales; cerrar() ordena el índice, fsync y publica."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.pack_path, self.idx_path = _paths(nombre)
+        if self.pack_path.exists():
+            raise FileExistsError(self.pack_path)
+        suffix = f".{uuid.uuid4().hex[:8]}.tmp"
+        self._tmp = self.pack_path.with_name(f".{self.pack_path.name}{suffix}")
+        self._fh = open(self._tmp, "wb")
+        self._fh.write(MAGIC_PACK)
+        self._offset = len(MAGIC_PACK)
+        self._por_hash: dict[bytes, tuple[int, int]] = {}
+        self._recs: list[tuple[int, int, int, bytes]] = []
+        self.bytes_escritos = 0
+
+    def agregar(self, version_id: int, data: bytes, blob_hash: str):
+        digest = bytes.fromhex(blob_hash)
+        pos = self._por_hash.get(digest)
+        if pos is None:
+            self._fh.write(data)
+            pos = (self._offset, len(data))
+            self._por_hash[digest] = pos
+            self._offset += len(data)
+            self.bytes_escritos += len(data)
+        self._recs.append((version_id, pos[0], pos[1], digest))
+
+    def __len__(self):
+        return len(self._recs)
+
+    def cerrar(self) -> int:
+        """Publica .pack e .idx (primero el .pack: un .idx visible siempre apunta a datos completos)."""
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        os.replace(self._tmp, self.pack_path)
+
+        self._recs.sort(key=lambda r: r[0])
+        tmp_idx = self.idx_path.with_name(f".{self.idx_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_idx, "wb") as fh:
+            fh.write(MAGIC_IDX)
+            fh.write(_HEADER.pack(len(self._recs)))
+            for rec in self._recs:
+                fh.write(_REC.pack(*rec))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_idx, self.idx_path)
+        return len(self._recs)
+
+    def descartar(self):
+        try:
+            self._fh.close()
+        finally:
+            self._tmp.unlink(missing_ok=True)
+
+
+class PackReader:
+    """Pack abierto con mmap (solo lectura). Los memoryview devueltos viven mientras el reader."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        pack_path, idx_path = _paths(nombre)
+        with open(idx_path, "rb") as fi, open(pack_path, "rb") as fp:
+            self._idx = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pack = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx[: len(MAGIC_IDX)] != MAGIC_IDX or self._pack[: len(MAGIC_PACK)] != MAGIC_PACK:
+            raise ValueError(f"pack {nombre} corrupto (cabecera)")
+        (self.n,) = _HEADER.unpack_from(self._idx, len(MAGIC_IDX))
+        self._view = memoryview(self._pack)
+
+    def _rec(self, i: int) -> tuple[int, int, int, bytes]:
+        return _REC.unpack_from(self._idx, _IDX_DATA + i * _REC.size)
+
+    def buscar(self, version_id: int) -> tuple[int, int, str] | None:
+        """(offset, largo, hash) de la versión, por búsqueda binaria sobre el índice mapeado."""
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            vid = _REC_VID.unpack_from(self._idx, _IDX_DATA + mid * _REC.size)[0]
+            if vid < version_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n:
+            vid, off, largo, digest = self._rec(lo)
+            if vid == version_id:
+                return off, largo, digest.hex()
+        return None
+
+    def leer(self, version_id: int) -> memoryview | None:
+        hit = self.buscar(version_id)
+        if hit is None:
+            return None
+        off, largo, _ = hit
+        return self._view[off:off + largo]
+
+
+# solo el version_id del registro (evita desempaquetar el hash en cada paso de la búsqueda)
+_REC_VID = struct.Struct(">Q")
+
+_readers: dict[str, PackReader] = {}
+_lock = threading.Lock()
+
+
+def abrir(nombre: str) -> PackReader:
+    """
+    Reader cacheado por nombre. Los packs son inmutables y pocos (uno por mes
+    archivado), así que quedan mapeados mientras viva el proceso.
+    """
+    r = _readers.get(nombre)
+    if r is None:
+        with _lock:
+            r = _readers.get(nombre)
+            if r is None:
+                r = _readers[nombre] = PackReader(nombre)
+    return r
+
+
+def leer(nombre: str, version_id: int) -> memoryview | None:
+    try:
+        return abrir(nombre).leer(version_id)
+    except FileNotFoundError:
+        print(f"[packs] WARNING pack {nombre} no existe", flush=True)
+        return None
+
+
+def leer_bytes(nombre: str, version_id: int) -> bytes | None:
+    """Copia de los bytes de la versión (para llamar en un hilo: abrir y paginar el mmap bloquean)."""
+    vista = leer(nombre, version_id)
+    return bytes(vista) if vista is not None else None
+
+
+def hash_en_pack(nombre: str, version_id: int) -> str | None:
+    try:
+        hit = abrir(nombre).buscar(version_id)
+    except FileNotFoundError:
+        return None
+    return hit[2] if hit else None
@@ -0,0 +1,53 @@
+# app/services/particiones.py
+"""
+Particiones mensuales de captura_versiones (sql/007).
+
+El scheduler mantiene creadas las particiones de los próximos PARTITION_MONTHS_AHEAD
+meses: sin partición para el mes en curso un INSERT fallaría. Los meses viejos se
+pueden separar sin bloquear la tabla (ver README_DEPLOY.md).
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+
+
+async def esta_particionada(db: AsyncSession) -> bool:
+    relkind = (
+        await db.execute(text("SELECT relkind FROM pg_class WHERE oid = 'captura_versiones'::regclass"))
+    ).scalar_one_or_none()
+    return relkind == "p"
+
+
+async def asegurar_particiones(db: AsyncSession, meses: int | None = None) -> int:
+    """Crea las particiones que falten hasta `meses` meses adelante. 0 si la tabla no está particionada."""
+    if not await esta_particionada(db):
+        return 0
+    n = (
+        await db.execute(
+            text("SELECT capver_asegurar_particiones(:meses)"),
+            {"meses": settings.partition_months_ahead if meses is None else meses},
+        )
+    ).scalar_one()
+    await db.commit()
+    return n
+
+
+async def listar_particiones(db: AsyncSession) -> list[dict]:
+    """Particiones con su rango y tamaño en disco (para operar detach/archivo)."""
+    rows = (
+        await db.execute(
+            text(
+                """
+                SELECT c.relname AS nombre,
+                       pg_get_expr(c.relpartbound, c.oid) AS rango,
+                       pg_total_relation_size(c.oid) AS bytes
+                  FROM pg_inherits i
+                  JOIN pg_class c ON c.oid = i.inhrelid
+                 WHERE i.inhparent = 'captura_versiones'::regclass
+                 ORDER BY c.relname
+                """
+            )
+        )
+    ).mappings().all()
+    return [dict(r) for r in rows]
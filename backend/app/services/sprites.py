@@ -0,0 +1,97 @@
+# app/services/sprites.py
+"""
+Sprites de miniaturas para una página del board: una sola imagen con una celda por
+captura y un mapa de offsets, en vez de una petición /ultima/thumb por fila.
+
+El sprite se identifica por la tupla ordenada de claves de contenido de las celdas
+(thumb_key: version_id o blob_hash, más tamaño de celda, calidad y columnas): mientras
+ninguna captura de la página tenga una versión nueva o compactada, la clave no cambia y se sirve desde el cache de thumbs en disco (clave "s<digest>",
+con el mismo LRU y presupuesto que las miniaturas). Las celdas salen solo de
+miniaturas estándar: la que falte (versiones legadas o archivadas sin variante) se
+genera de a una en el pool y queda en el cache, así nunca se juntan originales en
+memoria. La composición también corre en el pool de imágenes.
+"""
+import asyncio
+import hashlib
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services import image_pool
+from app.services.image_pool import ImagePoolSaturated
+from app.services.blobs import get_rendition, rendition_bytes, version_bytes
+from app.services.images import RENDITIONS, componer_sprite, generar_thumbs
+from app.services.thumbs import save_thumb, thumb_en_disco, thumb_key
+
+# clave -> [lock, coroutines que lo usan o esperan]; se quita cuando nadie lo referencia
+_locks: dict[str, list] = {}
+
+
+def sprite_key(claves, cell_w: int, quality: int, cols: int, cell_h: int) -> str:
+    """claves: thumb_key de cada celda (None = vacía); cambian con una versión nueva o compactada."""
+    firma = ",".join("-" if c is None else c for c in claves)
+    digest = hashlib.blake2b(f"{firma}|{cell_w}x{cell_h}|q{quality}|c{cols}".encode(), digest_size=16)
+    return f"s{digest.hexdigest()}"
+
+
+def layout(n: int, cols: int, cell_w: int, cell_h: int) -> tuple[int, int, list[tuple[int, int]]]:
+    """(ancho, alto, [(x, y)] por celda) del sprite de n celdas."""
+    cols = max(1, min(cols, n or 1))
+    rows = max(1, -(-n // cols))
+    return cols * cell_w, rows * cell_h, [((i % cols) * cell_w, (i // cols) * cell_h) for i in range(n)]
+
+
+async def _fuente(db: AsyncSession, meta) -> bytes | None:
+    """Miniatura estándar de la celda (disco, variante, o generada desde el original y guardada)."""
+    thumb_w, _, thumb_q = RENDITIONS["thumb"]
+    key = thumb_key(meta.id, meta.blob_hash)
+    ruta = await asyncio.to_thread(thumb_en_disco, key, thumb_w, thumb_q)
+    if ruta is not None:
+        try:
+            return await asyncio.to_thread(ruta.read_bytes)
+        except FileNotFoundError:
+            pass
+    if meta.blob_hash:
+        data = await rendition_bytes(db, await get_rendition(db, meta.blob_hash, "thumb"))
+        if data:
+            return data
+    raw = await version_bytes(db, meta.id)
+    if not raw:
+        return None
+    try:
+        res = await image_pool.run(generar_thumbs, raw, [(thumb_w, thumb_q)])
+    except ImagePoolSaturated:
+        raise
+    except Exception as e:
+        print(f"[sprite] WARNING version_id={meta.id} sin miniatura: {e!r}", flush=True)
+        return None
+    data = res["thumbs"][(thumb_w, thumb_q)]
+    await asyncio.to_thread(save_thumb, key, data, thumb_w, thumb_q)
+    return data
+
+
+async def asegurar(db: AsyncSession, key: str, metas: list, cell_w: int, cell_h: int, quality: int, cols: int) -> None:
+    """
+    Deja el sprite `key` en el cache en disco (lo compone si falta). metas: una por celda
+    (None = celda vacía). Peticiones simultáneas por la misma clave lo componen una vez.
+    Propaga ImagePoolSaturated.
+    """
+    if await asyncio.to_thread(thumb_en_disco, key, cell_w, quality) is not None:
+        return
+    ent = _locks.get(key)
+    if ent is None:
+        ent = _locks[key] = [asyncio.Lock(), 0]
+    ent[1] += 1
+    try:
+        async with ent[0]:
+            if await asyncio.to_thread(thumb_en_disco, key, cell_w, quality) is not None:
+                return
+            fuentes = [await _fuente(db, m) if m is not None else None for m in metas]
+            res = await image_pool.run(
+                componer_sprite, fuentes, max(1, min(cols, len(metas) or 1)), cell_w, cell_h, quality
+            )
+            await asyncio.to_thread(save_thumb, key, res["bytes"], cell_w, quality)
+            print(f"[sprite] {key}: {len(metas)} celdas, {len(res['bytes'])} bytes", flush=True)
+    finally:
+        ent[1] -= 1
+        if ent[1] == 0:
+            _locks.pop(key, None)
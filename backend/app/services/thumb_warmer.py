@@ -0,0 +1,171 @@
+# app/services/thumb_warmer.py
+"""
+Precalentado de miniaturas del board del día.
+
+Tras un deploy o una purga del cache, el primer operador que abre el board pagaba el
+encode WebP (method=6) de cada centro en get_ultima_thumb. Este worker deja en el cache
+en disco las variantes estándar (THUMB_WARM_WIDTHS x THUMB_WARM_QUALITY, ya ajustadas a
+los buckets de snap) de:
+
+- la última versión de cada captura de hoy, al arrancar (barrido);
+- cada versión recién ingestada (notificar(), después del commit).
+
+Trabaja de a THUMB_WARM_CONCURRENCY versiones y solo encola en el pool de imágenes cuando
+hay un worker ocioso, así que no compite con los uploads ni con los thumbs a demanda.
+"""
+import asyncio
+from datetime import date
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.capturas import Captura
+from app.services import image_pool
+from app.services.blobs import metas_de_capturas, metas_de_versiones, version_bytes
+from app.services.image_pool import ImagePoolSaturated
+from app.services.images import generar_thumbs
+from app.services.thumbs import save_thumb, snap, thumb_key, thumb_path
+
+# espera mientras el pool está ocupado con trabajo en vivo
+_ESPERA_POOL = 0.5
+
+_pendientes: set[int] = set()
+_barrido = False
+_evento: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+_stats = {"barridos": 0, "versiones": 0, "generadas": 0, "ya_en_cache": 0, "errores": 0}
+
+
+def variantes() -> list[tuple[int, int]]:
+    return sorted({snap(w, settings.thumb_warm_quality) for w in settings.thumb_warm_widths})
+
+
+def notificar(version_ids) -> None:
+    """Encola versiones recién ingestadas (no bloquea; sin efecto si el warmer no corre)."""
+    if _evento is None:
+        return
+    _pendientes.update(version_ids)
+    _evento.set()
+
+
+def barrer_hoy() -> None:
+    """Pide un barrido de las últimas versiones de las capturas de hoy."""
+    global _barrido
+    if _evento is None:
+        return
+    _barrido = True
+    _evento.set()
+
+
+async def _metas_de_hoy(db) -> list:
+    ids = (
+        await db.execute(
+            select(Captura.id)
+            .where(Captura.fecha_reporte == date.today(), Captura.ultima_version_id.is_not(None))
+            .order_by(Captura.id)
+        )
+    ).scalars().all()
+    return list((await metas_de_capturas(db, ids)).values()) if ids else []
+
+
+def _faltan(meta) -> list[tuple[int, int]]:
+    key = thumb_key(meta.id, meta.blob_hash)
+    return [(w, q) for w, q in variantes() if not thumb_path(key, w, q).exists()]
+
+
+async def _calentar(meta) -> None:
+    faltan = await asyncio.to_thread(_faltan, meta)
+    if not faltan:
+        _stats["ya_en_cache"] += 1
+        return
+    async with SessionLocal() as db:
+        raw = await version_bytes(db, meta.id)
+    if not raw:
+        return
+    while True:
+        while not image_pool.hay_worker_libre():
+            await asyncio.sleep(_ESPERA_POOL)
+        try:
+            res = await image_pool.run(generar_thumbs, raw, faltan)
+            break
+        except ImagePoolSaturated as e:
+            await asyncio.sleep(e.retry_after)
+
+    def _guardar():
+        key = thumb_key(meta.id, meta.blob_hash)
+        for (w, q), data in res["thumbs"].items():
+            save_thumb(key, data, w, q)
+
+    await asyncio.to_thread(_guardar)
+    _stats["generadas"] += len(res["thumbs"])
+
+
+async def _procesar(metas: list) -> None:
+    sem = asyncio.Semaphore(max(1, settings.thumb_warm_concurrency))
+
+    async def uno(meta):
+        async with sem:
+            try:
+                await _calentar(meta)
+            except Exception as e:
+                _stats["errores"] += 1
+                print(f"[thumb-warm] WARNING version_id={meta.id}: {e!r}", flush=True)
+            _stats["versiones"] += 1
+
+    await asyncio.gather(*(uno(m) for m in metas if m.tiene_imagen))
+
+
+async def _loop():
+    global _barrido
+    while True:
+        await _evento.wait()
+        _evento.clear()
+        try:
+            if _barrido:
+                async with SessionLocal() as db:
+                    metas = await _metas_de_hoy(db)
+                _barrido = False
+                _stats["barridos"] += 1
+                print(f"[thumb-warm] barrido de hoy: {len(metas)} versiones", flush=True)
+                await _procesar(metas)
+            if _pendientes:
+                ids = sorted(_pendientes)
+                async with SessionLocal() as db:
+                    metas = list((await metas_de_versiones(db, ids)).values())
+                _pendientes.difference_update(ids)
+                await _procesar(metas)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # lo pendiente (barrido o ids) se conserva y se reintenta
+            print(f"[thumb-warm] ERROR: {e!r}", flush=True)
+            await asyncio.sleep(30)
+            _evento.set()
+
+
+async def start():
+    global _evento, _task
+    if _task is not None or not settings.thumb_warm_enabled:
+        return
+    _evento = asyncio.Event()
+    _task = asyncio.create_task(_loop())
+    barrer_hoy()
+    print(f"[thumb-warm] iniciado (variantes={variantes()}, concurrencia={settings.thumb_warm_concurrency})", flush=True)
+
+
+async def stop():
+    global _task, _evento
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = _evento = None
+    print("[thumb-warm] detenido", flush=True)
+
+
+def stats() -> dict:
+    return {**_stats, "activo": _task is not None, "pendientes": len(_pendientes), "variantes": variantes()}
@@ -0,0 +1,222 @@
+# app/services/thumbs.py
+"""
+Cache en disco de miniaturas: static/thumbs/thumb_{clave}_w{max_w}_q{quality}.webp
+clave = "h<hash>" si la versión tiene blob direccionado por contenido, "v<id>" (legado) si no.
+
+El cache tiene un presupuesto de bytes (THUMB_CACHE_MAX_BYTES). Al pasarse, se
+desalojan los archivos menos usados (LRU por último acceso) hasta bajar al 90%.
+El orden se lleva en memoria y arranca del atime/mtime de los archivos, así que
+sobrevive a reinicios. Los tamaños pedidos se redondean a unos pocos buckets
+(snap) para que una captura no genere cientos de variantes.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.capturas import CapturaVersion, ImagenBlob
+
+THUMB_DIR = Path(__file__).resolve().parent.parent / "static" / "thumbs"
+THUMB_DIR.mkdir(parents=True, exist_ok=True)
+
+# al desalojar se baja hasta este porcentaje del presupuesto (evita desalojar en cada escritura)
+_LOW_WATERMARK = 0.9
+
+_lock = threading.Lock()
+_index: "OrderedDict[str, int] | None" = None  # nombre de archivo -> bytes, del menos al más reciente
+_bytes = 0
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "evicted_bytes": 0, "purged": 0}
+
+
+def thumb_key(version_id: int, blob_hash: str | None) -> str:
+    return f"h{blob_hash}" if blob_hash else f"v{version_id}"
+
+
+def thumb_path(key: str, max_w: int, quality: int) -> Path:
+    return THUMB_DIR / f"thumb_{key}_w{max_w}_q{quality}.webp"
+
+
+def snap(max_w: int, quality: int) -> tuple[int, int]:
+    """Bucket de ancho (el menor >= max_w) y de calidad (el más cercano) configurados."""
+    widths = settings.thumb_widths
+    w = next((b for b in widths if b >= max_w), widths[-1])
+    q = min(settings.thumb_qualities, key=lambda b: (abs(b - quality), -b))
+    return w, q
+
+
+def _cargar_indice() -> "OrderedDict[str, int]":
+    """Primer uso: recorre THUMB_DIR y ordena por último acceso conocido."""
+    global _index, _bytes
+    if _index is not None:
+        return _index
+    entradas = []
+    with os.scandir(THUMB_DIR) as it:
+        for e in it:
+            if not (e.name.startswith("thumb_") and e.name.endswith(".webp")):
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            entradas.append((max(st.st_atime, st.st_mtime), e.name, st.st_size))
+    entradas.sort()
+    _index = OrderedDict((name, size) for _, name, size in entradas)
+    _bytes = sum(_index.values())
+    print(f"[thumb] cache: {len(_index)} archivos, {_bytes / 1e6:.1f} MB", flush=True)
+    return _index
+
+
+def _desalojar():
+    """Con _lock tomado: borra los menos usados hasta quedar bajo el watermark."""
+    global _bytes
+    budget = settings.thumb_cache_max_bytes
+    if budget <= 0 or _bytes <= budget:
+        return
+    objetivo = int(budget * _LOW_WATERMARK)
+    while _index and _bytes > objetivo:
+        name, size = _index.popitem(last=False)
+        _bytes -= size
+        try:
+            (THUMB_DIR / name).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[thumb] WARNING no se pudo desalojar {name}: {e!r}", flush=True)
+        _stats["evictions"] += 1
+        _stats["evicted_bytes"] += size
+
+
+def thumb_en_disco(key: str, max_w: int, quality: int) -> Path | None:
+    """
+    Ruta del thumb cacheado (y marca el acceso para el LRU), o None. Bloquea en disco:
+    llamar con asyncio.to_thread. Los bytes no se leen: se sirve con archivos.responder_archivo.
+    """
+    global _bytes
+    p = thumb_path(key, max_w, quality)
+    try:
+        st = p.stat()
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+            idx = _cargar_indice()
+            size = idx.pop(p.name, None)
+            if size is not None:
+                # borrado por fuera (otro proceso o a mano)
+                _bytes -= size
+        return None
+    with _lock:
+        _stats["hits"] += 1
+        idx = _cargar_indice()
+        if p.name in idx:
+            idx.move_to_end(p.name)
+        else:
+            _registrar(p.name, st.st_size)
+    try:
+        # atime explícito: el LRU sobrevive a reinicios aunque el FS monte con noatime
+        os.utime(p, (time.time(), st.st_mtime))
+    except OSError:
+        pass
+    return p
+
+
+def _registrar(name: str, size: int):
+    global _bytes
+    idx = _cargar_indice()
+    prev = idx.pop(name, None)
+    if prev is not None:
+        _bytes -= prev
+    idx[name] = size
+    _bytes += size
+
+
+def save_thumb(key: str, data: bytes, max_w: int = 360, quality: int = 70) -> Path | None:
+    """
+    Guarda en disco una miniatura ya generada para reutilizarla (y desaloja si se pasa
+    del presupuesto). Bloquea en disco: desde una petición, llamar con asyncio.to_thread.
+    """
+    cache_path = thumb_path(key, max_w, quality)
+    tmp = cache_path.with_name(f".{cache_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, cache_path)
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        print(f"[thumb-pre] WARNING {key} no se pudo escribir thumb: {e!r}", flush=True)
+        return None
+    with _lock:
+        _stats["writes"] += 1
+        _registrar(cache_path.name, len(data))
+        _desalojar()
+    return cache_path
+
+
+def purge_thumbs(keys) -> int:
+    """Borra todas las variantes en disco de las claves dadas; devuelve cuántos archivos se eliminaron."""
+    global _bytes
+    claves = set(keys)
+    if not claves:
+        return 0
+    with _lock:
+        idx = _cargar_indice()
+        nombres = [name for name in idx if _clave_de(name) in claves]
+        for name in nombres:
+            _bytes -= idx.pop(name)
+    n = 0
+    for name in nombres:
+        try:
+            (THUMB_DIR / name).unlink()
+            n += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[thumb] WARNING no se pudo borrar {name}: {e!r}", flush=True)
+    with _lock:
+        _stats["purged"] += n
+    return n
+
+
+def _clave_de(name: str) -> str:
+    # thumb_{clave}_w{w}_q{q}.webp -> clave
+    return name[len("thumb_"):].rsplit("_w", 1)[0]
+
+
+async def limpiar_huerfanos(db: AsyncSession, lote: int = 500) -> int:
+    """
+    Borra los thumbs cuya versión (v<id>) o blob (h<hash>) ya no existe: cubre borrados
+    que no pasaron por purge_freed (cascadas, borrados a mano). Lo corre el scheduler.
+    """
+    with _lock:
+        claves = {_clave_de(n) for n in _cargar_indice()}
+    hashes = sorted(c[1:] for c in claves if c.startswith("h"))
+    ids = sorted(int(c[1:]) for c in claves if c.startswith("v") and c[1:].isdigit())
+
+    huerfanas = []
+    for i in range(0, len(hashes), lote):
+        parte = hashes[i:i + lote]
+        vivos = set((await db.execute(select(ImagenBlob.hash).where(ImagenBlob.hash.in_(parte)))).scalars())
+        huerfanas += [f"h{h}" for h in parte if h not in vivos]
+    for i in range(0, len(ids), lote):
+        parte = ids[i:i + lote]
+        vivos = set((await db.execute(select(CapturaVersion.id).where(CapturaVersion.id.in_(parte)))).scalars())
+        huerfanas += [f"v{v}" for v in parte if v not in vivos]
+    return purge_thumbs(huerfanas)
+
+
+def stats() -> dict:
+    with _lock:
+        idx = _cargar_indice()
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "archivos": len(idx),
+            "bytes": _bytes,
+            "max_bytes": settings.thumb_cache_max_bytes,
+            "hit_rate": round(_stats["hits"] / total, 4) if total else None,
+            "buckets": {"max_w": settings.thumb_widths, "quality": settings.thumb_qualities},
+        }
@@ -0,0 +1,134 @@
+# app/services/ultima.py
+"""
+Puntero desnormalizado a la última versión de cada captura:
+capturas.ultima_version_id / ultima_tomada_en / version_count.
+
+Se mantiene en la misma transacción que inserta o borra versiones, así que sigue al
+commit o al rollback del cambio. Con (ultima_version_id, ultima_tomada_en) la versión
+se alcanza por PK de captura_versiones y Postgres puede descartar particiones, sin el
+ORDER BY tomada_en DESC LIMIT 1 ni el row_number() sobre todas las versiones.
+
+Alta: O(1) por captura (UPDATE condicional). Baja: se recalcula desde las versiones
+que quedan de esa captura (pocas). rellenar() lo rehace todo (backfill / derivas).
+"""
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, Integer, and_, bindparam, case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.capturas import Captura, CapturaVersion
+
+# Core (no ORM): el UPDATE de alta va como executemany con los parámetros por captura
+_cap = Captura.__table__
+
+
+def _alta_stmt():
+    t = bindparam("u_tomada", type_=TIMESTAMP)
+    vid = bindparam("u_version", type_=Integer)
+    es_ultima = or_(
+        _cap.c.ultima_tomada_en.is_(None),
+        t > _cap.c.ultima_tomada_en,
+        and_(t == _cap.c.ultima_tomada_en, vid > _cap.c.ultima_version_id),
+    )
+    return (
+        update(_cap)
+        .where(_cap.c.id == bindparam("u_captura", type_=Integer))
+        .values(
+            version_count=_cap.c.version_count + bindparam("u_n", type_=Integer),
+            ultima_version_id=case((es_ultima, vid), else_=_cap.c.ultima_version_id),
+            ultima_tomada_en=case((es_ultima, t), else_=_cap.c.ultima_tomada_en),
+        )
+    )
+
+
+_ALTA = _alta_stmt()
+
+
+async def registrar(db: AsyncSession, versiones) -> None:
+    """versiones: iterable de (captura_id, version_id, tomada_en) recién insertadas. No hace commit."""
+    acc: dict[int, list] = {}
+    for captura_id, version_id, tomada_en in versiones:
+        a = acc.get(captura_id)
+        if a is None:
+            acc[captura_id] = [1, (tomada_en, version_id)]
+            continue
+        a[0] += 1
+        a[1] = max(a[1], (tomada_en, version_id))
+    params = [
+        {"u_captura": cid, "u_n": n, "u_tomada": t, "u_version": vid}
+        for cid, (n, (t, vid)) in acc.items()
+    ]
+    if params:
+        await db.execute(_ALTA, params)
+
+
+def _refrescar_stmt(*where):
+    ultima = (
+        select(CapturaVersion.id, CapturaVersion.tomada_en)
+        .where(CapturaVersion.captura_id == _cap.c.id)
+        .order_by(CapturaVersion.tomada_en.desc(), CapturaVersion.id.desc())
+        .limit(1)
+    )
+    return (
+        update(_cap)
+        .where(*where)
+        .values(
+            ultima_version_id=ultima.with_only_columns(CapturaVersion.id).scalar_subquery(),
+            ultima_tomada_en=ultima.with_only_columns(CapturaVersion.tomada_en).scalar_subquery(),
+            version_count=(
+                select(func.count())
+                .where(CapturaVersion.captura_id == _cap.c.id)
+                .scalar_subquery()
+            ),
+        )
+    )
+
+
+async def refrescar(db: AsyncSession, captura_ids) -> None:
+    """Recalcula el puntero de las capturas dadas (llamar DESPUÉS de borrar versiones). No hace commit."""
+    ids = sorted(set(captura_ids))
+    if ids:
+        await db.execute(_refrescar_stmt(_cap.c.id.in_(ids)))
+
+
+async def rellenar(db: AsyncSession, lote: int = 5000, desde: datetime | None = None) -> int:
+    """
+    Backfill por lotes de id (commit por lote): rehace el puntero de todas las capturas,
+    o de las creadas desde `desde`. Devuelve cuántas capturas se tocaron.
+    """
+    total, ultimo = 0, 0
+    while True:
+        q = select(Captura.id).where(Captura.id > ultimo).order_by(Captura.id).limit(lote)
+        if desde is not None:
+            q = q.where(Captura.created_at >= desde)
+        ids = (await db.execute(q)).scalars().all()
+        if not ids:
+            break
+        ultimo = ids[-1]
+        await db.execute(_refrescar_stmt(_cap.c.id.in_(ids)))
+        await db.commit()
+        total += len(ids)
+        print(f"[ultima] {total} capturas (id {ultimo})", flush=True)
+    return total
+
+
+async def version(db: AsyncSession, captura_id: int) -> tuple[int, str | None] | None:
+    """
+    (id, blob_hash) de la última versión, o None: el puntero de capturas más la fila de
+    la versión por su PK (id, tomada_en), sin tocar bytes. Alcanza para la ETag y para
+    el cache en memoria (el hash cambia si la compactación re-codifica la versión).
+    """
+    row = (
+        await db.execute(
+            select(Captura.ultima_version_id, CapturaVersion.blob_hash)
+            .join(
+                CapturaVersion,
+                and_(
+                    CapturaVersion.id == Captura.ultima_version_id,
+                    CapturaVersion.tomada_en == Captura.ultima_tomada_en,
+                ),
+            )
+            .where(Captura.id == captura_id)
+        )
+    ).first()
+    return (row.ultima_version_id, row.blob_hash) if row else None
@@ -0,0 +1,178 @@
+# app/services/upload_sessions.py
+"""
+Uploads reanudables por trozos (enlaces satelitales / 4G que se cortan a mitad).
+
+    POST   /api/capturas/upload/sesiones                 crea la sesión (tamaño total + destino)
+    PUT    /api/capturas/upload/sesiones/{id}?offset=N   agrega un trozo empezando en N
+    GET    /api/capturas/upload/sesiones/{id}            offset recibido hasta ahora
+    POST   /api/capturas/upload/sesiones/{id}/finalizar  procesa el archivo completo como /upload
+
+Cada sesión vive en disco: sessions/{id}.part (bytes recibidos) + sessions/{id}.json
+(metadata). El offset es el tamaño del .part, así que sobrevive a reinicios.
+Las sesiones sin actividad por más de upload_session_ttl se eliminan desde el scheduler.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+SESSION_DIR = Path(settings.spool_dir) / "sessions"
+SESSION_DIR.mkdir(parents=True, exist_ok=True)
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_locks: dict[str, asyncio.Lock] = {}
+
+
+def _part(sid: str) -> Path:
+    return SESSION_DIR / f"{sid}.part"
+
+
+def _meta_path(sid: str) -> Path:
+    return SESSION_DIR / f"{sid}.json"
+
+
+def _write_meta(sid: str, meta: dict):
+    tmp = SESSION_DIR / f"{sid}.json.tmp"
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, _meta_path(sid))
+
+
+def lock(sid: str) -> asyncio.Lock:
+    """Serializa trozos y finalizar de una misma sesión."""
+    return _locks.setdefault(sid, asyncio.Lock())
+
+
+def _load(sid: str) -> dict:
+    if not _ID_RE.match(sid or ""):
+        raise HTTPException(status_code=404, detail="sesión de upload no encontrada")
+    try:
+        meta = json.loads(_meta_path(sid).read_text())
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail="sesión de upload no encontrada o expirada")
+    if meta.get("resultado"):
+        # finalizada: los bytes ya se liberaron, se informa completa
+        meta["offset"] = meta["size"]
+        return meta
+    try:
+        meta["offset"] = _part(sid).stat().st_size
+    except FileNotFoundError:
+        meta["offset"] = 0
+    return meta
+
+
+def _public(sid: str, meta: dict) -> dict:
+    return {
+        "session_id": sid,
+        "offset": meta["offset"],
+        "size": meta["size"],
+        "chunk_max": settings.upload_chunk_max,
+        "resultado": meta.get("resultado"),
+    }
+
+
+def crear(size: int, destino: dict) -> dict:
+    """Registra una sesión nueva para un archivo de `size` bytes."""
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="size debe ser > 0")
+    if size > settings.upload_max_bytes:
+        raise HTTPException(status_code=413, detail=f"archivo supera el máximo de {settings.upload_max_bytes} bytes")
+    sid = uuid.uuid4().hex
+    meta = {**destino, "size": size, "creado": datetime.now(timezone.utc).isoformat()}
+    _part(sid).touch()
+    _write_meta(sid, meta)
+    meta["offset"] = 0
+    return _public(sid, meta)
+
+
+def consultar(sid: str) -> dict:
+    return _public(sid, _load(sid))
+
+
+def _append(sid: str, chunk: bytes):
+    with open(_part(sid), "ab") as fh:
+        fh.write(chunk)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+async def agregar_trozo(sid: str, offset: int, chunk: bytes) -> dict:
+    """
+    Agrega `chunk` en `offset`. Si el offset no coincide con lo recibido responde 409
+    con el offset correcto (el cliente retoma desde ahí). Un trozo repetido que ya
+    estaba completo se acepta sin escribir nada.
+    """
+    async with lock(sid):
+        meta = _load(sid)
+        actual = meta["offset"]
+        if meta.get("resultado"):
+            return _public(sid, meta)
+        if offset + len(chunk) <= actual:
+            # reintento de un trozo que ya llegó (se perdió la respuesta)
+            return _public(sid, meta)
+        if offset != actual:
+            raise HTTPException(
+                status_code=409,
+                detail=f"offset esperado {actual}",
+                headers={"Upload-Offset": str(actual)},
+            )
+        if actual + len(chunk) > meta["size"]:
+            raise HTTPException(status_code=413, detail="el trozo excede el tamaño declarado")
+        await asyncio.to_thread(_append, sid, chunk)
+        meta["offset"] = actual + len(chunk)
+        return _public(sid, meta)
+
+
+async def leer_completo(sid: str) -> tuple[dict, bytes]:
+    """Devuelve (metadata, bytes) de una sesión completa; 409 si aún faltan bytes."""
+    meta = _load(sid)
+    if meta["offset"] != meta["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail=f"upload incompleto: {meta['offset']}/{meta['size']} bytes",
+            headers={"Upload-Offset": str(meta["offset"])},
+        )
+    raw = await asyncio.to_thread(_part(sid).read_bytes)
+    return meta, raw
+
+
+def marcar_finalizada(sid: str, meta: dict, resultado: dict):
+    """
+    Guarda el resultado y libera los bytes: un finalizar repetido (se cortó la
+    respuesta) devuelve el mismo resultado sin crear otra versión.
+    """
+    meta = {k: v for k, v in meta.items() if k != "offset"}
+    meta["resultado"] = resultado
+    _write_meta(sid, meta)
+    _part(sid).unlink(missing_ok=True)
+
+
+def limpiar_expiradas(max_age_sec: int | None = None) -> int:
+    """Elimina sesiones sin actividad (mtime del .part/.json) más viejas que max_age_sec."""
+    max_age_sec = max_age_sec or settings.upload_session_ttl
+    limit = time.time() - max_age_sec
+    n = 0
+    for meta in SESSION_DIR.glob("*.json"):
+        sid = meta.stem
+        try:
+            part = _part(sid)
+            last = max(meta.stat().st_mtime, part.stat().st_mtime if part.exists() else 0)
+            if last >= limit:
+                continue
+            part.unlink(missing_ok=True)
+            meta.unlink(missing_ok=True)
+            _locks.pop(sid, None)
+            n += 1
+        except FileNotFoundError:
+            pass
+    for tmp in SESSION_DIR.glob("*.tmp"):
+        if tmp.stat().st_mtime < limit:
+            tmp.unlink(missing_ok=True)
+    return n
@@ -0,0 +1,63 @@
+# app/services/uploads.py
+from fastapi import HTTPException, Request, UploadFile
+
+from app.core.config import settings
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"archivo supera el máximo de {max_bytes} bytes")
+
+
+async def read_upload_capped(file: UploadFile, max_bytes: int | None = None) -> bytes:
+    """
+    Lee el UploadFile con un tope (413 si se pasa de max_bytes). Si el tamaño no se
+    conoce de antemano se lee por bloques y se corta apenas se excede.
+
+    Ojo: con multipart, cuando esto corre Starlette ya recibió y volcó a disco el cuerpo
+    entero, así que el tope evita la copia en memoria y el trabajo de Pillow pero no la
+    recepción. El límite duro de red lo pone el proxy (client_max_body_size en Nginx,
+    ver README_DEPLOY.md); /upload/raw (read_body_capped) sí corta sobre el stream.
+    """
+    limit = max_bytes or settings.upload_max_bytes
+    if file.size is not None:
+        # el parser multipart ya conoce el tamaño: validar y leer en una sola asignación
+        if file.size > limit:
+            raise _too_large(limit)
+        return await file.read()
+
+    buf = bytearray()
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(buf) + len(chunk) > limit:
+            raise _too_large(limit)
+        buf += chunk
+    return bytes(buf)
+
+
+async def read_body_capped(request: Request, max_bytes: int | None = None) -> bytes:
+    """
+    Lee el cuerpo crudo (application/octet-stream, image/jpeg...) sin multipart ni
+    SpooledTemporaryFile: los trozos que entrega el servidor ASGI se juntan una sola
+    vez al final. 413 apenas se excede el tope (o antes, si Content-Length ya lo excede).
+    """
+    limit = max_bytes or settings.upload_max_bytes
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise _too_large(limit)
+
+    chunks: list[bytes] = []
+    total = 0
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        total += len(chunk)
+        if total > limit:
+            raise _too_large(limit)
+        chunks.append(chunk)
+    if len(chunks) == 1:
+        return chunks[0]
+    return b"".join(chunks)
@@ -0,0 +1,183 @@
+# app/services/uso.py
+"""
+Contabilidad incremental de almacenamiento (tabla uso_almacenamiento).
+
+Cada alta, baja o cambio de peso de una versión ajusta la fila de su
+(cliente, centro, fecha_reporte) dentro de la misma transacción, así que el rollup
+sigue al commit o al rollback del cambio. Los delta se dan por captura_id: el
+INSERT ... SELECT toma cliente/centro/fecha de la propia captura.
+
+Consultar el rollup evita el full scan de captura_versiones JOIN capturas;
+recalcular() lo rehace desde cero si alguna vez se desvía (borrados a mano).
+"""
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import BigInteger, Integer, bindparam, delete, desc, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.capturas import Captura, CapturaVersion
+from app.models.centros import Centro
+from app.models.clientes import Cliente
+from app.models.uso import UsoAlmacenamiento as Uso
+
+
+def _upsert_stmt():
+    sel = select(
+        Captura.cliente_id,
+        Captura.centro_id,
+        Captura.fecha_reporte,
+        bindparam("u_versiones", type_=Integer),
+        bindparam("u_bytes", type_=BigInteger),
+    ).where(Captura.id == bindparam("u_captura"))
+    stmt = pg_insert(Uso).from_select(["cliente_id", "centro_id", "fecha", "versiones", "bytes"], sel)
+    return stmt.on_conflict_do_update(
+        index_elements=[Uso.cliente_id, Uso.centro_id, Uso.fecha],
+        set_={
+            "versiones": Uso.versiones + stmt.excluded.versiones,
+            "bytes": Uso.bytes + stmt.excluded.bytes,
+            "updated_at": func.now(),
+        },
+    )
+
+
+_UPSERT = _upsert_stmt()
+
+
+async def ajustar(db: AsyncSession, deltas) -> None:
+    """deltas: iterable de (captura_id, versiones, bytes), con signo. Se agrupan por captura. No hace commit."""
+    acc: dict[int, list[int]] = defaultdict(lambda: [0, 0])
+    for captura_id, n, b in deltas:
+        acc[captura_id][0] += n
+        acc[captura_id][1] += b or 0
+    params = [
+        {"u_captura": cid, "u_versiones": n, "u_bytes": b}
+        for cid, (n, b) in acc.items()
+        if n or b
+    ]
+    if params:
+        await db.execute(_UPSERT, params)
+
+
+async def _versiones_por_captura(db: AsyncSession, *where) -> list[tuple[int, int, int]]:
+    return (
+        await db.execute(
+            select(
+                CapturaVersion.captura_id,
+                func.count(),
+                func.coalesce(func.sum(CapturaVersion.peso_bytes), 0),
+            )
+            .where(*where)
+            .group_by(CapturaVersion.captura_id)
+        )
+    ).all()
+
+
+async def restar_versiones(db: AsyncSession, *where) -> None:
+    """Descuenta las versiones que cumplen `where` (llamar ANTES de borrarlas)."""
+    rows = await _versiones_por_captura(db, *where)
+    await ajustar(db, ((cid, -n, -b) for cid, n, b in rows))
+
+
+async def sumar_versiones(db: AsyncSession, *where) -> None:
+    """Vuelve a contar versiones ya existentes (p.ej. tras mover la captura de fecha)."""
+    rows = await _versiones_por_captura(db, *where)
+    await ajustar(db, rows)
+
+
+async def olvidar(db: AsyncSession, *, cliente_id: int | None = None, centro_id: int | None = None) -> None:
+    """Elimina el rollup de un centro o cliente que se está borrando. No hace commit."""
+    stmt = delete(Uso)
+    if cliente_id is not None:
+        stmt = stmt.where(Uso.cliente_id == cliente_id)
+    elif centro_id is not None:
+        stmt = stmt.where(Uso.centro_id == centro_id)
+    else:
+        raise ValueError("olvidar requiere cliente_id o centro_id")
+    await db.execute(stmt)
+
+
+async def recalcular(db: AsyncSession, desde: date | None = None) -> int:
+    """Rehace el rollup (todo o desde una fecha) con un full scan. Hace commit."""
+    await db.execute(text("LOCK TABLE uso_almacenamiento IN EXCLUSIVE MODE"))
+    borrar = delete(Uso)
+    where = []
+    if desde is not None:
+        borrar = borrar.where(Uso.fecha >= desde)
+        where.append(Captura.fecha_reporte >= desde)
+    await db.execute(borrar)
+    sel = (
+        select(
+            Captura.cliente_id,
+            Captura.centro_id,
+            Captura.fecha_reporte,
+            func.count(),
+            func.coalesce(func.sum(CapturaVersion.peso_bytes), 0),
+        )
+        .join(Captura, Captura.id == CapturaVersion.captura_id)
+        .where(*where)
+        .group_by(Captura.cliente_id, Captura.centro_id, Captura.fecha_reporte)
+    )
+    res = await db.execute(
+        pg_insert(Uso).from_select(["cliente_id", "centro_id", "fecha", "versiones", "bytes"], sel)
+    )
+    await db.commit()
+    return res.rowcount or 0
+
+
+# ————— consultas —————
+_AGRUPAR = {
+    "cliente": lambda: ([Uso.cliente_id, Cliente.nombre.label("cliente_nombre")], [Uso.cliente_id, Cliente.nombre]),
+    "centro": lambda: (
+        [Uso.cliente_id, Uso.centro_id, Centro.nombre.label("centro_nombre")],
+        [Uso.cliente_id, Uso.centro_id, Centro.nombre],
+    ),
+    "dia": lambda: ([Uso.fecha], [Uso.fecha]),
+}
+
+
+async def consultar(
+    db: AsyncSession,
+    *,
+    agrupar: str = "cliente",
+    desde: date | None = None,
+    hasta: date | None = None,
+    cliente_id: int | None = None,
+    centro_id: int | None = None,
+    limite: int = 100,
+) -> dict:
+    """Versiones y bytes agrupados por cliente, centro o día (mayor consumo primero; por día, cronológico)."""
+    cols, group = _AGRUPAR[agrupar]()
+    versiones = func.sum(Uso.versiones).label("versiones")
+    total_bytes = func.sum(Uso.bytes).label("bytes")
+    where = []
+    if desde is not None:
+        where.append(Uso.fecha >= desde)
+    if hasta is not None:
+        where.append(Uso.fecha <= hasta)
+    if cliente_id is not None:
+        where.append(Uso.cliente_id == cliente_id)
+    if centro_id is not None:
+        where.append(Uso.centro_id == centro_id)
+
+    stmt = select(*cols, versiones, total_bytes).where(*where).group_by(*group)
+    if agrupar == "cliente":
+        stmt = stmt.outerjoin(Cliente, Cliente.id == Uso.cliente_id)
+    elif agrupar == "centro":
+        stmt = stmt.outerjoin(Centro, Centro.id == Uso.centro_id)
+    stmt = stmt.order_by(Uso.fecha if agrupar == "dia" else desc(total_bytes)).limit(limite)
+    items = [
+        {**r._asdict(), "versiones": int(r.versiones or 0), "bytes": int(r.bytes or 0)}
+        for r in (await db.execute(stmt)).all()
+    ]
+
+    tot = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(Uso.versiones), 0),
+                func.coalesce(func.sum(Uso.bytes), 0),
+            ).where(*where)
+        )
+    ).one()
+    return {"agrupar": agrupar, "items": items, "total_versiones": int(tot[0]), "total_bytes": int(tot[1])}
@@ -0,0 +1,96 @@
+# bench_304.py
+"""
+Latencia de las peticiones condicionales (If-None-Match -> 304) de la última imagen /
+miniatura, por captura, contra un backend levantado. El 304 solo lee el puntero de la
+captura y la fila de la versión por PK (sin bytes), así que su latencia no debería
+depender del peso de la imagen.
+
+    python bench_304.py --cliente-id 1 [--fecha 2025-10-15] [-n 200] [--ruta image|thumb]
+    python bench_304.py --capturas 10 11 12 --base http://localhost:8000
+
+Por cada captura: un GET normal (tamaño y ETag) y luego N GET condicionales sobre
+la misma conexión keep-alive. Imprime p50/p95 del 304 junto al tamaño de la imagen.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import requests
+
+
+def capturas_del_board(s: requests.Session, base: str, cliente_id: int, fecha: str | None) -> list[int]:
+    params = {"cliente_id": cliente_id, "page_size": 100}
+    if fecha:
+        params["fecha"] = fecha
+    r = s.get(f"{base}/api/capturas", params=params, timeout=30)
+    r.raise_for_status()
+    return [it["id"] for it in r.json()["items"] if it["id"] and it["ultima_version_id"]]
+
+
+def medir(s: requests.Session, url: str, n: int) -> tuple[int, list[float]] | None:
+    r = s.get(url, timeout=30)
+    if r.status_code != 200 or not r.headers.get("ETag"):
+        print(f"  {url}: HTTP {r.status_code} sin ETag, se omite", file=sys.stderr)
+        return None
+    size, etag = len(r.content), r.headers["ETag"]
+    tiempos = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        r = s.get(url, headers={"If-None-Match": etag}, timeout=30)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+        if r.status_code != 304:
+            print(f"  {url}: esperaba 304, llegó {r.status_code}", file=sys.stderr)
+            return None
+    return size, tiempos
+
+
+def pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p * (len(xs) - 1))))]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Latencia del 304 de /ultima/image y /ultima/thumb vs tamaño de imagen.")
+    ap.add_argument("--base", default="http://localhost:8000")
+    ap.add_argument("--cliente-id", type=int, help="toma las capturas del board de este cliente")
+    ap.add_argument("--fecha", default=None, help="YYYY-MM-DD del board (por defecto hoy)")
+    ap.add_argument("--capturas", type=int, nargs="*", default=None, help="ids de captura explícitos")
+    ap.add_argument("--ruta", choices=("image", "thumb"), default="image")
+    ap.add_argument("-n", type=int, default=200, help="peticiones condicionales por captura")
+    args = ap.parse_args(argv)
+
+    s = requests.Session()
+    ids = args.capturas or []
+    if not ids:
+        if not args.cliente_id:
+            ap.error("indicar --capturas o --cliente-id")
+        ids = capturas_del_board(s, args.base.rstrip("/"), args.cliente_id, args.fecha)
+    if not ids:
+        print("sin capturas con imagen", file=sys.stderr)
+        return 1
+
+    filas = []
+    for cid in ids:
+        url = f"{args.base.rstrip('/')}/api/capturas/{cid}/ultima/{args.ruta}"
+        res = medir(s, url, args.n)
+        if res:
+            size, t = res
+            filas.append((size, cid, statistics.median(t), pct(t, 0.95)))
+
+    filas.sort()
+    print(f"{'captura':>8} {'bytes':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for size, cid, p50, p95 in filas:
+        print(f"{cid:>8} {size:>10} {p50:>8.2f} {p95:>8.2f}")
+    if len(filas) >= 2:
+        sizes = [f[0] for f in filas]
+        p50s = [f[2] for f in filas]
+        print(f"\nbytes {min(sizes)}..{max(sizes)} ({max(sizes) / max(1, min(sizes)):.0f}x) -> "
+              f"p50 {min(p50s):.2f}..{max(p50s):.2f} ms")
+        if len(filas) >= 3 and len(set(sizes)) > 1 and len(set(p50s)) > 1:
+            print(f"correlación bytes/p50: {statistics.correlation(sizes, p50s):+.2f} (≈0: no depende del tamaño)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
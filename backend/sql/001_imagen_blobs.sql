@@ -0,0 +1,21 @@
+-- 001: blobs de imagen deduplicados por contenido (BLAKE2b-256)
+-- Idempotente: se puede re-ejecutar sin efectos.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS imagen_blobs (
+    hash          VARCHAR(64) PRIMARY KEY,
+    data          BYTEA,
+    content_type  VARCHAR(50),
+    ancho         INTEGER,
+    alto          INTEGER,
+    peso_bytes    INTEGER,
+    ref_count     INTEGER NOT NULL DEFAULT 0,
+    created_at    TIMESTAMP DEFAULT now()
+);
+
+ALTER TABLE captura_versiones
+    ADD COLUMN IF NOT EXISTS blob_hash VARCHAR(64) REFERENCES imagen_blobs(hash);
+
+CREATE INDEX IF NOT EXISTS ix_capver_blob_hash ON captura_versiones (blob_hash);
+
+COMMIT;
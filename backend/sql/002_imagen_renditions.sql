@@ -0,0 +1,15 @@
+-- 002: variantes derivadas (thumb, pdf, placeholder) generadas en el ingest
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS imagen_renditions (
+    blob_hash     VARCHAR(64) NOT NULL REFERENCES imagen_blobs(hash) ON DELETE CASCADE,
+    variante      VARCHAR(20) NOT NULL,
+    content_type  VARCHAR(50),
+    ancho         INTEGER,
+    alto          INTEGER,
+    peso_bytes    INTEGER,
+    data          BYTEA,
+    PRIMARY KEY (blob_hash, variante)
+);
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- 003: claves de idempotencia de /upload y /{captura_id}/version (purgadas por el scheduler)
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope       VARCHAR(40)  NOT NULL,
+    key         VARCHAR(128) NOT NULL,
+    captura_id  INTEGER      NOT NULL,
+    version_id  INTEGER      NOT NULL,
+    created_at  TIMESTAMP    NOT NULL DEFAULT now(),
+    PRIMARY KEY (scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys (created_at);
+
+COMMIT;
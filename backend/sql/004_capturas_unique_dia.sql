@@ -0,0 +1,36 @@
+-- 004: una sola captura por (centro, dispositivo, fecha_reporte); NULL en dispositivo_id
+-- cuenta como un valor más (COALESCE) para que el upsert del ingest sea atómico.
+--
+-- Antes de crear el índice se fusionan los duplicados que hayan dejado las carreras:
+-- se conserva la captura más antigua (menor id) y se le mueven versiones y órdenes.
+BEGIN;
+
+LOCK TABLE capturas IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TEMP TABLE capturas_dup ON COMMIT DROP AS
+SELECT id, keep_id
+FROM (
+    SELECT id,
+           min(id) OVER (PARTITION BY centro_id, COALESCE(dispositivo_id, 0), fecha_reporte) AS keep_id
+    FROM capturas
+) t
+WHERE id <> keep_id;
+
+UPDATE captura_versiones v
+   SET captura_id = d.keep_id
+  FROM capturas_dup d
+ WHERE v.captura_id = d.id;
+
+UPDATE ordenes_captura o
+   SET captura_id = d.keep_id
+  FROM capturas_dup d
+ WHERE o.captura_id = d.id;
+
+DELETE FROM capturas c
+ USING capturas_dup d
+ WHERE c.id = d.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_capturas_centro_disp_fecha
+    ON capturas (centro_id, COALESCE(dispositivo_id, 0), fecha_reporte);
+
+COMMIT;
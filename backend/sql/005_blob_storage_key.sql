@@ -0,0 +1,9 @@
+-- 005: bytes de imagen fuera de Postgres (BLOB_BACKEND=fs|s3). La fila guarda solo la
+-- clave; `data` queda NULL una vez movido. Las filas con data y sin storage_key siguen
+-- sirviéndose desde la BD hasta que `python -m app.jobs.migrar_blobs` las mueva.
+BEGIN;
+
+ALTER TABLE imagen_blobs      ADD COLUMN IF NOT EXISTS storage_key VARCHAR(200);
+ALTER TABLE imagen_renditions ADD COLUMN IF NOT EXISTS storage_key VARCHAR(200);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- 006: retención de captura_versiones (app.jobs.retencion). compactada_en marca las
+-- versiones ya re-codificadas a calidad de archivo para no volver a procesarlas.
+BEGIN;
+
+ALTER TABLE captura_versiones ADD COLUMN IF NOT EXISTS compactada_en TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS ix_capver_sin_compactar
+    ON captura_versiones (tomada_en) WHERE compactada_en IS NULL;
+
+COMMIT;
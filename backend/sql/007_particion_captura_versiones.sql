@@ -0,0 +1,100 @@
+-- 007: captura_versiones particionada por mes (RANGE sobre tomada_en) + índices BRIN.
+--
+-- La PK pasa a (id, tomada_en): en una tabla particionada toda clave única debe incluir
+-- la columna de partición. Ninguna tabla tiene FK hacia captura_versiones, así que el
+-- cambio es transparente; id sigue saliendo de la misma secuencia.
+--
+-- capturas NO se particiona: captura_versiones.captura_id y ordenes_captura.captura_id
+-- la referencian por id y una FK hacia una tabla particionada exigiría incluir
+-- fecha_reporte en ambas. Solo recibe BRIN sobre created_at / fecha_reporte.
+--
+-- Re-ejecutable: si captura_versiones ya es particionada solo (re)crea la función y los
+-- índices. La copia toma ACCESS EXCLUSIVE sobre la tabla: correr en ventana de
+-- mantenimiento. Las particiones futuras las crea el scheduler (capver_asegurar_particiones).
+BEGIN;
+
+-- crea (si falta) la partición del mes que contiene `mes`: captura_versiones_YYYY_MM
+CREATE OR REPLACE FUNCTION capver_crear_particion(mes date) RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+    desde date := date_trunc('month', mes)::date;
+    hasta date := (date_trunc('month', mes) + interval '1 month')::date;
+    nombre text := format('captura_versiones_%s', to_char(desde, 'YYYY_MM'));
+BEGIN
+    IF to_regclass(nombre) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF captura_versiones FOR VALUES FROM (%L) TO (%L)',
+            nombre, desde, hasta
+        );
+    END IF;
+    RETURN nombre;
+END $$;
+
+-- particiones desde el mes de `desde` hasta `meses` meses después del actual
+CREATE OR REPLACE FUNCTION capver_asegurar_particiones(meses integer, desde date DEFAULT now()::date)
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    m date := date_trunc('month', desde)::date;
+    fin date := (date_trunc('month', now()) + make_interval(months => meses))::date;
+    n integer := 0;
+BEGIN
+    WHILE m <= fin LOOP
+        PERFORM capver_crear_particion(m);
+        n := n + 1;
+        m := (m + interval '1 month')::date;
+    END LOOP;
+    RETURN n;
+END $$;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'captura_versiones'::regclass) = 'p' THEN
+        RAISE NOTICE 'captura_versiones ya está particionada';
+        RETURN;
+    END IF;
+
+    LOCK TABLE captura_versiones IN ACCESS EXCLUSIVE MODE;
+
+    -- la secuencia sobrevive al DROP de la tabla vieja
+    ALTER SEQUENCE captura_versiones_id_seq OWNED BY NONE;
+    ALTER TABLE captura_versiones RENAME TO captura_versiones_old;
+
+    CREATE TABLE captura_versiones (
+        LIKE captura_versiones_old INCLUDING DEFAULTS
+    ) PARTITION BY RANGE (tomada_en);
+
+    -- la PK exige tomada_en NOT NULL; filas legadas sin fecha toman la de la captura
+    UPDATE captura_versiones_old v
+       SET tomada_en = COALESCE(c.created_at, c.fecha_reporte::timestamp, now())
+      FROM capturas c
+     WHERE v.tomada_en IS NULL AND c.id = v.captura_id;
+    UPDATE captura_versiones_old SET tomada_en = now() WHERE tomada_en IS NULL;
+
+    PERFORM capver_asegurar_particiones(
+        3, COALESCE((SELECT min(tomada_en) FROM captura_versiones_old)::date, now()::date)
+    );
+
+    INSERT INTO captura_versiones SELECT * FROM captura_versiones_old;
+    DROP TABLE captura_versiones_old;
+
+    ALTER SEQUENCE captura_versiones_id_seq OWNED BY captura_versiones.id;
+    ALTER TABLE captura_versiones ADD PRIMARY KEY (id, tomada_en);
+    ALTER TABLE captura_versiones
+        ADD FOREIGN KEY (captura_id) REFERENCES capturas(id) ON DELETE CASCADE;
+    ALTER TABLE captura_versiones
+        ADD FOREIGN KEY (blob_hash) REFERENCES imagen_blobs(hash);
+END $$;
+
+-- índices sobre la tabla padre: se propagan a cada partición (también a las futuras)
+CREATE INDEX IF NOT EXISTS ix_capver_captura_fecha ON captura_versiones (captura_id, tomada_en);
+CREATE INDEX IF NOT EXISTS ix_capver_blob_hash ON captura_versiones (blob_hash);
+CREATE INDEX IF NOT EXISTS ix_capver_sin_compactar
+    ON captura_versiones (tomada_en) WHERE compactada_en IS NULL;
+CREATE INDEX IF NOT EXISTS brin_capver_tomada_en ON captura_versiones USING brin (tomada_en);
+
+-- capturas: append-mostly por fecha; BRIN ocupa unas pocas páginas y no frena los INSERT
+CREATE INDEX IF NOT EXISTS brin_capturas_created_at ON capturas USING brin (created_at);
+CREATE INDEX IF NOT EXISTS brin_capturas_fecha_reporte ON capturas USING brin (fecha_reporte);
+
+COMMIT;
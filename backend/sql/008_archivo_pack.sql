@@ -0,0 +1,7 @@
+-- 008: versiones archivadas en packfiles (app.jobs.archivar_packs). Con archivo_pack
+-- los bytes viven en PACK_DIR/{archivo_pack}.pack y blob_hash / imagen_bytes quedan NULL.
+BEGIN;
+
+ALTER TABLE captura_versiones ADD COLUMN IF NOT EXISTS archivo_pack VARCHAR(60);
+
+COMMIT;
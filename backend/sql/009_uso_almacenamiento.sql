@@ -0,0 +1,28 @@
+-- 009: rollup de almacenamiento por (cliente, centro, fecha_reporte). El backend lo
+-- actualiza en cada alta/baja de versión; aquí se crea y se llena desde cero.
+-- Re-ejecutable: rehace el contenido (también sirve para corregir derivas manuales,
+-- igual que `python -m app.jobs.recalcular_uso`).
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS uso_almacenamiento (
+    cliente_id  INTEGER   NOT NULL,
+    centro_id   INTEGER   NOT NULL,
+    fecha       DATE      NOT NULL,
+    versiones   INTEGER   NOT NULL DEFAULT 0,
+    bytes       BIGINT    NOT NULL DEFAULT 0,
+    updated_at  TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (cliente_id, centro_id, fecha)
+);
+
+CREATE INDEX IF NOT EXISTS ix_uso_almacenamiento_fecha ON uso_almacenamiento (fecha);
+CREATE INDEX IF NOT EXISTS ix_uso_almacenamiento_centro_fecha ON uso_almacenamiento (centro_id, fecha);
+
+LOCK TABLE uso_almacenamiento IN EXCLUSIVE MODE;
+DELETE FROM uso_almacenamiento;
+INSERT INTO uso_almacenamiento (cliente_id, centro_id, fecha, versiones, bytes)
+SELECT c.cliente_id, c.centro_id, c.fecha_reporte, count(*), COALESCE(sum(v.peso_bytes), 0)
+  FROM captura_versiones v
+  JOIN capturas c ON c.id = v.captura_id
+ GROUP BY c.cliente_id, c.centro_id, c.fecha_reporte;
+
+COMMIT;
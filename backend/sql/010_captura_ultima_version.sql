@@ -0,0 +1,30 @@
+-- 010: puntero desnormalizado a la última versión de cada captura (app.services.ultima).
+-- El backend lo mantiene en cada alta/baja de versión; aquí se agregan las columnas y
+-- se llenan desde captura_versiones. Re-ejecutable (también corrige derivas, igual que
+-- `python -m app.jobs.rellenar_ultima`, que lo hace por lotes sin un UPDATE gigante).
+BEGIN;
+
+ALTER TABLE capturas ADD COLUMN IF NOT EXISTS ultima_version_id INTEGER;
+ALTER TABLE capturas ADD COLUMN IF NOT EXISTS ultima_tomada_en TIMESTAMP;
+ALTER TABLE capturas ADD COLUMN IF NOT EXISTS version_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE capturas c
+   SET ultima_version_id = u.id,
+       ultima_tomada_en  = u.tomada_en,
+       version_count     = u.n
+  FROM (
+        SELECT DISTINCT ON (captura_id)
+               captura_id, id, tomada_en,
+               count(*) OVER (PARTITION BY captura_id) AS n
+          FROM captura_versiones
+         ORDER BY captura_id, tomada_en DESC, id DESC
+       ) u
+ WHERE u.captura_id = c.id
+   AND (c.ultima_version_id IS DISTINCT FROM u.id OR c.version_count <> u.n);
+
+UPDATE capturas c
+   SET ultima_version_id = NULL, ultima_tomada_en = NULL, version_count = 0
+ WHERE c.version_count <> 0
+   AND NOT EXISTS (SELECT 1 FROM captura_versiones v WHERE v.captura_id = c.id);
+
+COMMIT;